@@ -7,12 +7,23 @@ import numpy as np
 import folium
 from streamlit_folium import st_folium
 from scipy.spatial import ConvexHull
-import matplotlib.colors as mcolors
 import random
+import uuid
 
 # Stellt sicher, dass die Module aus dem src-Ordner gefunden werden
-from src.daten import lade_basis_daten, lade_szenarien_liste, lade_szenario_zuweisung, speichere_szenario
-from src.karten import zeichne_karte
+from src.daten import (lade_basis_daten, lade_szenarien_liste, lade_szenario_zuweisung, speichere_szenario,
+                       basis_daten_version, speicher_status, merke_szenario_basis, merke_zuweisung,
+                       vergiss_letzte_zuweisung, lade_sitzungs_stand, sitzungs_token,
+                       lade_alle_szenario_zuweisungen)
+from src.datenquelle import aktualisiere_basis_daten, letzter_sync_bericht, sheets_metriken, wende_zuweisung_an
+from src.karten import zeichne_karte, farb_zuordnung, ist_rasterkarte
+from src.kacheln import kachel_server
+from src.kunden_index import hole_kunden_index, klick_toleranz_m, MARKER_KLICK_TOLERANZ_M, RASTER_KLICK_ZOOM
+from src.sitzungen import sitzungen, cache_tag, MB
+from src.konfig import ist_admin_modus, IST_ZUSTAND
+from src.besuchsplanung import plane_besuche, wohnorte_je_vertreter, ARBEITSTAGE_PRO_JAHR
+from src.kpi import kennzahlen, bewerte_szenarien, rangfolge, KPI_RICHTUNG
+from src.standortplanung import plane_standorte, als_szenario
 
 # --- 2. SEITEN-KONFIGURATION ---
 st.set_page_config(
@@ -117,6 +128,8 @@ def initialisiere_app_zustand():
     """
     if 'app_initialisiert' not in st.session_state:
         try:
+            # Eindeutig pro Streamlit-Session (mehrere Tabs können dieselbe Sitzungs-ID in der URL haben)
+            sitzungs_token()
             st.session_state.df_basis = lade_basis_daten()
             # Prüfe ob Daten erfolgreich geladen wurden
             if st.session_state.df_basis is None or st.session_state.df_basis.empty:
@@ -124,8 +137,12 @@ def initialisiere_app_zustand():
                 st.session_state.app_initialisiert = False
                 return
             
+            # Version des geteilten Datenstands, auf dem diese Session arbeitet
+            st.session_state.basis_version = basis_daten_version()
             # df_aktuell hält den Zustand der Gebietsverteilung, die angezeigt und bearbeitet wird.
             st.session_state.df_aktuell = st.session_state.df_basis.copy()
+            # Wohnorte eines geladenen Was-wäre-wenn-Szenarios (None = Wohnorte aus den Stammdaten)
+            st.session_state.szenario_wohnorte = None
             st.session_state.app_initialisiert = True
             # Hält die ID des angeklickten Kunden. Startet mit None (keine Auswahl).
             st.session_state.selected_customer_id = None
@@ -134,6 +151,13 @@ def initialisiere_app_zustand():
             st.session_state.selected_vertreter = []
             # Für Undo-Funktionalität
             st.session_state.zuweisung_history = []
+            # Günstiges Versions-Token für Karten- und Index-Caches; steigt bei jeder Änderung an df_aktuell
+            st.session_state.zuweisungs_version = 0
+            # Autosave: Sitzungs-ID in der URL, damit ungespeicherte Änderungen ein Neuladen überstehen
+            if 'sitzung' not in st.query_params:
+                st.query_params['sitzung'] = uuid.uuid4().hex
+            st.session_state.sitzung_id = st.query_params['sitzung']
+            stelle_sitzung_wieder_her()
             
         except Exception as e:
             st.error(f"❌ Fehler beim Laden der Basisdaten: {str(e)}")
@@ -144,6 +168,72 @@ def initialisiere_app_zustand():
             st.session_state.app_initialisiert = False
             return
 
+def hebe_auswahl_auf():
+    """
+    Hebt die Kundenauswahl auf und vergisst den letzten Kartenklick, damit ein erneuter Klick auf
+    denselben Kunden ihn wieder auswählt (die Karte behält ihren Key und meldet den Klick nicht neu).
+    """
+    st.session_state.selected_customer_id = None
+    st.session_state.letzter_karten_klick = None
+
+def erhoehe_zuweisungs_version():
+    """Markiert df_aktuell als geändert, damit abhängige Caches neue Schlüssel verwenden."""
+    st.session_state.zuweisungs_version = st.session_state.get('zuweisungs_version', 0) + 1
+
+def df_fuer_szenario(szenario_name):
+    """
+    Baut die Gebietsverteilung für ein Szenario auf Basis von df_basis auf.
+    Gibt None zurück, wenn das Szenario nicht geladen werden konnte.
+    """
+    if szenario_name == IST_ZUSTAND:
+        return st.session_state.df_basis.copy()
+    neue_zuweisung = lade_szenario_zuweisung(szenario_name)
+    if neue_zuweisung is None:
+        return None
+    return wende_zuweisung_an(st.session_state.df_basis, neue_zuweisung)
+
+def aktuelle_wohnorte():
+    """
+    Wohnort je Vertreter aus den Stammdaten (df_basis), ergänzt um die Wohnorte eines geladenen
+    Was-wäre-wenn-Szenarios. Nie aus den Zeilen von df_aktuell: eine Umverteilung ändert dort nur
+    Vertreter_Name, der Wohnort bleibt der des alten Vertreters.
+    """
+    wohnorte = wohnorte_je_vertreter(st.session_state.df_basis)
+    szenario_wohnorte = st.session_state.get('szenario_wohnorte')
+    if szenario_wohnorte is not None:
+        wohnorte = szenario_wohnorte.combine_first(wohnorte)
+    return wohnorte
+
+def stelle_sitzung_wieder_her():
+    """
+    Stellt Szenario und ungespeicherte Zuweisungen einer früheren Sitzung aus dem lokalen Journal wieder her.
+    """
+    szenario_name, aenderungen = lade_sitzungs_stand(st.session_state.sitzung_id)
+    if szenario_name and szenario_name != IST_ZUSTAND:
+        df_szenario = df_fuer_szenario(szenario_name)
+        if df_szenario is not None:
+            st.session_state.df_aktuell = df_szenario
+    erhoehe_zuweisungs_version()
+    if not aenderungen:
+        return
+
+    # Jeweils die letzte Änderung pro Kunde anwenden (vektorisiert)
+    letzte = {kunden_nr: neuer_vertreter for kunden_nr, _, neuer_vertreter, _ in aenderungen}
+    df_aktuell = st.session_state.df_aktuell
+    maske = df_aktuell['Kunden_Nr'].isin(list(letzte))
+    df_aktuell.loc[maske, 'Vertreter_Name'] = df_aktuell.loc[maske, 'Kunden_Nr'].map(letzte)
+
+    st.session_state.zuweisung_history = [
+        {
+            'kunden_id': int(kunden_nr) if float(kunden_nr).is_integer() else kunden_nr,
+            'alter_vertreter': alter_vertreter,
+            'neuer_vertreter': neuer_vertreter,
+            'timestamp': pd.Timestamp.fromtimestamp(zeitpunkt)
+        }
+        for kunden_nr, alter_vertreter, neuer_vertreter, zeitpunkt in aenderungen[-10:]
+    ]
+    st.toast(f"♻️ {len(aenderungen)} ungespeicherte Änderung(en) wiederhergestellt.")
+
 def kunde_zuweisen(kunden_id, neuer_vertreter):
     """
     Weist einen Kunden einem neuen Vertreter zu und speichert die Änderung für Undo.
@@ -166,6 +256,11 @@ def kunde_zuweisen(kunden_id, neuer_vertreter):
         if len(st.session_state.zuweisung_history) > 10:
             st.session_state.zuweisung_history = st.session_state.zuweisung_history[-10:]
         
+        erhoehe_zuweisungs_version()
+        
+        # Sofort ins lokale Journal, damit die Änderung ein Neuladen der Seite übersteht
+        merke_zuweisung(st.session_state.sitzung_id, kunden_id, alter_vertreter, neuer_vertreter)
+        
         # Update des DataFrames im Session State
         st.session_state.df_aktuell.loc[
             st.session_state.df_aktuell['Kunden_Nr'] == kunden_id,
@@ -188,6 +283,8 @@ def undo_letzte_zuweisung():
             st.session_state.df_aktuell['Kunden_Nr'] == letzte_aenderung['kunden_id'],
             'Vertreter_Name'
         ] = letzte_aenderung['alter_vertreter']
+        erhoehe_zuweisungs_version()
+        vergiss_letzte_zuweisung(st.session_state.sitzung_id)
         
         return True
     return False
@@ -274,6 +371,12 @@ if st.session_state.user_is_logged_in:
 
     # Der angezeigte DataFrame ist immer der, der im Session State gespeichert ist
     df = st.session_state.df_aktuell
+    # Speicherbuchführung: Session als aktiv markieren, Budgets durchsetzen, inaktive Sessions aufräumen
+    sitzungen.beruehre(
+        st.session_state.cache_token,
+        df_aktuell=df,
+        zuweisung_history=st.session_state.zuweisung_history
+    )
     
     # --- SEITENLEISTE (Sidebar) ---
     with st.sidebar:
@@ -282,6 +385,9 @@ if st.session_state.user_is_logged_in:
         # Logout-Button
         if st.button("🚪 Abmelden", type="secondary"):
             st.session_state.user_is_logged_in = False
+            # Gecachte Karten, SQLite-Verbindung und temporäre Datei dieser Session freigeben
+            if 'cache_token' in st.session_state:
+                sitzungen.beende_sitzung(st.session_state.cache_token)
             # Session State zurücksetzen
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
@@ -300,7 +406,7 @@ if st.session_state.user_is_logged_in:
                     st.warning("Keine Änderung zum Rückgängigmachen verfügbar.")
             
             if col2.button("🗑️ Auswahl löschen"):
-                st.session_state.selected_customer_id = None
+                hebe_auswahl_auf()
                 st.rerun()
         
         st.info("👆 **Anleitung:** Klicken Sie auf einen Kundenpunkt auf der Karte, um ihn einem neuen Vertreter zuzuweisen.")
@@ -312,20 +418,59 @@ if st.session_state.user_is_logged_in:
             for i, aenderung in enumerate(reversed(st.session_state.zuweisung_history[-3:]), 1):
                 st.markdown(f"{i}. Kunde {aenderung['kunden_id']}: {aenderung['alter_vertreter']} → {aenderung['neuer_vertreter']}")
 
+        st.markdown("---")
+        st.header("Basisdaten")
+        sync_bericht = letzter_sync_bericht()
+        if sync_bericht is not None:
+            st.caption(f"Letzter Abgleich: {sync_bericht.zusammenfassung()}")
+        if basis_daten_version() != st.session_state.basis_version:
+            st.info("🆕 Neuere Basisdaten verfügbar. Laden Sie den IST-Zustand neu, um sie zu übernehmen.")
+        if st.button("🔄 Basisdaten aktualisieren", help="Lädt die Stammdaten im Hintergrund neu aus Google Sheets"):
+            if aktualisiere_basis_daten():
+                st.toast("Aktualisierung der Basisdaten gestartet.")
+            else:
+                st.toast("Aktualisierung läuft bereits.")
+        with st.expander("📊 Google Sheets API-Statistik"):
+            metriken = sheets_metriken()
+            if metriken['operationen']:
+                st.dataframe(pd.DataFrame(metriken['operationen']).T[
+                    ['anfragen', 'fehler', 'wiederholungen', 'latenz_mittel', 'latenz_max']
+                ].round(3))
+                st.caption(f"Durch Rate-Limit gewartet: {metriken['gedrosselt_sekunden']:.1f}s")
+            else:
+                st.caption("Noch keine Anfragen.")
+        if ist_admin_modus():
+            with st.expander("🧠 Speicherbelegung"):
+                belegung = sitzungen.belegung()
+                st.caption(
+                    f"{belegung['gesamt'] / MB:.0f} MB von {sitzungen.gesamt_budget / MB:.0f} MB "
+                    f"({belegung['sitzungen']} Session(s), Budget je Session {sitzungen.sitzung_budget / MB:.0f} MB)"
+                )
+                st.caption(
+                    f"Basisdaten {belegung['geteilt'] / MB:.1f} MB · Zustand {belegung['zustand'] / MB:.1f} MB · "
+                    f"Karten {belegung['karten'] / MB:.1f} MB · Datenbanken {belegung['datenbank'] / MB:.1f} MB"
+                )
+                st.dataframe(pd.DataFrame(sitzungen.uebersicht()), hide_index=True, use_container_width=True)
+
         st.markdown("---")
         st.header("Szenario Management")
         szenarien_liste = lade_szenarien_liste()
-        geladenes_szenario = st.selectbox("Szenario laden:", options=['Aktueller IST-Zustand'] + szenarien_liste, key="szenario_laden")
+        geladenes_szenario = st.selectbox("Szenario laden:", options=[IST_ZUSTAND] + szenarien_liste, key="szenario_laden")
 
         if st.button("Ausgewähltes Szenario laden"):
-            if geladenes_szenario == 'Aktueller IST-Zustand':
-                st.session_state.df_aktuell = st.session_state.df_basis.copy()
-            else:
-                neue_zuweisung = lade_szenario_zuweisung(geladenes_szenario)
-                if neue_zuweisung is not None:
-                    basis_copy = st.session_state.df_basis.copy().set_index('Kunden_Nr')
-                    basis_copy.update(neue_zuweisung)
-                    st.session_state.df_aktuell = basis_copy.reset_index()
+            # Neuesten geteilten Datenstand übernehmen (sofort, ohne auf Google Sheets zu warten)
+            if basis_daten_version() != st.session_state.basis_version:
+                neue_basis = lade_basis_daten()
+                if not neue_basis.empty:
+                    st.session_state.df_basis = neue_basis
+                    st.session_state.basis_version = basis_daten_version()
+            df_szenario = df_fuer_szenario(geladenes_szenario)
+            if df_szenario is not None:
+                st.session_state.df_aktuell = df_szenario
+                st.session_state.szenario_wohnorte = None
+                st.session_state.zuweisung_history = []
+                erhoehe_zuweisungs_version()
+                merke_szenario_basis(st.session_state.sitzung_id, geladenes_szenario)
             st.toast(f"Szenario '{geladenes_szenario}' geladen!")
             st.rerun()
 
@@ -338,6 +483,56 @@ if st.session_state.user_is_logged_in:
                     st.toast(f"Szenario '{neuer_szenario_name}' erfolgreich gespeichert!")
             else:
                 st.warning("Bitte einen Namen für das Szenario eingeben.")
+        status = speicher_status()
+        if status['offen']:
+            st.caption(f"⏳ {status['offen']} Szenario(s) werden im Hintergrund nach Google Sheets geschrieben.")
+            if status['letzter_fehler']:
+                st.caption(f"Letzter Fehler (wird erneut versucht): {status['letzter_fehler']}")
+
+        st.markdown("---")
+        st.header("Standortplanung")
+        with st.expander("📍 Wohnorte für neue oder umziehende Vertreter"):
+            # Aus den Stammdaten: umverteilte Kundenzeilen tragen noch den Wohnort des alten Vertreters
+            wohnorte = aktuelle_wohnorte()
+            umziehende = st.multiselect("Umziehende Vertreter:", options=sorted(df['Vertreter_Name'].unique()),
+                                        help="Alle anderen Vertreter behalten ihren Wohnort.")
+            neue_vertreter = st.number_input("Neue Vertreter:", min_value=0, max_value=50, value=1, step=1)
+            standort_starts = st.slider("Starts der lokalen Suche:", min_value=2, max_value=32, value=8,
+                                        help="Mehr Starts finden eher die beste Lösung, dauern aber länger.")
+            if st.button("Standorte berechnen"):
+                freie = list(umziehende) + [f"Neu {i + 1}" for i in range(int(neue_vertreter))]
+                feste = {name: (zeile.Wohnort_Lat, zeile.Wohnort_Lon)
+                         for name, zeile in wohnorte.iterrows() if name not in umziehende}
+                try:
+                    with st.spinner("Suche Standorte..."):
+                        st.session_state.standort_loesung = plane_standorte(
+                            df, feste, freie, starts=standort_starts, wohnorte=wohnorte,
+                            max_worker=1  # im App-Prozess; parallele Starts nur über die CLI
+                        )
+                except Exception as e:
+                    st.error(f"Standortplanung fehlgeschlagen: {e}")
+            loesung = st.session_state.get('standort_loesung')
+            if loesung is not None:
+                st.caption(
+                    f"Ø Luftlinie (umsatzgewichtet): {loesung.kosten / max(df['Umsatz_2024'].clip(lower=0).sum(), 1):.1f} km "
+                    f"· {loesung.starts} Starts in {loesung.dauer:.1f}s"
+                )
+                st.dataframe(
+                    loesung.standorte[~loesung.standorte['Fest']].drop(columns='Fest').round(4),
+                    hide_index=True, use_container_width=True
+                )
+                if st.button("Als Was-wäre-wenn-Szenario laden",
+                             help="Jeder Kunde geht an den nächstgelegenen Wohnort; speichern wie jedes Szenario."):
+                    st.session_state.df_aktuell = als_szenario(df, loesung)
+                    st.session_state.szenario_wohnorte = loesung.standorte.set_index('Vertreter_Name')[
+                        ['Wohnort_Lat', 'Wohnort_Lon']]
+                    st.session_state.zuweisung_history = []
+                    erhoehe_zuweisungs_version()
+                    # Wohnorte sind nicht Teil des Journals: ein Neuladen der Seite startet wieder beim IST-Zustand
+                    merke_szenario_basis(st.session_state.sitzung_id, IST_ZUSTAND)
+                    st.session_state.standort_loesung = None
+                    st.toast("Was-wäre-wenn-Szenario geladen.")
+                    st.rerun()
         
 
 
@@ -375,17 +570,94 @@ if st.session_state.user_is_logged_in:
     )
     st.session_state.selected_vertreter = selected_vertreter
 
+    kartenmodus_optionen = {'Automatisch': 'auto', 'Einzelne Punkte': 'vektor', 'Rasterkacheln': 'raster',
+                            'Ebenen (Filter in der Karte)': 'ebenen'}
+    if not kachel_server.verfuegbar:
+        # Rasterkacheln nur mit einer vom Browser erreichbaren Kachel-URL (GEBIETSPLANER_KACHEL_URL)
+        del kartenmodus_optionen['Rasterkacheln']
+    kartenmodus = kartenmodus_optionen[st.sidebar.radio(
+        'Kartendarstellung:',
+        options=list(kartenmodus_optionen),
+        help=("Rasterkacheln werden serverseitig erzeugt und bleiben auch bei sehr vielen Kunden flüssig. "
+              if kachel_server.verfuegbar else "")
+             + "Bei Ebenen wird die Karte nur einmal übertragen; Verlag und Vertreter werden direkt in der Karte "
+               "ohne Neuladen gefiltert."
+    )]
+    if kartenmodus == 'ebenen':
+        st.sidebar.caption("ℹ️ Die Filter oben wirken auf das Dashboard; die Karte filtern Sie oben rechts in der Karte.")
+
     df_filtered_display = df[df['Vertreter_Name'].isin(selected_vertreter)]
     if selected_verlag != 'Alle Verlage':
         df_filtered_display = df_filtered_display[df_filtered_display['Verlag'] == selected_verlag]
 
     # --- DASHBOARD-ANZEIGE ---
     st.subheader(f"Analyse für: {geladenes_szenario}")
+    werte = kennzahlen(df_filtered_display)
     col1, col2, col3 = st.columns(3)
-    col1.metric("Anzahl Vertreter", df_filtered_display['Vertreter_Name'].nunique())
-    col2.metric("Anzahl Kunden", f"{len(df_filtered_display):,}".replace(',', '.'))
-    col3.metric("Jahresumsatz 2024", f"{int(df_filtered_display['Umsatz_2024'].sum()):,} €".replace(',', '.'))
+    col1.metric("Anzahl Vertreter", werte['Vertreter'])
+    col2.metric("Anzahl Kunden", f"{werte['Kunden']:,}".replace(',', '.'))
+    col3.metric("Jahresumsatz 2024", f"{int(werte['Umsatz_2024']):,} €".replace(',', '.'))
+
+    # --- BESUCHSPLANUNG / AUSLASTUNG ---
+    with st.expander("📅 Besuchsplanung & Auslastung"):
+        # OPTIMIERT: Nur auf Wunsch rechnen, im App-Prozess (kein Prozess-Pool) und je Datenstand nur einmal
+        if st.toggle("Auslastung berechnen", key="besuchsplanung_aktiv"):
+            plan_schluessel = (st.session_state.zuweisungs_version, st.session_state.basis_version)
+            gemerkt = st.session_state.get('besuchsplan')
+            if gemerkt is None or gemerkt[0] != plan_schluessel:
+                with st.spinner("Plane Besuche..."):
+                    # Umsatzklassen über alle Kunden, geplant wird je Vertreter (gecacht pro Gebietsstand)
+                    besuchs_uebersicht, _ = plane_besuche(df, wohnorte=aktuelle_wohnorte())
+                st.session_state.besuchsplan = (plan_schluessel, besuchs_uebersicht)
+            besuchs_uebersicht = st.session_state.besuchsplan[1]
+            if not besuchs_uebersicht.empty:
+                angezeigt = besuchs_uebersicht[besuchs_uebersicht['Vertreter_Name'].isin(selected_vertreter)]
+                ueberlastet = angezeigt[angezeigt['Auslastung'] > 1.0]
+                if not ueberlastet.empty:
+                    st.warning(
+                        f"⚠️ {len(ueberlastet)} Gebiet(e) nicht in {ARBEITSTAGE_PRO_JAHR} Arbeitstagen bedienbar: "
+                        + ", ".join(f"{row.Vertreter_Name} ({row.Auslastung:.0%})" for row in ueberlastet.itertuples())
+                    )
+                st.caption(f"Besuche pro Jahr nach Umsatzklasse, Tourentage bei {ARBEITSTAGE_PRO_JAHR} Arbeitstagen.")
+                st.dataframe(
+                    angezeigt.style.format({'Auslastung': '{:.0%}', 'km_pro_Jahr': '{:,.0f}', 'km_pro_Tag': '{:.0f}'}),
+                    use_container_width=True,
+                    hide_index=True
+                )
     
+    # --- SZENARIO-VERGLEICH ---
+    with st.expander("🏆 Szenario-Vergleich"):
+        vergleich_auswahl = st.multiselect(
+            "Szenarien:", options=szenarien_liste, default=szenarien_liste,
+            help="Alle Szenarien werden mit einer Anfrage geladen und gemeinsam bewertet; "
+                 "unveränderte Szenarien kommen aus dem Cache."
+        )
+        if st.button("Szenarien bewerten"):
+            zuweisungen = lade_alle_szenario_zuweisungen(vergleich_auswahl)
+            if zuweisungen is not None:
+                with st.spinner("Bewerte Szenarien..."):
+                    st.session_state.szenario_bewertung = bewerte_szenarien(
+                        st.session_state.df_basis, zuweisungen,
+                        max_worker=1  # im App-Prozess; den Prozess-Pool nutzt nur die CLI
+                    )
+        bewertung = st.session_state.get('szenario_bewertung')
+        if bewertung is not None:
+            kennzahl = st.selectbox(
+                "Rangfolge nach:", options=[k for k in bewertung.columns if k in KPI_RICHTUNG or k.startswith('Abdeckung')],
+                format_func=lambda k: f"{k} ({'höher' if KPI_RICHTUNG.get(k, True) else 'niedriger'} ist besser)"
+            )
+            st.caption(
+                "Umsatz_Gini: Ungleichverteilung des Umsatzes über die Vertreter · km: Luftlinie Kunde–Wohnort · "
+                "Abdeckung: Umsatzanteil im Umkreis des Wohnorts"
+            )
+            st.dataframe(
+                rangfolge(bewertung, kennzahl).style.format(
+                    {k: '{:.0%}' for k in bewertung.columns if k.startswith('Abdeckung')}
+                ),
+                use_container_width=True,
+                hide_index=True
+            )
+
     # --- KUNDEN-ZUWEISUNG FENSTER (über der Karte) ---
     if st.session_state.selected_customer_id:
         # Zeige ausgewählten Kunden an
@@ -415,7 +687,7 @@ if st.session_state.user_is_logged_in:
                 st.markdown("### 🎯 Kunden-Zuweisung")
             with col2:
                 if st.button("❌ Schließen", key="close_modal"):
-                    st.session_state.selected_customer_id = None
+                    hebe_auswahl_auf()
                     st.rerun()  # Nur hier für UI-Update
             
             st.markdown("---")
@@ -430,6 +702,9 @@ if st.session_state.user_is_logged_in:
             with col2:
                 st.markdown(f"**👨‍💼 Aktueller Vertreter:** {selected_customer_data['Vertreter_Name']}")
                 st.markdown(f"**📍 Koordinaten:** {selected_customer_data['Latitude']:.4f}, {selected_customer_data['Longitude']:.4f}")
+                praezision = selected_customer_data.get('Koordinaten_Praezision', 'original')
+                if praezision in ('plz', 'ort'):
+                    st.caption(f"⚠️ Koordinaten angenähert über {'PLZ' if praezision == 'plz' else 'Ort'}-Zentroid")
             
             st.markdown("---")
             
@@ -456,18 +731,18 @@ if st.session_state.user_is_logged_in:
                     if st.button("✅ Bestätigen", type="primary", key="confirm_assignment"):
                         if kunde_zuweisen(st.session_state.selected_customer_id, neuer_vertreter):
                             st.toast(f"✅ Kunde erfolgreich zu {neuer_vertreter} verschoben!")
-                            st.session_state.selected_customer_id = None
+                            hebe_auswahl_auf()
                             st.rerun()  # Nur hier für Karten-Update nach Zuweisung
                         else:
                             st.error("Die Zuweisung konnte nicht durchgeführt werden.")
                 with col2:
                     if st.button("❌ Abbrechen", key="cancel_assignment"):
-                        st.session_state.selected_customer_id = None
+                        hebe_auswahl_auf()
                         st.rerun()  # Nur hier für UI-Update
                     
                 with col3:
                     if st.button("🔄 Anderen Kunden wählen", key="select_other"):
-                        st.session_state.selected_customer_id = None
+                        hebe_auswahl_auf()
                         st.rerun()  # Nur hier für UI-Update
             else:
                 st.info("ℹ️ Wählen Sie einen anderen Vertreter aus, um die Zuweisung zu ändern.")
@@ -478,41 +753,51 @@ if st.session_state.user_is_logged_in:
             st.error("❌ Der ausgewählte Kunde konnte nicht gefunden werden.")
             if st.button("Seite neu laden"):
                 st.rerun()
-            st.session_state.selected_customer_id = None
+            hebe_auswahl_auf()
     
     st.subheader("Gebietskarte")
     
 
     
-    # OPTIMIERT: Karte neu rendern wenn sich Daten oder Kundenauswahl geändert haben
-    current_data_hash = hash(str(df_filtered_display[['Kunden_Nr', 'Vertreter_Name']].values.tobytes()))
-    current_selection_hash = hash(str(st.session_state.selected_customer_id))
-    combined_hash = hash(str(current_data_hash) + str(current_selection_hash))
-    
-    # Neu rendern wenn sich Daten oder Kundenauswahl geändert haben
-    if ('last_karte_data_hash' not in st.session_state or 
-        st.session_state.last_karte_data_hash != combined_hash):
-        
-        vertreter_liste = sorted(df['Vertreter_Name'].unique())
-        palette = list(mcolors.TABLEAU_COLORS.values()) + list(mcolors.CSS4_COLORS.values())
-        farb_map = {name: palette[i % len(palette)] for i, name in enumerate(vertreter_liste)}
-        
-        karte_obj = zeichne_karte(df_filtered_display, farb_map, st.session_state.selected_customer_id)
-        
-        # Speichere aktuelle Daten für nächsten Vergleich
-        st.session_state.last_karte_data_hash = combined_hash
-        st.session_state.cached_karte = karte_obj
+    # OPTIMIERT: Karten-Cache über Versions-Tokens statt über einen Hash der gefilterten Daten
+    if kartenmodus == 'ebenen':
+        # Alle Kunden in Ebenen: Karte hängt nicht von den Filtern ab, Filterwechsel treffen den Cache
+        df_karte = df
+        filter_schluessel = ('ebenen',)
     else:
-        # Verwende gecachte Karte
-        karte_obj = st.session_state.cached_karte
+        df_karte = df_filtered_display
+        filter_schluessel = (selected_verlag, tuple(sorted(selected_vertreter)))
+    versions_schluessel = (
+        st.session_state.cache_token,
+        st.session_state.zuweisungs_version,
+        st.session_state.basis_version,
+        filter_schluessel
+    )
+    # Schlüssel für Rasterkacheln und Klick-Index: Zuweisungsstand + Filter, unabhängig von der Kundenauswahl
+    kachel_schluessel = f"{hash(versions_schluessel) & 0xFFFFFFFFFFFF:x}"
+
+    farb_map = farb_zuordnung(df['Vertreter_Name'].unique())
+    
+    karte_obj = zeichne_karte(
+        df_karte, farb_map, st.session_state.selected_customer_id,
+        modus=kartenmodus, kachel_schluessel=kachel_schluessel,
+        cache_schluessel=versions_schluessel,
+        cache_tags=(cache_tag(st.session_state.cache_token),)
+    )
 
     # Karten-Interaktion für Kundenauswahl
+    # OPTIMIERT: Nur Klicks lösen einen Rerun aus, Verschieben und Zoomen bleiben im Browser.
+    # Rasterkacheln haben keine Marker, dort zählt der Klick auf die Kartenposition.
+    klick_feld = 'last_clicked' if ist_rasterkarte(df_karte, kartenmodus, kachel_schluessel) else 'last_object_clicked'
+    # Marker-Klicks werden mitgezählt: ein erneuter Klick auf denselben Marker ist damit ein neuer Wert
+    zaehler_feld = 'last_object_clicked_count' if klick_feld == 'last_object_clicked' else None
     map_data = st_folium(
         karte_obj, 
         width='100%', 
         height=700, 
-        returned_objects=['last_object_clicked_popup'],
-        key=f"map_{st.session_state.selected_customer_id}"  # Unique key für bessere Interaktion
+        returned_objects=[klick_feld] + ([zaehler_feld] if zaehler_feld else []),
+        # Fester Key: eine Kundenauswahl aktualisiert die Karte, statt die Komponente neu aufzubauen
+        key="gebietskarte"
     )
 
     # OPTIMIERT: Kundenauswahl über Suchfeld und Dropdown
@@ -581,23 +866,22 @@ if st.session_state.user_is_logged_in:
     else:
         st.info("Keine Kunden zum Anzeigen verfügbar.")
     
-    # OPTIMIERT: Karten-Klick-Interaktion
-    if map_data and map_data.get("last_object_clicked_popup"):
-        popup_text = map_data["last_object_clicked_popup"]
-        
-        # Extrahiere Kunden-ID aus dem Popup-Text
-        try:
-            if "ID:" in popup_text:
-                # Behandle sowohl <br> als auch \n Zeilenumbrüche
-                lines = popup_text.replace("<br>", "\n").split("\n")
-                for line in lines:
-                    if "ID:" in line:
-                        id_text = line.replace("ID:", "").strip()
-                        clicked_id = int(id_text)
-                        if st.session_state.selected_customer_id != clicked_id:
-                            st.session_state.selected_customer_id = clicked_id
-                            st.toast(f"✅ Kunde {clicked_id} ausgewählt!")
-                            st.rerun()  # Wichtig: Rerun für sofortige Anzeige des Dialogs
-                        break
-        except (ValueError, IndexError, AttributeError):
-            pass
\ No newline at end of file
+    # OPTIMIERT: Karten-Klick-Interaktion über Klick-Koordinaten und KD-Baum statt Popup-Text
+    klick = (map_data or {}).get(klick_feld)
+    klick_zustand = (klick, (map_data or {}).get(zaehler_feld) if zaehler_feld else None)
+    # st_folium liefert den letzten Klick bei jedem Rerun erneut: nur einen neuen Klick auswerten
+    if klick and klick.get("lat") is not None and klick_zustand != st.session_state.get('letzter_karten_klick'):
+        st.session_state.letzter_karten_klick = klick_zustand
+        if len(df_karte) > 0:
+            kunden_index = hole_kunden_index(kachel_schluessel, df_karte)
+            if klick_feld == 'last_object_clicked':
+                # Marker-Klick liefert die exakten Marker-Koordinaten
+                toleranz = MARKER_KLICK_TOLERANZ_M
+            else:
+                # Ohne Zoomstufe (sie löst bewusst keinen Rerun aus) gilt die Toleranz einer Übersichtskarte
+                toleranz = klick_toleranz_m(klick["lat"], RASTER_KLICK_ZOOM)
+            clicked_id = kunden_index.naechster_kunde(klick["lat"], klick["lng"], max_distanz_m=toleranz)
+            if clicked_id is not None and st.session_state.selected_customer_id != clicked_id:
+                st.session_state.selected_customer_id = clicked_id
+                st.toast(f"✅ Kunde {clicked_id} ausgewählt!")
+                st.rerun()  # Wichtig: Rerun für sofortige Anzeige des Dialogs
@@ -0,0 +1,127 @@
+# basis_cache.py
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class BasisDatenCache:
+    """
+    Prozessweiter Cache für die Basisdaten nach dem Prinzip "stale-while-revalidate".
+
+    Alle Sessions bekommen sofort den letzten erfolgreich geladenen Datenstand.
+    Ist dieser älter als `max_alter` Sekunden, wird im Hintergrund neu geladen
+    und der neue Stand atomar ausgetauscht. Nur der allererste Aufruf blockiert.
+
+    Args:
+        lade_funktion: Funktion ohne Argumente, die einen DataFrame liefert oder eine Exception wirft.
+            Liefert sie dasselbe Objekt wie zuletzt, gilt der Stand als unverändert (keine neue Version).
+        max_alter: Sekunden, nach denen der Datenstand als veraltet gilt
+        bei_neuer_version: Optionaler Callback(version), der nach jedem Austausch aufgerufen wird
+    """
+
+    def __init__(self, lade_funktion, max_alter=7200, bei_neuer_version=None):
+        self._lade_funktion = lade_funktion
+        self.max_alter = max_alter
+        self._bei_neuer_version = bei_neuer_version
+        # (daten, version, geladen_um) - wird immer als Ganzes ersetzt
+        self._stand = None
+        self._version = 0
+        self._lade_lock = threading.Lock()
+        # Schützt Prüfen-und-Starten der Threads, damit parallele Sessions nur einen starten
+        self._thread_lock = threading.Lock()
+        self._hintergrund_thread = None
+        self._zeitplan_thread = None
+        self.letzter_fehler = None
+
+    @property
+    def version(self):
+        """Versionsnummer des aktuellen Datenstands (0 = noch nichts geladen)."""
+        stand = self._stand
+        return stand[1] if stand else 0
+
+    @property
+    def geladen_um(self):
+        """Zeitpunkt (time.time()) des aktuellen Datenstands oder None."""
+        stand = self._stand
+        return stand[2] if stand else None
+
+    def ist_veraltet(self):
+        stand = self._stand
+        return stand is None or time.time() - stand[2] > self.max_alter
+
+    def hole(self):
+        """
+        Gibt den aktuellen Datenstand zurück.
+        Blockiert nur, solange noch nie erfolgreich geladen wurde.
+        """
+        stand = self._stand
+        if stand is None:
+            with self._lade_lock:
+                # Ein anderer Thread könnte inzwischen geladen haben
+                if self._stand is None:
+                    self._lade_und_tausche()
+            stand = self._stand
+        elif self.ist_veraltet():
+            self.aktualisiere_im_hintergrund()
+        return stand[0]
+
+    def aktualisiere(self):
+        """Lädt synchron neu. Gibt True zurück, wenn ein neuer (geänderter) Stand übernommen wurde."""
+        with self._lade_lock:
+            try:
+                return self._lade_und_tausche()
+            except Exception as e:
+                self.letzter_fehler = e
+                logger.warning("Aktualisierung der Basisdaten fehlgeschlagen: %s", e)
+                return False
+
+    def aktualisiere_im_hintergrund(self):
+        """
+        Startet eine Aktualisierung in einem Hintergrund-Thread.
+        Gibt False zurück, wenn bereits eine Aktualisierung läuft.
+        """
+        with self._thread_lock:
+            thread = self._hintergrund_thread
+            if thread is not None and thread.is_alive():
+                return False
+            thread = threading.Thread(target=self.aktualisiere, name="basisdaten-refresh", daemon=True)
+            self._hintergrund_thread = thread
+            thread.start()
+            return True
+
+    def starte_zeitplan(self, intervall=None):
+        """Startet (einmalig) einen Daemon-Thread, der die Daten periodisch aktualisiert."""
+        intervall = intervall or self.max_alter
+
+        def _schleife():
+            while True:
+                time.sleep(intervall)
+                self.aktualisiere()
+
+        with self._thread_lock:
+            if self._zeitplan_thread is not None and self._zeitplan_thread.is_alive():
+                return
+            self._zeitplan_thread = threading.Thread(target=_schleife, name="basisdaten-zeitplan", daemon=True)
+            self._zeitplan_thread.start()
+
+    def _lade_und_tausche(self):
+        # Muss mit gehaltenem _lade_lock aufgerufen werden
+        daten = self._lade_funktion()
+        if daten is None or daten.empty:
+            raise ValueError("Leerer Datenstand erhalten")
+        stand = self._stand
+        if stand is not None and daten is stand[0]:
+            # Unverändert: nur den Zeitstempel erneuern
+            self._stand = (daten, stand[1], time.time())
+            self.letzter_fehler = None
+            return False
+        self._version += 1
+        # Atomarer Austausch: Leser sehen entweder den alten oder den neuen Stand
+        self._stand = (daten, self._version, time.time())
+        self.letzter_fehler = None
+        if self._bei_neuer_version is not None:
+            self._bei_neuer_version(self._version)
+        return True
@@ -0,0 +1,223 @@
+# besuchsplanung.py
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.cache import VersionsCache
+
+# Besuchsfrequenz nach Umsatzklasse: (Mindest-Perzentil des Umsatzes, Klasse, Besuche pro Jahr)
+BESUCHS_STUFEN = [(0.8, 'A', 12), (0.5, 'B', 6), (0.0, 'C', 2)]
+ARBEITSTAGE_PRO_JAHR = 210
+MAX_BESUCHE_PRO_TAG = 8
+MAX_KM_PRO_TAG = 350.0
+# Straßen sind länger als die Luftlinie
+UMWEGFAKTOR = 1.3
+# Unterhalb dieser Vertreteranzahl lohnt sich kein Prozess-Pool
+MIN_VERTRETER_PARALLEL = 8
+# Obergrenze für Pool-Prozesse, auch wenn mehr angefordert werden (geteilte Hosts)
+MAX_POOL_WORKER = 4
+
+# Eigener Cache, damit viele Vertreter-Einträge keine Karten aus dem allgemeinen Cache verdrängen
+_plan_cache = VersionsCache(max_eintraege=2000)
+
+
+def _haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * np.arcsin(np.sqrt(a))
+
+
+def besuchs_frequenzen(dataframe):
+    """Ordnet jedem Kunden anhand des Umsatz-Perzentils eine Klasse und Besuche pro Jahr zu."""
+    perzentil = dataframe['Umsatz_2024'].fillna(0).rank(pct=True, method='max')
+    klasse = pd.Series(BESUCHS_STUFEN[-1][1], index=dataframe.index)
+    besuche = pd.Series(BESUCHS_STUFEN[-1][2], index=dataframe.index)
+    for grenze, name, anzahl in reversed(BESUCHS_STUFEN[:-1]):
+        maske = perzentil > grenze
+        klasse[maske] = name
+        besuche[maske] = anzahl
+    return klasse, besuche
+
+
+class _Tour:
+    """
+    Geschlossene Tour ab Wohnort, die per günstigster Einfügung wächst.
+    Kantenlängen werden in festen Puffern mitgeführt: eine Einfügung kostet eine Distanzberechnung
+    über die Tour statt einer neuen Tour.
+    """
+
+    def __init__(self, heim_lat, heim_lon, kapazitaet=MAX_BESUCHE_PRO_TAG):
+        self.lat = np.full(kapazitaet + 2, heim_lat, dtype=float)
+        self.lon = np.full(kapazitaet + 2, heim_lon, dtype=float)
+        self.kanten = np.zeros(kapazitaet + 1)
+        self.punkte = 2  # Wohnort am Anfang und am Ende
+        self.km = 0.0
+
+    def einfuegung(self, lat, lon):
+        """Gibt (Mehr-km Luftlinie, Kante, Distanzen zu allen Tourpunkten) für einen neuen Punkt zurück."""
+        n = self.punkte
+        distanzen = _haversine_km(self.lat[:n], self.lon[:n], lat, lon)
+        delta = distanzen[:-1] + distanzen[1:] - self.kanten[:n - 1]
+        i = int(np.argmin(delta))
+        return float(delta[i]), i, distanzen
+
+    def fuege_ein(self, lat, lon, einfuegung):
+        delta, i, distanzen = einfuegung
+        n = self.punkte
+        # Kante i (Punkt i -> i+1) wird durch zwei Kanten über den neuen Punkt ersetzt
+        self.lat[i + 2:n + 1] = self.lat[i + 1:n]
+        self.lon[i + 2:n + 1] = self.lon[i + 1:n]
+        self.lat[i + 1], self.lon[i + 1] = lat, lon
+        self.kanten[i + 2:n] = self.kanten[i + 1:n - 1]
+        self.kanten[i], self.kanten[i + 1] = distanzen[i], distanzen[i + 1]
+        self.punkte += 1
+        self.km += delta
+
+
+def plane_vertreter(auftrag):
+    """
+    Packt die Besuche eines Vertreters in Tourentage.
+
+    Kunden gleicher Frequenz werden reihum nach ihrem Winkel zum Wohnort (Sweep) zu Tagesclustern
+    gebündelt, bis Besuchs- oder Kilometergrenze erreicht ist (Tourlänge per günstigster
+    Einfügung, in Straßen-km geschätzt); jedes Cluster wird so oft
+    gefahren, wie seine Frequenz verlangt. Top-Level-Funktion, damit sie im Prozess-Pool läuft.
+
+    Args:
+        auftrag: Dict mit vertreter, heim_lat, heim_lon, kunden_nr, lat, lon, besuche
+    Returns:
+        Dict mit Kennzahlen und den Tagesclustern
+    """
+    heim_lat, heim_lon = auftrag['heim_lat'], auftrag['heim_lon']
+    lat = np.asarray(auftrag['lat'], dtype=float)
+    lon = np.asarray(auftrag['lon'], dtype=float)
+    besuche = np.asarray(auftrag['besuche'], dtype=int)
+    kunden_nr = np.asarray(auftrag['kunden_nr'])
+
+    winkel = np.arctan2(lat - heim_lat, (lon - heim_lon) * np.cos(np.radians(heim_lat)))
+    heim_km = _haversine_km(heim_lat, heim_lon, lat, lon)
+    cluster = []
+    for frequenz in sorted(set(besuche.tolist()), reverse=True):
+        indizes = np.where(besuche == frequenz)[0]
+        indizes = indizes[np.argsort(winkel[indizes])]
+        # Tour des aktuellen Tages wird per günstigster Einfügung fortgeschrieben, nicht neu berechnet
+        aktuell, tour = [], _Tour(heim_lat, heim_lon)
+        for i in indizes:
+            if len(aktuell) == MAX_BESUCHE_PRO_TAG:
+                einfuegung = None
+            else:
+                einfuegung = tour.einfuegung(lat[i], lon[i])
+            if aktuell and (einfuegung is None or (tour.km + einfuegung[0]) * UMWEGFAKTOR > MAX_KM_PRO_TAG):
+                cluster.append((frequenz, aktuell, tour.km))
+                aktuell, tour = [], _Tour(heim_lat, heim_lon)
+                # Erster Kunde eines Tages: hin und zurück
+                einfuegung = (2 * heim_km[i], 0, np.array([heim_km[i], heim_km[i]]))
+            aktuell.append(i)
+            tour.fuege_ein(lat[i], lon[i], einfuegung)
+        if aktuell:
+            cluster.append((frequenz, aktuell, tour.km))
+
+    tage = []
+    tourentage = 0
+    km_pro_jahr = 0.0
+    for frequenz, mitglieder, luftlinie_km in cluster:
+        km = luftlinie_km * UMWEGFAKTOR
+        tourentage += frequenz
+        km_pro_jahr += km * frequenz
+        tage.append({'frequenz': frequenz, 'kunden_nr': kunden_nr[mitglieder].tolist(), 'km': round(km, 1)})
+
+    return {
+        'Vertreter_Name': auftrag['vertreter'],
+        'Kunden': len(kunden_nr),
+        'Besuche_pro_Jahr': int(besuche.sum()),
+        'Tourentage': tourentage,
+        'Auslastung': tourentage / ARBEITSTAGE_PRO_JAHR,
+        'km_pro_Jahr': round(km_pro_jahr),
+        'km_pro_Tag': round(km_pro_jahr / tourentage, 1) if tourentage else 0.0,
+        'tage': tage,
+    }
+
+
+def wohnorte_je_vertreter(dataframe):
+    """
+    Wohnort je Vertreter (Index Vertreter_Name, Spalten Wohnort_Lat und Wohnort_Lon).
+
+    Nur für Stammdaten wie df_basis geeignet, in denen jede Zeile den Wohnort ihres Vertreters
+    trägt. Nach einer Umverteilung hat eine Kundenzeile noch den Wohnort des alten Vertreters.
+    """
+    return dataframe.dropna(subset=['Wohnort_Lat', 'Wohnort_Lon']) \
+        .groupby('Vertreter_Name')[['Wohnort_Lat', 'Wohnort_Lon']].first()
+
+
+def _auftraege(dataframe, wohnorte):
+    _, besuche = besuchs_frequenzen(dataframe)
+    daten = dataframe.assign(_besuche=besuche).drop_duplicates(subset=['Kunden_Nr', 'Vertreter_Name'])
+    for vertreter, gruppe in daten.groupby('Vertreter_Name', sort=True):
+        gruppe = gruppe.sort_values('Kunden_Nr')
+        heim_lat, heim_lon = wohnorte.loc[vertreter] if vertreter in wohnorte.index else (np.nan, np.nan)
+        auftrag = {
+            'vertreter': vertreter,
+            'heim_lat': float(heim_lat),
+            'heim_lon': float(heim_lon),
+            'kunden_nr': gruppe['Kunden_Nr'].to_numpy(),
+            'lat': gruppe['Latitude'].to_numpy(),
+            'lon': gruppe['Longitude'].to_numpy(),
+            'besuche': gruppe['_besuche'].to_numpy(),
+        }
+        # Versionsschlüssel des Vertreters: ändert sich nur, wenn sich sein Gebiet ändert
+        fingerabdruck = int(pd.util.hash_pandas_object(
+            gruppe[['Kunden_Nr', 'Latitude', 'Longitude', '_besuche']], index=False
+        ).sum() & 0xFFFFFFFFFFFFFFFF)
+        yield auftrag, (vertreter, fingerabdruck, auftrag['heim_lat'], auftrag['heim_lon'])
+
+
+def plane_besuche(dataframe, wohnorte=None, max_worker=1):
+    """
+    Erstellt den Besuchsplan für alle Vertreter in `dataframe`.
+
+    Ergebnisse werden pro Vertreter und Gebietsstand gecacht, sodass nach einer Umverteilung nur
+    die betroffenen Vertreter neu geplant werden.
+
+    Args:
+        wohnorte: Wohnort je Vertreter aus den Stammdaten (siehe `wohnorte_je_vertreter`); ohne
+            Angabe aus `dataframe` selbst, was nur für unveränderte Basisdaten stimmt
+        max_worker: 1 (Standard) rechnet im aufrufenden Prozess, z.B. in der App oder in einem
+            Pool-Worker. Größere Werte (nur für Batch-Läufe) starten einen Pool mit höchstens
+            MAX_POOL_WORKER per 'spawn' gestarteten Prozessen; ein fork würde die Threads des
+            aufrufenden Prozesses (Hintergrund-Aktualisierung, Schreib-Worker) in halbem Zustand kopieren.
+    Returns:
+        (Übersicht als DataFrame je Vertreter, Dict vertreter -> Tagescluster)
+    """
+    parameter = (ARBEITSTAGE_PRO_JAHR, MAX_BESUCHE_PRO_TAG, MAX_KM_PRO_TAG, tuple(BESUCHS_STUFEN))
+    if wohnorte is None:
+        wohnorte = wohnorte_je_vertreter(dataframe)
+    ergebnisse = {}
+    offen = []
+    for auftrag, schluessel in _auftraege(dataframe, wohnorte[['Wohnort_Lat', 'Wohnort_Lon']]):
+        cache_schluessel = ('besuchsplan', parameter) + schluessel
+        treffer = _plan_cache.finde(cache_schluessel)
+        if treffer is None:
+            offen.append((auftrag, cache_schluessel))
+        else:
+            ergebnisse[auftrag['vertreter']] = treffer
+
+    if offen:
+        if len(offen) >= MIN_VERTRETER_PARALLEL and max_worker > 1:
+            with ProcessPoolExecutor(max_workers=min(max_worker, MAX_POOL_WORKER),
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                berechnet = list(executor.map(plane_vertreter, [a for a, _ in offen]))
+        else:
+            berechnet = [plane_vertreter(a) for a, _ in offen]
+        for (auftrag, cache_schluessel), ergebnis in zip(offen, berechnet):
+            _plan_cache.setze(cache_schluessel, ergebnis)
+            ergebnisse[auftrag['vertreter']] = ergebnis
+
+    if not ergebnisse:
+        return pd.DataFrame(), {}
+    uebersicht = pd.DataFrame([
+        {k: v for k, v in e.items() if k != 'tage'} for e in ergebnisse.values()
+    ]).sort_values('Auslastung', ascending=False).reset_index(drop=True)
+    return uebersicht, {name: e['tage'] for name, e in ergebnisse.items()}
@@ -0,0 +1,133 @@
+# cache.py
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+# Grob gemessener Speicherbedarf eines Folium-Elements (z.B. CircleMarker samt Tooltip)
+BYTES_PRO_KARTEN_ELEMENT = 1024
+
+
+def _anzahl_elemente(element):
+    return 1 + sum(_anzahl_elemente(kind) for kind in element._children.values())
+
+
+def schaetze_groesse(wert, tief=True):
+    """
+    Ungefährer Speicherbedarf eines Werts in Bytes (DataFrames exakt, Karten geschätzt).
+    Mit `tief=False` zählen bei DataFrames nur die Spalten-Arrays, nicht die referenzierten Strings.
+    """
+    if isinstance(wert, (pd.DataFrame, pd.Series)):
+        groesse = wert.memory_usage(deep=tief)
+        return int(groesse.sum() if isinstance(wert, pd.DataFrame) else groesse)
+    if hasattr(wert, '_children'):  # folium / branca
+        return _anzahl_elemente(wert) * BYTES_PRO_KARTEN_ELEMENT
+    if isinstance(wert, (list, tuple)):
+        return sys.getsizeof(wert) + sum(schaetze_groesse(w, tief) for w in wert)
+    return sys.getsizeof(wert)
+
+
+class VersionsCache:
+    """
+    Prozessweiter LRU-Cache, dessen Schlüssel aus günstigen Versions-Tokens bestehen
+    (z.B. Basisdaten-Version, Zuweisungs-Version, Filter) statt aus gehashten DataFrames.
+
+    Einträge tragen Tags (z.B. 'szenarien', 'karten'), über die gezielt invalidiert wird,
+    statt wie bei st.cache_data.clear() alles zu verwerfen. Zu jedem Eintrag wird seine
+    ungefähre Größe gemerkt, damit die Sitzungsverwaltung Speicherbudgets durchsetzen kann.
+    """
+
+    def __init__(self, max_eintraege=128):
+        self.max_eintraege = max_eintraege
+        self._eintraege = OrderedDict()  # schluessel -> (wert, ablauf, tags, groesse)
+        self._lock = threading.RLock()
+        self.treffer = 0
+        self.fehlschlaege = 0
+
+    def hole(self, schluessel, berechne, tags=(), ttl=None):
+        """
+        Gibt den gecachten Wert zurück oder berechnet ihn mit `berechne()`.
+
+        Args:
+            schluessel: Hashbares Tupel aus Versions-Tokens
+            berechne: Funktion ohne Argumente
+            tags: Tags für die gezielte Invalidierung
+            ttl: Optionale Lebensdauer in Sekunden
+        """
+        fehlt = object()
+        wert = self.finde(schluessel, fehlt)
+        if wert is not fehlt:
+            return wert
+        wert = berechne()
+        self.setze(schluessel, wert, tags=tags, ttl=ttl)
+        return wert
+
+    def finde(self, schluessel, standard=None):
+        """Gibt den gecachten Wert oder `standard` zurück, ohne etwas zu berechnen."""
+        with self._lock:
+            eintrag = self._eintraege.get(schluessel)
+            if eintrag is not None and (eintrag[1] is None or eintrag[1] > time.time()):
+                self._eintraege.move_to_end(schluessel)
+                self.treffer += 1
+                return eintrag[0]
+        self.fehlschlaege += 1
+        return standard
+
+    def setze(self, schluessel, wert, tags=(), ttl=None):
+        with self._lock:
+            ablauf = time.time() + ttl if ttl else None
+            self._eintraege[schluessel] = (wert, ablauf, frozenset(tags), schaetze_groesse(wert))
+            self._eintraege.move_to_end(schluessel)
+            while len(self._eintraege) > self.max_eintraege:
+                self._eintraege.popitem(last=False)
+
+    def invalidiere(self, tag):
+        """Entfernt alle Einträge mit dem Tag. Gibt die Anzahl entfernter Einträge zurück."""
+        with self._lock:
+            betroffen = [k for k, eintrag in self._eintraege.items() if tag in eintrag[2]]
+            for schluessel in betroffen:
+                del self._eintraege[schluessel]
+            return len(betroffen)
+
+    def belegung(self, praefix=''):
+        """Belegte Bytes je Tag (nur Tags mit dem angegebenen Präfix, z.B. 'session:')."""
+        summen = {}
+        with self._lock:
+            for _, _, tags, groesse in self._eintraege.values():
+                for tag in tags:
+                    if tag.startswith(praefix):
+                        summen[tag] = summen.get(tag, 0) + groesse
+        return summen
+
+    def verdraenge(self, max_bytes, tag=None, praefix=None):
+        """
+        Entfernt die am längsten ungenutzten Einträge, bis die betroffenen Einträge höchstens
+        `max_bytes` belegen. Betroffen sind Einträge mit `tag` bzw. mit einem Tag, das mit `praefix`
+        beginnt (LRU über alle Sessions hinweg). Gibt die freigegebenen Bytes zurück.
+        """
+        def betroffen(tags):
+            if tag is not None:
+                return tag in tags
+            return any(t.startswith(praefix) for t in tags)
+
+        with self._lock:
+            kandidaten = [(k, e[3]) for k, e in self._eintraege.items() if betroffen(e[2])]
+            belegt = sum(groesse for _, groesse in kandidaten)
+            freigegeben = 0
+            for schluessel, groesse in kandidaten:  # älteste zuerst
+                if belegt - freigegeben <= max_bytes:
+                    break
+                del self._eintraege[schluessel]
+                freigegeben += groesse
+            return freigegeben
+
+    def leeren(self):
+        with self._lock:
+            self._eintraege.clear()
+
+
+# Geteilter Cache für alle Sessions
+cache = VersionsCache()
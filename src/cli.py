@@ -0,0 +1,209 @@
+# cli.py
+"""
+Kommandozeile für nächtliche Jobs, ohne Web-Oberfläche.
+
+    python -m src.cli snapshot --ziel export/
+    python -m src.cli szenarien --ziel export/ [--name "Szenario A" ...] [--worker 4] [--ohne-karten]
+    python -m src.cli standorte --ziel export/ [--umziehend "Name" ...] [--neu 1] [--starts 8] [--worker 4]
+    python -m src.cli schreiben
+
+Zugangsdaten kommen aus .streamlit/secrets.toml (oder GEBIETSPLANER_SECRETS).
+"""
+
+import argparse
+import logging
+import multiprocessing
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from src import datenquelle
+from src.karten import zeichne_karte, farb_zuordnung
+from src.konfig import IST_ZUSTAND
+from src.kpi import szenario_kennzahlen, bewerte_szenarien
+from src.besuchsplanung import MAX_POOL_WORKER, wohnorte_je_vertreter
+from src.standortplanung import plane_standorte
+
+logger = logging.getLogger('gebietsplaner')
+
+
+def _dateiname(name):
+    return re.sub(r'[^0-9A-Za-z_-]+', '_', name).strip('_') or 'szenario'
+
+
+def verarbeite_szenario(auftrag):
+    """
+    Berechnet Kennzahlen, Besuchsplan und Karte eines Szenarios und schreibt sie nach `auftrag['ziel']`.
+    Top-Level-Funktion, damit sie im Prozess-Pool läuft.
+
+    Args:
+        auftrag: Dict mit name, dataframe, wohnorte, farb_map, ziel, karten
+    Returns:
+        Dict mit den Kennzahlen des Szenarios
+    """
+    start = time.perf_counter()
+    name, dataframe = auftrag['name'], auftrag['dataframe']
+    verzeichnis = os.path.join(auftrag['ziel'], _dateiname(name))
+    os.makedirs(verzeichnis, exist_ok=True)
+
+    # Dieser Prozess ist bereits ein Pool-Worker: Besuchsplanung seriell rechnen
+    werte, besuchs_uebersicht = szenario_kennzahlen(dataframe, wohnorte=auftrag['wohnorte'], max_worker=1)
+    dataframe[['Kunden_Nr', 'Vertreter_Name']].to_parquet(os.path.join(verzeichnis, 'zuweisung.parquet'), index=False)
+    if not besuchs_uebersicht.empty:
+        besuchs_uebersicht.to_parquet(os.path.join(verzeichnis, 'besuchsplan.parquet'), index=False)
+    if auftrag['karten']:
+        # Statische HTML-Datei: Rasterkacheln bräuchten den laufenden Kachelserver
+        zeichne_karte(dataframe, auftrag['farb_map'], modus='vektor').save(os.path.join(verzeichnis, 'karte.html'))
+
+    return {'Szenario': name, **werte, 'Dauer_s': round(time.perf_counter() - start, 2)}
+
+
+def _lade_basis():
+    df = datenquelle.hole_basis_daten(zeitplan=False)
+    if df.empty:
+        raise RuntimeError("Keine Basisdaten geladen.")
+    return df
+
+
+def befehl_snapshot(args):
+    """Lädt die Stammdaten neu und exportiert den Basisdatenstand."""
+    os.makedirs(args.ziel, exist_ok=True)
+    df = _lade_basis()
+    bericht = datenquelle.letzter_sync_bericht()
+    if bericht is not None:
+        logger.info("Abgleich: %s", bericht.zusammenfassung())
+    pfad = os.path.join(args.ziel, 'basisdaten.parquet')
+    df.to_parquet(pfad, index=False)
+    logger.info("%d Kunden nach %s geschrieben.", len(df), pfad)
+    return 0
+
+
+def befehl_szenarien(args):
+    """Berechnet Kennzahlen und Karten für gespeicherte Szenarien, parallel je Szenario."""
+    os.makedirs(args.ziel, exist_ok=True)
+    df_basis = _lade_basis()
+    zuweisungen = datenquelle.alle_szenario_zuweisungen(args.name or None)
+    if args.name:
+        for fehlend in sorted(set(args.name) - set(zuweisungen) - {IST_ZUSTAND}):
+            logger.warning("Szenario '%s' nicht gefunden.", fehlend)
+
+    szenarien = {}
+    if not args.name or IST_ZUSTAND in args.name:
+        szenarien[IST_ZUSTAND] = df_basis
+    for name, zuweisung in zuweisungen.items():
+        szenarien[name] = datenquelle.wende_zuweisung_an(df_basis, zuweisung)
+
+    # Eine Farbzuordnung für alle Szenarien, damit dieselben Vertreter gleich aussehen
+    farb_map = farb_zuordnung(pd.concat([df['Vertreter_Name'] for df in szenarien.values()]).unique())
+    # Wohnorte aus den Stammdaten: umverteilte Kundenzeilen tragen noch den Wohnort des alten Vertreters
+    wohnorte = wohnorte_je_vertreter(df_basis)
+    auftraege = [
+        {'name': name, 'dataframe': df, 'wohnorte': wohnorte, 'farb_map': farb_map, 'ziel': args.ziel,
+         'karten': not args.ohne_karten}
+        for name, df in szenarien.items()
+    ]
+
+    ergebnisse = []
+    fehler = 0
+    # 'spawn' wie bei den übrigen Pools: ein fork kopierte Threads und gspread-Zustand des Elternprozesses
+    with ProcessPoolExecutor(max_workers=min(args.worker or MAX_POOL_WORKER, MAX_POOL_WORKER),
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        laufend = {executor.submit(verarbeite_szenario, auftrag): auftrag['name'] for auftrag in auftraege}
+        for future in as_completed(laufend):
+            try:
+                ergebnis = future.result()
+            except Exception as e:
+                logger.error("Szenario '%s' fehlgeschlagen: %s", laufend[future], e)
+                fehler += 1
+                continue
+            logger.info("Szenario '%s' fertig (%.1fs).", ergebnis['Szenario'], ergebnis['Dauer_s'])
+            ergebnisse.append(ergebnis)
+
+    if ergebnisse:
+        # Vergleichskennzahlen (Gini, Distanzen, verschobene Kunden, Abdeckung) aller Szenarien in einem Lauf
+        bewertung = bewerte_szenarien(df_basis, zuweisungen,
+                                      max_worker=args.worker or MAX_POOL_WORKER).drop(columns='Vertreter')
+        uebersicht = pd.DataFrame(ergebnisse).merge(bewertung, on='Szenario', how='left') \
+            .sort_values('Szenario').reset_index(drop=True)
+        uebersicht.to_parquet(os.path.join(args.ziel, 'kennzahlen.parquet'), index=False)
+        print(uebersicht.to_string(index=False))
+    return 1 if fehler else 0
+
+
+def befehl_standorte(args):
+    """Sucht Wohnorte für neue oder umziehende Vertreter; die Starts laufen parallel im Prozess-Pool."""
+    os.makedirs(args.ziel, exist_ok=True)
+    df = _lade_basis()
+    umziehende = args.umziehend or []
+    for fehlend in sorted(set(umziehende) - set(df['Vertreter_Name'])):
+        logger.warning("Vertreter '%s' nicht gefunden.", fehlend)
+    wohnorte = wohnorte_je_vertreter(df)
+    feste = {name: (zeile.Wohnort_Lat, zeile.Wohnort_Lon)
+             for name, zeile in wohnorte.iterrows() if name not in umziehende}
+    freie = list(umziehende) + [f"Neu {i + 1}" for i in range(args.neu)]
+    loesung = plane_standorte(df, feste, freie, starts=args.starts, wohnorte=wohnorte,
+                              max_worker=args.worker or min(args.starts, MAX_POOL_WORKER))
+    pfad = os.path.join(args.ziel, 'standorte.parquet')
+    loesung.standorte.to_parquet(pfad, index=False)
+    logger.info("%d Starts in %.1fs, Standorte nach %s geschrieben.", loesung.starts, loesung.dauer, pfad)
+    print(loesung.standorte[~loesung.standorte['Fest']].drop(columns='Fest').round(4).to_string(index=False))
+    return 0
+
+
+def befehl_schreiben(args):
+    """
+    Schreibt noch offene Szenarien aus dem lokalen Journal nach Google Sheets.
+    Aufträge, die gerade ein anderer Prozess (z.B. die laufende App) schreibt, bleiben diesem überlassen.
+    """
+    anzahl = datenquelle.schreibe_offene_szenarien()
+    logger.info("%d Szenario-Auftrag/Aufträge geschrieben.", anzahl)
+    laufend = datenquelle.speicher_status()['laeuft']
+    if laufend:
+        logger.warning("%d Auftrag/Aufträge werden gerade von einem anderen Prozess geschrieben "
+                       "und wurden übersprungen.", laufend)
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m src.cli', description="Gebietsplaner ohne Web-Oberfläche")
+    parser.add_argument('-v', '--verbose', action='store_true', help="Ausführliche Ausgabe")
+    befehle = parser.add_subparsers(dest='befehl', required=True)
+
+    snapshot = befehle.add_parser('snapshot', help="Basisdaten neu laden und als Parquet exportieren")
+    snapshot.add_argument('--ziel', default='export', help="Ausgabeverzeichnis (Standard: export)")
+    snapshot.set_defaults(funktion=befehl_snapshot)
+
+    szenarien = befehle.add_parser('szenarien', help="Kennzahlen, Besuchspläne und Karten je Szenario exportieren")
+    szenarien.add_argument('--ziel', default='export', help="Ausgabeverzeichnis (Standard: export)")
+    szenarien.add_argument('--name', action='append', help="Nur dieses Szenario (mehrfach möglich)")
+    szenarien.add_argument('--worker', type=int, default=None, help=f"Anzahl paralleler Prozesse (höchstens {MAX_POOL_WORKER})")
+    szenarien.add_argument('--ohne-karten', action='store_true', help="Keine HTML-Karten erzeugen")
+    szenarien.set_defaults(funktion=befehl_szenarien)
+
+    standorte = befehle.add_parser('standorte', help="Wohnorte für neue oder umziehende Vertreter berechnen")
+    standorte.add_argument('--ziel', default='export', help="Ausgabeverzeichnis (Standard: export)")
+    standorte.add_argument('--umziehend', action='append', help="Umziehender Vertreter (mehrfach möglich)")
+    standorte.add_argument('--neu', type=int, default=0, help="Anzahl neuer Vertreter (Standard: 0)")
+    standorte.add_argument('--starts', type=int, default=8, help="Starts der lokalen Suche (Standard: 8)")
+    standorte.add_argument('--worker', type=int, default=None, help=f"Anzahl paralleler Prozesse (höchstens {MAX_POOL_WORKER})")
+    standorte.set_defaults(funktion=befehl_standorte)
+
+    schreiben = befehle.add_parser('schreiben', help="Offene Szenarien aus dem Journal nach Google Sheets schreiben")
+    schreiben.set_defaults(funktion=befehl_schreiben)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(levelname)s %(message)s')
+    try:
+        return args.funktion(args)
+    except Exception as e:
+        logger.error("%s", e)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,48 +2,55 @@
 
 import streamlit as st
 import pandas as pd
-import numpy as np
-import gspread
-from google.oauth2.service_account import Credentials
 import sqlite3
 import tempfile
 import os
+import uuid
+
+from src import datenquelle
+from src.datenquelle import basis_daten_version
+from src.sitzungen import sitzungen
+
+# Streamlit-Anbindung der Datenquelle: Fehler werden hier angezeigt, Zustand pro Session gehalten.
+# Die eigentliche Logik liegt in src/datenquelle.py und ist auch ohne Web-Oberfläche nutzbar.
+
+# Version der Basisdaten, deren Größe zuletzt an die Sitzungsverwaltung gemeldet wurde
+_gemessene_version = None
+
+def sitzungs_token():
+    """Eindeutiges Token der Streamlit-Session (Cache-Tags, SQLite-Verbindung, Speicherbuchführung)."""
+    if 'cache_token' not in st.session_state:
+        st.session_state.cache_token = uuid.uuid4().hex
+    return st.session_state.cache_token
 
-# Diese Funktion bleibt, um die Basisdaten zu laden
-@st.cache_data(ttl=7200)  # 2 Stunden Cache für bessere Performance
 def lade_basis_daten():
-    """Lädt die initialen Kunden- und Vertreterdaten."""
+    """
+    Lädt die initialen Kunden- und Vertreterdaten.
+    Liefert sofort den letzten gültigen Stand; veraltete Daten werden im Hintergrund erneuert.
+    Der zurückgegebene DataFrame wird zwischen Sessions geteilt und darf nicht verändert werden.
+    """
     try:
-        creds_info = st.secrets["gcp_service_account"]
-        scopes = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-        creds = Credentials.from_service_account_info(creds_info, scopes=scopes)
-        gc = gspread.authorize(creds)
-        
-        kunden_sheet = gc.open("Kunden_mit_Koordinaten_Stand_2025-03").sheet1
-        vertreter_sheet = gc.open("vertreter_stammdaten_robust").sheet1
-        
-        kunden_df = pd.DataFrame(kunden_sheet.get_all_records())
-        vertreter_df = pd.DataFrame(vertreter_sheet.get_all_records())
+        df = datenquelle.hole_basis_daten()
+        
+        # Geteilter Datenstand: einmal pro Version messen, zählt nicht gegen das Sitzungsbudget
+        global _gemessene_version
+        version = basis_daten_version()
+        if _gemessene_version != version:
+            sitzungen.merke_geteilt('basisdaten', df)
+            _gemessene_version = version
 
-        df_merged = pd.merge(kunden_df, vertreter_df, on='Vertreter_Name', how='left')
-        
-        # Optimierte Datenverarbeitung
-        numeric_columns = ['Latitude', 'Longitude', 'Wohnort_Lat', 'Wohnort_Lon', 'Umsatz_2024', 'Kunden_Nr']
-        for col in numeric_columns:
-            if col in df_merged.columns:
-                df_merged[col] = pd.to_numeric(df_merged[col].replace('', np.nan), errors='coerce')
-        
-        # Entferne Zeilen ohne Koordinaten
-        df_merged.dropna(subset=['Latitude', 'Longitude', 'Wohnort_Lat', 'Wohnort_Lon'], inplace=True)
-        
-        # Sortiere für bessere Performance
-        df_merged.sort_values('Kunden_Nr', inplace=True)
-        df_merged.reset_index(drop=True, inplace=True)
-        
-        # Erstelle In-Memory SQLite für bessere Performance
-        create_in_memory_db(df_merged)
-        
-        return df_merged
+        # In-Memory DB pro Session und Datenstand, nicht nur bei Cache-Misses
+        db_version = st.session_state.get('db_version')
+        if db_version != version:
+            bericht = datenquelle.sync_bericht(version)
+            if (db_version == version - 1 and bericht is not None and not bericht.vollstaendig
+                    and sitzungen.db_verbindung(sitzungs_token()) is not None):
+                aktualisiere_in_memory_db(df, bericht.betroffene_kunden)
+            else:
+                create_in_memory_db(df)
+            st.session_state.db_version = version
+        
+        return df
         
     except Exception as e:
         st.error(f"Fehler beim Laden der Basisdaten aus Google Sheets: {e}")
@@ -55,8 +62,8 @@ def create_in_memory_db(df):
         # Erstelle temporäre SQLite-Datei
         temp_db_path = tempfile.mktemp(suffix='.db')
         
-        # Verbinde zur SQLite-Datenbank
-        conn = sqlite3.connect(temp_db_path)
+        # Verbinde zur SQLite-Datenbank (darf beim Aufräumen aus einem anderen Thread geschlossen werden)
+        conn = sqlite3.connect(temp_db_path, check_same_thread=False)
         
         # Speichere DataFrame in SQLite
         df.to_sql('kunden', conn, if_exists='replace', index=False)
@@ -66,26 +73,43 @@ def create_in_memory_db(df):
         conn.execute('CREATE INDEX IF NOT EXISTS idx_vertreter ON kunden(Vertreter_Name)')
         conn.execute('CREATE INDEX IF NOT EXISTS idx_verlag ON kunden(Verlag)')
         
-        # Speichere DB-Pfad im Session State
-        st.session_state.db_path = temp_db_path
-        st.session_state.db_conn = conn
+        # Verbindung gehört der Sitzungsverwaltung, die sie bei Inaktivität schließt und die Datei löscht
+        sitzungen.registriere_db(sitzungs_token(), conn, temp_db_path)
         
         st.success("✅ In-Memory Datenbank erstellt für bessere Performance")
         
     except Exception as e:
         st.warning(f"⚠️ In-Memory DB konnte nicht erstellt werden: {e}")
 
+def aktualisiere_in_memory_db(df, kunden_nummern):
+    """Zieht nur die Zeilen der angegebenen Kunden in der In-Memory DB nach."""
+    try:
+        conn = sitzungen.db_verbindung(sitzungs_token())
+        nummern = [float(nr) for nr in kunden_nummern]
+        if nummern:
+            conn.executemany('DELETE FROM kunden WHERE Kunden_Nr = ?', [(nr,) for nr in nummern])
+            df[df['Kunden_Nr'].isin(nummern)].to_sql('kunden', conn, if_exists='append', index=False)
+        conn.commit()
+    except Exception as e:
+        st.warning(f"⚠️ In-Memory DB konnte nicht aktualisiert werden: {e}")
+        create_in_memory_db(df)
+
 @st.cache_data(ttl=3600)  # 1 Stunde Cache für Datenbankabfragen
 def query_kunden_db(query, params=None):
     """Führt eine SQL-Abfrage auf der In-Memory Datenbank aus."""
     try:
-        if 'db_conn' not in st.session_state:
-            return pd.DataFrame()
+        conn = sitzungen.db_verbindung(sitzungs_token())
+        if conn is None:
+            # Nach dem Aufräumen bei Bedarf neu aufbauen
+            create_in_memory_db(datenquelle.hole_basis_daten())
+            conn = sitzungen.db_verbindung(sitzungs_token())
+            if conn is None:
+                return pd.DataFrame()
         
         if params:
-            return pd.read_sql_query(query, st.session_state.db_conn, params=params)
+            return pd.read_sql_query(query, conn, params=params)
         else:
-            return pd.read_sql_query(query, st.session_state.db_conn)
+            return pd.read_sql_query(query, conn)
             
     except Exception as e:
         st.warning(f"⚠️ Datenbankabfrage fehlgeschlagen: {e}")
@@ -93,55 +117,74 @@ def query_kunden_db(query, params=None):
 
 # --- NEUE FUNKTIONEN FÜR SZENARIEN ---
 
-def hole_szenarien_sheet():
-    """Stellt die Verbindung zur Szenarien-Tabelle her."""
-    creds_info = st.secrets["gcp_service_account"]
-    scopes = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
-    creds = Credentials.from_service_account_info(creds_info, scopes=scopes)
-    gc = gspread.authorize(creds)
-    return gc.open("gebietsplaner_szenarien").sheet1
-
-@st.cache_data(ttl=600) # 10 Minuten Cache für Szenarien-Liste
 def lade_szenarien_liste():
-    """Lädt die Liste aller einzigartigen Szenario-Namen."""
+    """Lädt die Liste aller einzigartigen Szenario-Namen, inklusive noch nicht geschriebener."""
+    datenquelle.starte_schreib_worker()
     try:
-        szenarien_sheet = hole_szenarien_sheet()
-        szenarien_namen = szenarien_sheet.col_values(1)[1:] # Erste Spalte ohne Header
-        return sorted(list(set(szenarien_namen)))
+        szenarien_namen = datenquelle.gespeicherte_szenarien_namen()
     except Exception as e:
         st.warning(f"Konnte keine gespeicherten Szenarien laden: {e}")
-        return []
+        szenarien_namen = []
+    return sorted(set(szenarien_namen) | set(datenquelle.offene_szenarien_namen()))
 
 def lade_szenario_zuweisung(szenario_name):
     """Lädt die Kundenzuordnung für ein spezifisches Szenario."""
     try:
-        szenarien_sheet = hole_szenarien_sheet()
-        alle_szenarien_df = pd.DataFrame(szenarien_sheet.get_all_records())
-        szenario_df = alle_szenarien_df[alle_szenarien_df['szenario_name'] == szenario_name]
-        # Wir brauchen nur die Zuordnung von Kunden-Nr zu Vertreter
-        zuweisung = szenario_df[['Kunden_Nr', 'Vertreter_Name']]
-        zuweisung['Kunden_Nr'] = pd.to_numeric(zuweisung['Kunden_Nr'], errors='coerce')
-        return zuweisung.set_index('Kunden_Nr')
+        return datenquelle.szenario_zuweisung(szenario_name)
     except Exception as e:
         st.error(f"Fehler beim Laden des Szenarios '{szenario_name}': {e}")
         return None
 
+def lade_alle_szenario_zuweisungen(namen=None):
+    """Lädt die Zuordnungen aller (oder der angegebenen) Szenarien mit einer Leseanfrage."""
+    try:
+        return datenquelle.alle_szenario_zuweisungen(namen)
+    except Exception as e:
+        st.error(f"Fehler beim Laden der Szenarien: {e}")
+        return None
+
 def speichere_szenario(szenario_name, dataframe_aktuell):
-    """Speichert die aktuelle Gebietsverteilung als neues Szenario."""
+    """
+    Speichert die aktuelle Gebietsverteilung als neues Szenario.
+    Der Auftrag landet sofort im lokalen Journal; das Schreiben nach Google Sheets erfolgt im Hintergrund.
+    """
     try:
-        szenarien_sheet = hole_szenarien_sheet()
-        
-        # Daten für das Speichern vorbereiten
-        zu_speichern_df = dataframe_aktuell[['Kunden_Nr', 'Vertreter_Name']].copy()
-        zu_speichern_df.insert(0, 'szenario_name', szenario_name)
-        
-        # Daten als Liste von Listen anhängen (effizienter als einzelne API-Calls)
-        daten_zum_anhaengen = zu_speichern_df.values.tolist()
-        szenarien_sheet.append_rows(daten_zum_anhaengen, value_input_option='USER_ENTERED')
-        
-        # Cache für die Szenarienliste leeren, damit die neue Liste geladen wird
-        st.cache_data.clear()
+        datenquelle.plane_szenario(szenario_name, dataframe_aktuell)
         return True
     except Exception as e:
         st.error(f"Fehler beim Speichern des Szenarios '{szenario_name}': {e}")
-        return False
\ No newline at end of file
+        return False
+
+def speicher_status():
+    """Anzahl der noch nicht nach Google Sheets geschriebenen Szenarien und letzter Fehler."""
+    return datenquelle.speicher_status()
+
+# --- AUTOSAVE DER SITZUNG ---
+
+def merke_szenario_basis(sitzung, szenario_name):
+    """Merkt sich, welches Szenario eine Sitzung geladen hat (verwirft deren offene Änderungen)."""
+    try:
+        datenquelle.journal().setze_basis(sitzung, szenario_name)
+    except Exception as e:
+        st.warning(f"⚠️ Sitzung konnte nicht gesichert werden: {e}")
+
+def merke_zuweisung(sitzung, kunden_nr, alter_vertreter, neuer_vertreter):
+    """Schreibt eine Zuweisungsänderung sofort ins lokale Journal."""
+    try:
+        datenquelle.journal().notiere_zuweisung(sitzung, kunden_nr, alter_vertreter, neuer_vertreter)
+    except Exception as e:
+        st.warning(f"⚠️ Änderung konnte nicht gesichert werden: {e}")
+
+def vergiss_letzte_zuweisung(sitzung):
+    try:
+        datenquelle.journal().entferne_letzte_zuweisung(sitzung)
+    except Exception as e:
+        st.warning(f"⚠️ Rückgängig konnte nicht gesichert werden: {e}")
+
+def lade_sitzungs_stand(sitzung):
+    """Gibt (szenario_name, Liste der Änderungen) einer früheren Sitzung zurück."""
+    try:
+        return datenquelle.journal().lade_sitzung(sitzung)
+    except Exception as e:
+        st.warning(f"⚠️ Gesicherte Sitzung konnte nicht gelesen werden: {e}")
+        return None, []
@@ -0,0 +1,193 @@
+# datenquelle.py
+
+import pandas as pd
+
+from src.basis_cache import BasisDatenCache
+from src.sync import InkrementellerSync
+from src.sheets_client import SheetsClientPool
+from src.journal import Journal, SchreibWorker
+from src.cache import cache
+from src.konfig import hole_secret
+
+# Datenzugriff ohne Streamlit: wird von der App (src/daten.py) und der Kommandozeile (src/cli.py) genutzt.
+# Fehler werden hier nicht angezeigt, sondern als Exceptions an den Aufrufer weitergereicht.
+
+BASIS_DATEN_MAX_ALTER = 7200  # 2 Stunden, danach wird im Hintergrund neu geladen
+KUNDEN_SHEET = "Kunden_mit_Koordinaten_Stand_2025-03"
+VERTRETER_SHEET = "vertreter_stammdaten_robust"
+SZENARIEN_SHEET = "gebietsplaner_szenarien"
+
+# Ein autorisierter Client für alle Sessions statt gspread.authorize bei jedem Aufruf
+_sheets = SheetsClientPool(lambda: hole_secret("gcp_service_account"))
+
+# Hält den letzten Stand beider Stammdaten-Tabellen und gleicht nur Änderungen ab
+_sync = InkrementellerSync(_sheets, KUNDEN_SHEET, VERTRETER_SHEET)
+
+# Sync-Berichte je Version, damit Sessions ihre In-Memory DB inkrementell nachziehen können
+_sync_berichte = {}
+
+def _merke_sync_bericht(version):
+    _sync_berichte[version] = _sync.letzter_bericht
+    for alte_version in [v for v in _sync_berichte if v <= version - 5]:
+        del _sync_berichte[alte_version]
+
+# Prozessweiter Cache: alle Sessions teilen sich denselben Datenstand
+_basis_cache = BasisDatenCache(_sync.synchronisiere, max_alter=BASIS_DATEN_MAX_ALTER,
+                               bei_neuer_version=_merke_sync_bericht)
+
+# --- BASISDATEN ---
+
+def hole_basis_daten(zeitplan=True):
+    """
+    Liefert den geteilten Basisdatenstand (blockiert nur beim allerersten Laden).
+    Mit `zeitplan` werden veraltete Daten danach regelmäßig im Hintergrund erneuert.
+    """
+    df = _basis_cache.hole()
+    if zeitplan:
+        _basis_cache.starte_zeitplan()
+    return df
+
+def basis_daten_version():
+    """Versionsnummer des aktuell geteilten Basisdatenstands (für abhängige Caches)."""
+    return _basis_cache.version
+
+def aktualisiere_basis_daten(blockierend=False):
+    """
+    Lädt die Stammdaten neu. Standardmäßig im Hintergrund (gibt False zurück, wenn bereits
+    eine Aktualisierung läuft); `blockierend=True` wartet auf das Ergebnis.
+    """
+    if blockierend:
+        return _basis_cache.aktualisiere()
+    return _basis_cache.aktualisiere_im_hintergrund()
+
+def sync_bericht(version):
+    """Sync-Bericht, der zur angegebenen Version geführt hat (oder None)."""
+    return _sync_berichte.get(version)
+
+def letzter_sync_bericht():
+    """Bericht der letzten Synchronisation mit den Stammdaten-Tabellen (oder None)."""
+    return _sync.letzter_bericht
+
+def sheets_metriken():
+    """Anfrage-Metriken des geteilten Google Sheets Clients."""
+    return _sheets.metriken()
+
+# --- SZENARIEN ---
+
+def hole_szenarien_sheet():
+    """Stellt die Verbindung zur Szenarien-Tabelle her (gepoolt, ohne erneute Autorisierung)."""
+    return _sheets.worksheet(SZENARIEN_SHEET)
+
+def _lade_szenarien_namen_aus_sheets():
+    szenarien_sheet = hole_szenarien_sheet()
+    return _sheets.ausfuehren('col_values', szenarien_sheet.col_values, 1)[1:] # Erste Spalte ohne Header
+
+def gespeicherte_szenarien_namen():
+    """Namen aller in Google Sheets gespeicherten Szenarien (mit Duplikaten, ungeordnet)."""
+    # 10 Minuten Cache für Szenarien-Liste, Tag 'szenarien' wird nach dem Speichern invalidiert
+    return cache.hole(('szenarien_liste',), _lade_szenarien_namen_aus_sheets, tags=('szenarien',), ttl=600)
+
+def offene_szenarien_namen():
+    """Namen der Szenarien, die noch nicht nach Google Sheets geschrieben wurden."""
+    return _journal.offene_szenario_namen()
+
+def _als_zuweisung(zeilen):
+    zuweisung = pd.DataFrame(zeilen, columns=['Kunden_Nr', 'Vertreter_Name'])
+    zuweisung['Kunden_Nr'] = pd.to_numeric(zuweisung['Kunden_Nr'], errors='coerce')
+    # Doppelt angehängte Zeilen (erneut geschriebener Auftrag, mehrfach gespeichertes Szenario):
+    # der zuletzt geschriebene Stand gilt, sonst scheitert DataFrame.update an doppelten Indizes
+    zuweisung = zuweisung.drop_duplicates('Kunden_Nr', keep='last')
+    return zuweisung.set_index('Kunden_Nr')
+
+def szenario_zuweisung(szenario_name):
+    """Kundenzuordnung (Index Kunden_Nr, Spalte Vertreter_Name) eines gespeicherten Szenarios."""
+    # Noch nicht nach Google Sheets geschriebene Szenarien direkt aus dem Journal
+    offene_zeilen = _journal.offene_szenario(szenario_name)
+    if offene_zeilen is not None:
+        return _als_zuweisung(offene_zeilen)
+
+    szenarien_sheet = hole_szenarien_sheet()
+    alle_szenarien_df = pd.DataFrame(_sheets.ausfuehren('get_all_records', szenarien_sheet.get_all_records))
+    szenario_df = alle_szenarien_df[alle_szenarien_df['szenario_name'] == szenario_name]
+    # Wir brauchen nur die Zuordnung von Kunden-Nr zu Vertreter
+    return _als_zuweisung(szenario_df[['Kunden_Nr', 'Vertreter_Name']].values.tolist())
+
+def alle_szenario_zuweisungen(namen=None):
+    """
+    Lädt die Zuordnungen mehrerer Szenarien mit einer einzigen Leseanfrage an Google Sheets.
+    Noch offene Szenarien aus dem Journal haben Vorrang vor bereits geschriebenen Ständen.
+
+    Returns:
+        Dict szenario_name -> Zuordnung (wie `szenario_zuweisung`)
+    """
+    szenarien_sheet = hole_szenarien_sheet()
+    alle_szenarien_df = pd.DataFrame(_sheets.ausfuehren('get_all_records', szenarien_sheet.get_all_records))
+    zuweisungen = {}
+    if not alle_szenarien_df.empty:
+        for name, gruppe in alle_szenarien_df.groupby('szenario_name', sort=False):
+            zuweisungen[name] = _als_zuweisung(gruppe[['Kunden_Nr', 'Vertreter_Name']].values.tolist())
+    for name in offene_szenarien_namen():
+        zuweisungen[name] = _als_zuweisung(_journal.offene_szenario(name))
+    if namen is not None:
+        zuweisungen = {name: zuweisungen[name] for name in namen if name in zuweisungen}
+    return zuweisungen
+
+def wende_zuweisung_an(df_basis, zuweisung):
+    """Überträgt eine Szenario-Zuordnung auf eine Kopie der Basisdaten."""
+    basis_copy = df_basis.copy().set_index('Kunden_Nr')
+    basis_copy.update(zuweisung)
+    return basis_copy.reset_index()
+
+def _schreibe_szenarien_nach_sheets(auftraege):
+    """Schreibt mehrere Szenario-Aufträge mit einem einzigen append_rows-Aufruf."""
+    szenarien_sheet = hole_szenarien_sheet()
+    daten_zum_anhaengen = [
+        [auftrag['szenario_name']] + zeile
+        for auftrag in auftraege
+        for zeile in auftrag['zeilen']
+    ]
+    # Nicht blind wiederholen: ein Timeout nach erfolgreichem Anhängen würde die Zeilen verdoppeln
+    _sheets.ausfuehren('append_rows', szenarien_sheet.append_rows, daten_zum_anhaengen,
+                       idempotent=False, value_input_option='USER_ENTERED')
+
+# Lokales Journal: Änderungen und Szenarien sind sofort dauerhaft, Google Sheets folgt im Hintergrund
+_journal = Journal()
+_schreib_worker = SchreibWorker(
+    _journal,
+    _schreibe_szenarien_nach_sheets,
+    # Nur die Szenarienliste neu laden, sobald die Zeilen in Google Sheets stehen
+    nach_schreiben=lambda: cache.invalidiere('szenarien')
+)
+
+def starte_schreib_worker():
+    """Schreibt übrig gebliebene Aufträge (z.B. nach Neustart) im Hintergrund nach."""
+    _schreib_worker.starte()
+
+def plane_szenario(szenario_name, dataframe_aktuell):
+    """Legt die Zuordnung als Schreibauftrag im Journal ab und weckt den Hintergrund-Worker."""
+    # Daten als Liste von Listen vormerken (wird gebündelt mit einem API-Call angehängt)
+    zeilen = dataframe_aktuell[['Kunden_Nr', 'Vertreter_Name']].values.tolist()
+    _journal.plane_szenario(szenario_name, zeilen)
+    _schreib_worker.wecke()
+
+def schreibe_offene_szenarien():
+    """
+    Schreibt alle offenen Aufträge synchron nach Google Sheets. Gibt deren Anzahl zurück.
+
+    Läuft parallel ein anderer Schreiber (z.B. der Hintergrund-Worker der App) auf demselben
+    Journal, werden dessen beanspruchte Aufträge übersprungen statt doppelt geschrieben.
+    """
+    gesamt = 0
+    while True:
+        anzahl = _schreib_worker.schreibe_jetzt()
+        if not anzahl:
+            return gesamt
+        gesamt += anzahl
+
+def speicher_status():
+    """Anzahl der noch nicht nach Google Sheets geschriebenen Szenarien und letzter Fehler."""
+    return _journal.status()
+
+def journal():
+    """Das lokale Journal (Autosave der Sitzungen)."""
+    return _journal
@@ -0,0 +1,168 @@
+# geokodierung.py
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import closing
+from functools import lru_cache
+
+import pandas as pd
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Lokale Zentroid-Tabelle (CSV mit Spalten PLZ, Ort, Lat, Lon), z.B. aus OpenGeoDB/GeoNames exportiert
+ZENTROIDE_PFAD = os.environ.get(
+    'GEBIETSPLANER_ZENTROIDE',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'daten', 'plz_zentroide.csv')
+)
+# Persistenter Cache der Geokodierungs-Ergebnisse, Schlüssel = Hash aus normalisierter Adresse und Tabellenstand
+CACHE_PFAD = os.environ.get(
+    'GEBIETSPLANER_GEOCACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'gebietsplaner', 'geocache.db')
+)
+
+PRAEZISION_ORIGINAL = 'original'
+PRAEZISION_PLZ = 'plz'
+PRAEZISION_ORT = 'ort'
+
+_cache_lock = threading.Lock()
+
+
+@lru_cache(maxsize=2)
+def _lade_zentroide(pfad, stand):
+    """
+    Lädt die Zentroid-Tabelle einmal pro Dateistand (stand = mtime) und aggregiert je PLZ und je Ort.
+    Gibt (je_plz, je_ort, version) zurück; version ist ein Hash des Dateiinhalts.
+    """
+    with open(pfad, 'rb') as datei:
+        version = hashlib.blake2b(datei.read(), digest_size=8).hexdigest()
+    tabelle = pd.read_csv(pfad, dtype={'PLZ': str, 'Ort': str})
+    if not {'Lat', 'Lon'} <= set(tabelle.columns):
+        logger.warning("Zentroid-Tabelle %s ohne Spalten Lat/Lon, Geokodierung deaktiviert.", pfad)
+        return None
+    # Fehlt PLZ oder Ort in der Tabelle, bleibt die jeweilige Zuordnung leer
+    tabelle['_plz'] = _normalisiere_plz(tabelle['PLZ']) if 'PLZ' in tabelle.columns else ''
+    tabelle['_ort'] = _normalisiere_ort(tabelle['Ort']) if 'Ort' in tabelle.columns else ''
+    je_plz = tabelle[tabelle['_plz'] != ''].groupby('_plz')[['Lat', 'Lon']].mean()
+    je_ort = tabelle[tabelle['_ort'] != ''].groupby('_ort')[['Lat', 'Lon']].mean()
+    return je_plz, je_ort, version
+
+
+def hole_zentroide():
+    """Gibt (je_plz, je_ort, version) zurück oder None, wenn keine lokale Zentroid-Tabelle vorhanden ist."""
+    if not os.path.exists(ZENTROIDE_PFAD):
+        return None
+    return _lade_zentroide(ZENTROIDE_PFAD, os.path.getmtime(ZENTROIDE_PFAD))
+
+
+def _normalisiere_plz(werte):
+    plz = werte.fillna('').astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+    return plz.where(plz == '', plz.str.zfill(5))
+
+
+def _normalisiere_ort(werte):
+    return werte.fillna('').astype(str).str.strip().str.lower()
+
+
+def _adress_hash(plz, ort, version):
+    # Mit dem Tabellenstand im Schlüssel liefert eine neue Zentroid-Tabelle keine veralteten Treffer
+    rahmen = pd.DataFrame({'plz': plz.values, 'ort': ort.values, 'tabelle': version})
+    return pd.util.hash_pandas_object(rahmen, index=False).map('{:016x}'.format).values
+
+
+def _lies_cache(hashes):
+    if not os.path.exists(CACHE_PFAD) or len(hashes) == 0:
+        return pd.DataFrame(columns=['adress_hash', 'lat', 'lon', 'praezision'])
+    with _cache_lock, closing(sqlite3.connect(CACHE_PFAD)) as conn:
+        # Ein Abruf für alle Hashes über eine temporäre Tabelle statt einer Abfrage pro Zeile
+        conn.execute('CREATE TEMP TABLE gesucht (adress_hash TEXT PRIMARY KEY)')
+        conn.executemany('INSERT OR IGNORE INTO gesucht VALUES (?)', [(h,) for h in hashes])
+        return pd.read_sql_query(
+            'SELECT c.adress_hash, c.lat, c.lon, c.praezision FROM geocache c JOIN gesucht g USING (adress_hash)',
+            conn
+        )
+
+
+def _schreibe_cache(ergebnisse):
+    if ergebnisse.empty:
+        return
+    os.makedirs(os.path.dirname(CACHE_PFAD), exist_ok=True)
+    with _cache_lock, closing(sqlite3.connect(CACHE_PFAD)) as conn:
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS geocache (adress_hash TEXT PRIMARY KEY, lat REAL, lon REAL, praezision TEXT)'
+        )
+        conn.executemany(
+            'INSERT OR REPLACE INTO geocache VALUES (?, ?, ?, ?)',
+            ergebnisse[['adress_hash', 'lat', 'lon', 'praezision']].itertuples(index=False, name=None)
+        )
+        conn.commit()
+
+
+def fuelle_koordinaten(df, lat_spalte, lon_spalte, plz_spalte, ort_spalte, praezision_spalte):
+    """
+    Ergänzt fehlende Koordinaten offline aus der Zentroid-Tabelle (erst PLZ, dann Ort).
+
+    Alle Zeilen werden gemeinsam per Join verarbeitet; bereits geokodierte Adressen kommen
+    aus dem Disk-Cache. Die Koordinatenspalten sind danach numerisch, `praezision_spalte`
+    enthält 'original', 'plz', 'ort' oder NaN (weiterhin ohne Koordinaten).
+
+    Fehlen beide Adressspalten oder die Zentroid-Tabelle, werden nur Typen und Präzision gesetzt;
+    fehlt nur eine, wird über die andere geokodiert.
+    """
+    df = df.copy()
+    for spalte in (lat_spalte, lon_spalte):
+        if spalte in df.columns:
+            # Immer float64, unabhängig davon, welche Zeilen gerade aufbereitet werden (inkrementeller Sync)
+            df[spalte] = pd.to_numeric(df[spalte].replace('', np.nan), errors='coerce').astype(float)
+        else:
+            df[spalte] = np.nan
+
+    vorhanden = df[lat_spalte].notna() & df[lon_spalte].notna()
+    df[praezision_spalte] = pd.Series(np.where(vorhanden, PRAEZISION_ORIGINAL, None), index=df.index, dtype=object)
+
+    fehlend = ~vorhanden
+    hat_plz_spalte, hat_ort_spalte = plz_spalte in df.columns, ort_spalte in df.columns
+    if not fehlend.any() or not (hat_plz_spalte or hat_ort_spalte):
+        return df
+    zentroide = hole_zentroide()
+    if zentroide is None:
+        return df
+    je_plz, je_ort, version = zentroide
+
+    leer = pd.Series('', index=df.index)
+    plz = _normalisiere_plz(df.loc[fehlend, plz_spalte] if hat_plz_spalte else leer[fehlend])
+    ort = _normalisiere_ort(df.loc[fehlend, ort_spalte] if hat_ort_spalte else leer[fehlend])
+    offen = pd.DataFrame({'_plz': plz, '_ort': ort, 'adress_hash': _adress_hash(plz, ort, version)},
+                         index=plz.index)
+    offen = offen[(offen['_plz'] != '') | (offen['_ort'] != '')]
+    if offen.empty:
+        return df
+
+    # 1. Disk-Cache
+    cache = _lies_cache(offen['adress_hash'].unique().tolist()).set_index('adress_hash')
+    treffer = offen[['adress_hash']].join(cache, on='adress_hash')
+    treffer[['lat', 'lon']] = treffer[['lat', 'lon']].astype(float)
+
+    # 2. Zentroid-Tabelle für alles, was nicht im Cache ist
+    neu = treffer['lat'].isna()
+    if neu.any():
+        kandidaten = offen[neu]
+        per_plz = kandidaten[['_plz']].join(je_plz, on='_plz')
+        per_ort = kandidaten[['_ort']].join(je_ort, on='_ort')
+        hat_plz = per_plz['Lat'].notna()
+        treffer.loc[kandidaten.index, 'lat'] = per_plz['Lat'].where(hat_plz, per_ort['Lat'])
+        treffer.loc[kandidaten.index, 'lon'] = per_plz['Lon'].where(hat_plz, per_ort['Lon'])
+        treffer.loc[kandidaten.index, 'praezision'] = np.where(
+            hat_plz, PRAEZISION_PLZ, np.where(per_ort['Lat'].notna(), PRAEZISION_ORT, None)
+        )
+        gefunden = treffer.loc[kandidaten.index].dropna(subset=['lat', 'lon'])
+        _schreibe_cache(gefunden.drop_duplicates('adress_hash'))
+
+    aufgeloest = treffer.dropna(subset=['lat', 'lon'])
+    df.loc[aufgeloest.index, lat_spalte] = aufgeloest['lat']
+    df.loc[aufgeloest.index, lon_spalte] = aufgeloest['lon']
+    df.loc[aufgeloest.index, praezision_spalte] = aufgeloest['praezision']
+    return df
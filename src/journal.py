@@ -0,0 +1,292 @@
+# journal.py
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import closing
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_PFAD = os.environ.get(
+    'GEBIETSPLANER_JOURNAL',
+    os.path.join(os.path.expanduser('~'), '.cache', 'gebietsplaner', 'journal.db')
+)
+# Ein beanspruchter Auftrag gilt danach als verwaist (Prozess abgestürzt) und wird erneut vergeben
+LEASE_SEKUNDEN = 300
+# So lange bleiben erledigte Aufträge (ohne Zeilen) zur Nachverfolgung stehen
+ERLEDIGT_AUFBEWAHRUNG_SEKUNDEN = 7 * 24 * 3600
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sitzungen (
+    sitzung TEXT PRIMARY KEY,
+    szenario TEXT,
+    aktualisiert REAL
+);
+CREATE TABLE IF NOT EXISTS zuweisungen (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    sitzung TEXT NOT NULL,
+    kunden_nr REAL NOT NULL,
+    alter_vertreter TEXT,
+    neuer_vertreter TEXT,
+    zeitpunkt REAL
+);
+CREATE INDEX IF NOT EXISTS idx_zuweisungen_sitzung ON zuweisungen(sitzung, id);
+CREATE TABLE IF NOT EXISTS szenario_auftraege (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    szenario_name TEXT NOT NULL,
+    zeilen TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'offen',
+    versuche INTEGER NOT NULL DEFAULT 0,
+    letzter_fehler TEXT,
+    erstellt REAL,
+    erledigt REAL,
+    besitzer TEXT,
+    beansprucht REAL
+);
+CREATE INDEX IF NOT EXISTS idx_auftraege_status ON szenario_auftraege(status, id);
+"""
+
+# Spalten, die älteren Journal-Dateien noch fehlen können
+_NACHTRAEGLICHE_SPALTEN = {'szenario_auftraege': {'besitzer': 'TEXT', 'beansprucht': 'REAL'}}
+
+
+def neuer_besitzer(name='worker'):
+    """Eindeutige Kennung eines Schreibers (Host, Prozess, Instanz) für Leases im Journal."""
+    return f"{name}@{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class Journal:
+    """
+    Lokales, dauerhaftes Journal (SQLite im WAL-Modus) für Zuweisungsänderungen pro Sitzung
+    und für noch nicht nach Google Sheets geschriebene Szenarien.
+
+    Jeder Aufruf öffnet eine eigene kurze Verbindung, damit UI-Threads und Schreib-Worker
+    parallel zugreifen können.
+
+    Szenario-Aufträge durchlaufen 'offen' -> 'laeuft' (beansprucht von genau einem Schreiber,
+    mit Lease) -> 'erledigt'. Mehrere Prozesse (App, Kommandozeile) können dasselbe Journal
+    abarbeiten, ohne Aufträge doppelt zu schreiben.
+    """
+
+    def __init__(self, pfad=JOURNAL_PFAD):
+        self.pfad = pfad
+        os.makedirs(os.path.dirname(pfad), exist_ok=True)
+        with closing(self._verbinde()) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+            for tabelle, spalten in _NACHTRAEGLICHE_SPALTEN.items():
+                vorhanden = {zeile[1] for zeile in conn.execute(f'PRAGMA table_info({tabelle})')}
+                for spalte, typ in spalten.items():
+                    if spalte not in vorhanden:
+                        conn.execute(f'ALTER TABLE {tabelle} ADD COLUMN {spalte} {typ}')
+
+    def _verbinde(self):
+        conn = sqlite3.connect(self.pfad, timeout=10)
+        conn.execute('PRAGMA synchronous=NORMAL')
+        return conn
+
+    # --- Sitzungen / Autosave ---
+
+    def setze_basis(self, sitzung, szenario):
+        """Merkt sich das geladene Szenario einer Sitzung und verwirft deren bisherige Änderungen."""
+        with closing(self._verbinde()) as conn, conn:
+            conn.execute('DELETE FROM zuweisungen WHERE sitzung = ?', (sitzung,))
+            conn.execute('INSERT OR REPLACE INTO sitzungen VALUES (?, ?, ?)', (sitzung, szenario, time.time()))
+
+    def notiere_zuweisung(self, sitzung, kunden_nr, alter_vertreter, neuer_vertreter):
+        with closing(self._verbinde()) as conn, conn:
+            conn.execute(
+                'INSERT INTO zuweisungen (sitzung, kunden_nr, alter_vertreter, neuer_vertreter, zeitpunkt) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (sitzung, float(kunden_nr), alter_vertreter, neuer_vertreter, time.time())
+            )
+            conn.execute('UPDATE sitzungen SET aktualisiert = ? WHERE sitzung = ?', (time.time(), sitzung))
+
+    def entferne_letzte_zuweisung(self, sitzung):
+        with closing(self._verbinde()) as conn, conn:
+            conn.execute(
+                'DELETE FROM zuweisungen WHERE id = (SELECT MAX(id) FROM zuweisungen WHERE sitzung = ?)',
+                (sitzung,)
+            )
+
+    def lade_sitzung(self, sitzung):
+        """Gibt (szenario, [(kunden_nr, alter_vertreter, neuer_vertreter, zeitpunkt), ...]) zurück."""
+        with closing(self._verbinde()) as conn:
+            zeile = conn.execute('SELECT szenario FROM sitzungen WHERE sitzung = ?', (sitzung,)).fetchone()
+            aenderungen = conn.execute(
+                'SELECT kunden_nr, alter_vertreter, neuer_vertreter, zeitpunkt FROM zuweisungen '
+                'WHERE sitzung = ? ORDER BY id',
+                (sitzung,)
+            ).fetchall()
+        return (zeile[0] if zeile else None), aenderungen
+
+    # --- Szenario-Aufträge (Write-Behind) ---
+
+    def plane_szenario(self, szenario_name, zeilen):
+        """Legt einen Schreibauftrag an. `zeilen` ist eine Liste [Kunden_Nr, Vertreter_Name]."""
+        with closing(self._verbinde()) as conn, conn:
+            cursor = conn.execute(
+                'INSERT INTO szenario_auftraege (szenario_name, zeilen, erstellt) VALUES (?, ?, ?)',
+                (szenario_name, json.dumps(zeilen), time.time())
+            )
+            return cursor.lastrowid
+
+    def beanspruche_auftraege(self, besitzer, limit=20, lease_sekunden=LEASE_SEKUNDEN):
+        """
+        Beansprucht atomar bis zu `limit` offene Aufträge (älteste zuerst) für `besitzer`.
+        Aufträge, deren Lease abgelaufen ist, werden dabei zurückgeholt.
+
+        Returns:
+            Liste von Dicts (id, szenario_name, zeilen, versuche); leer, wenn nichts offen ist
+        """
+        jetzt = time.time()
+        with closing(self._verbinde()) as conn:
+            # IMMEDIATE: Schreibsperre vor dem Auswählen, damit kein zweiter Schreiber dieselben Zeilen erwischt
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                zeilen = conn.execute(
+                    "UPDATE szenario_auftraege SET status = 'laeuft', besitzer = ?, beansprucht = ? "
+                    "WHERE id IN (SELECT id FROM szenario_auftraege "
+                    "             WHERE status = 'offen' OR (status = 'laeuft' AND beansprucht < ?) "
+                    "             ORDER BY id LIMIT ?) "
+                    "RETURNING id, szenario_name, zeilen, versuche",
+                    (besitzer, jetzt, jetzt - lease_sekunden, limit)
+                ).fetchall()
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+        return [{'id': i, 'szenario_name': name, 'zeilen': json.loads(daten), 'versuche': versuche}
+                for i, name, daten, versuche in sorted(zeilen)]
+
+    def offene_szenario(self, szenario_name):
+        """Zeilen des jüngsten noch nicht geschriebenen Auftrags für ein Szenario oder None."""
+        with closing(self._verbinde()) as conn:
+            zeile = conn.execute(
+                "SELECT zeilen FROM szenario_auftraege WHERE status IN ('offen', 'laeuft') AND szenario_name = ? "
+                "ORDER BY id DESC LIMIT 1",
+                (szenario_name,)
+            ).fetchone()
+        return json.loads(zeile[0]) if zeile else None
+
+    def offene_szenario_namen(self):
+        with closing(self._verbinde()) as conn:
+            return [z[0] for z in conn.execute(
+                "SELECT DISTINCT szenario_name FROM szenario_auftraege WHERE status IN ('offen', 'laeuft')"
+            )]
+
+    def markiere_erledigt(self, ids):
+        """Schließt Aufträge ab und räumt lange erledigte Aufträge aus dem Journal."""
+        jetzt = time.time()
+        with closing(self._verbinde()) as conn, conn:
+            conn.executemany(
+                "UPDATE szenario_auftraege SET status = 'erledigt', erledigt = ?, zeilen = '[]', besitzer = NULL "
+                "WHERE id = ?",
+                [(jetzt, i) for i in ids]
+            )
+            conn.execute(
+                "DELETE FROM szenario_auftraege WHERE status = 'erledigt' AND erledigt < ?",
+                (jetzt - ERLEDIGT_AUFBEWAHRUNG_SEKUNDEN,)
+            )
+
+    def markiere_fehlversuch(self, ids, fehler):
+        """Gibt beanspruchte Aufträge nach einem Fehler wieder frei."""
+        with closing(self._verbinde()) as conn, conn:
+            conn.executemany(
+                "UPDATE szenario_auftraege SET status = 'offen', besitzer = NULL, beansprucht = NULL, "
+                "versuche = versuche + 1, letzter_fehler = ? WHERE id = ? AND status = 'laeuft'",
+                [(str(fehler), i) for i in ids]
+            )
+
+    def status(self):
+        """Anzahl noch nicht geschriebener Aufträge, davon gerade beanspruchte, und letzter Fehler."""
+        with closing(self._verbinde()) as conn:
+            anzahl, laufend, fehler = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(status = 'laeuft'), 0), MAX(letzter_fehler) "
+                "FROM szenario_auftraege WHERE status IN ('offen', 'laeuft')"
+            ).fetchone()
+        return {'offen': anzahl, 'laeuft': laufend, 'letzter_fehler': fehler}
+
+
+class SchreibWorker:
+    """
+    Hintergrund-Thread, der offene Szenario-Aufträge gebündelt an eine Schreibfunktion übergibt.
+
+    Schlägt das Schreiben fehl, bleiben die Aufträge offen und werden mit wachsendem Abstand
+    erneut versucht; nichts geht verloren, auch nicht über Neustarts hinweg. Jeder Stapel wird
+    vorher im Journal beansprucht, sodass parallele Schreiber (auch in anderen Prozessen) nie
+    denselben Auftrag schreiben.
+
+    Args:
+        journal: Journal mit den Aufträgen
+        schreibe: Funktion(auftraege), die alle übergebenen Aufträge in einem Rutsch schreibt
+        nach_schreiben: Optionaler Callback nach erfolgreichem Schreiben (z.B. Cache invalidieren)
+    """
+
+    def __init__(self, journal, schreibe, nach_schreiben=None, intervall=5.0, max_wartezeit=300.0,
+                 besitzer=None):
+        self._journal = journal
+        self.besitzer = besitzer or neuer_besitzer()
+        self._schreibe = schreibe
+        self._nach_schreiben = nach_schreiben
+        self.intervall = intervall
+        self.max_wartezeit = max_wartezeit
+        self._signal = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def starte(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._schleife, name="szenario-schreiber", daemon=True)
+            self._thread.start()
+
+    def wecke(self):
+        """Signalisiert neue Arbeit (der Worker wartet sonst bis zum nächsten Intervall)."""
+        self.starte()
+        self._signal.set()
+
+    def schreibe_jetzt(self):
+        """
+        Schreibt einen Stapel offener Aufträge synchron (z.B. aus einem nächtlichen Job).
+        Gibt die Anzahl geschriebener Aufträge zurück; Fehler werden weitergereicht.
+        """
+        auftraege = self._journal.beanspruche_auftraege(self.besitzer)
+        if not auftraege:
+            return 0
+        ids = [a['id'] for a in auftraege]
+        try:
+            self._schreibe(auftraege)
+        except BaseException as e:
+            self._journal.markiere_fehlversuch(ids, e)
+            raise
+        self._journal.markiere_erledigt(ids)
+        if self._nach_schreiben is not None:
+            try:
+                self._nach_schreiben()
+            except Exception as e:
+                logger.warning("Nachbearbeitung nach dem Schreiben fehlgeschlagen: %s", e)
+        return len(ids)
+
+    def _schleife(self):
+        wartezeit = self.intervall
+        versuche = 0
+        while True:
+            self._signal.wait(wartezeit)
+            self._signal.clear()
+            try:
+                anzahl = self.schreibe_jetzt()
+            except Exception as e:
+                logger.warning("Schreiben offener Szenario-Aufträge fehlgeschlagen: %s", e)
+                versuche += 1
+                wartezeit = min(self.max_wartezeit, self.intervall * 2 ** versuche)
+                continue
+            versuche = 0
+            # Volle Stapel direkt weiterschreiben, sonst bis zum nächsten Intervall warten
+            wartezeit = 0 if anzahl >= 20 else self.intervall
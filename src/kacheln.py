@@ -0,0 +1,203 @@
+# kacheln.py
+
+import hashlib
+import hmac
+import io
+import os
+import re
+import secrets
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import matplotlib.colors as mcolors
+import matplotlib.image as mimage
+
+KACHEL_GROESSE = 256
+KACHEL_PORT = int(os.environ.get('GEBIETSPLANER_KACHEL_PORT', '8765'))
+# Standardmäßig nur lokal erreichbar; für einen Reverse Proxy auf einem anderen Host explizit freigeben
+KACHEL_HOST = os.environ.get('GEBIETSPLANER_KACHEL_HOST', '127.0.0.1')
+# Vom Browser erreichbare Basis-URL des Kachelservers (z.B. https://.../kacheln hinter einem Reverse Proxy).
+# Ohne diese Angabe gibt es keine Rasterkacheln: localhost zeigt beim Nutzer auf den eigenen Rechner,
+# und http-Kacheln werden auf einer https-Seite als Mixed Content blockiert.
+KACHEL_URL = os.environ.get('GEBIETSPLANER_KACHEL_URL', '').strip() or None
+
+MAX_QUELLEN = 32
+MAX_KACHELN = 4096
+
+_PFAD_MUSTER = re.compile(r'^/kacheln/([0-9a-zA-Z_-]+)/([0-9a-f]{32})/(\d+)/(\d+)/(\d+)\.png$')
+
+
+def _radius_fuer_zoom(z):
+    # Bei kleinen Zoomstufen kleine Punkte, damit dichte Gebiete nicht zu Flächen verschmelzen
+    return 1 if z < 7 else 2 if z < 10 else 3
+
+
+def _scheiben_offsets(radius):
+    dx, dy = np.meshgrid(np.arange(-radius, radius + 1), np.arange(-radius, radius + 1))
+    maske = dx ** 2 + dy ** 2 <= radius ** 2
+    return dx[maske], dy[maske]
+
+
+class KachelQuelle:
+    """
+    Vorberechnete Punktdaten (Web-Mercator, Farbe, Deckkraft) für das Rastern von XYZ-Kacheln.
+
+    Args:
+        lat, lon: Arrays der Kundenkoordinaten
+        farben: Liste von Matplotlib-Farben (eine pro Kunde)
+        gewichte: Werte für die Deckkraft (z.B. Umsatz), werden logarithmisch auf 0.25..1 skaliert
+    """
+
+    def __init__(self, lat, lon, farben, gewichte):
+        lat = np.clip(np.asarray(lat, dtype=float), -85.0511, 85.0511)
+        lon = np.asarray(lon, dtype=float)
+        # Normierte Mercator-Koordinaten in [0, 1]; Pixel auf Zoom z = Wert * 256 * 2**z
+        self.x = (lon + 180.0) / 360.0
+        self.y = (1.0 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2.0
+        self.rgb = np.array([mcolors.to_rgb(f) for f in farben], dtype=float).reshape(-1, 3)
+        gewichte = np.log1p(np.clip(np.nan_to_num(np.asarray(gewichte, dtype=float)), 0, None))
+        spanne = gewichte.max() if len(gewichte) and gewichte.max() > 0 else 1.0
+        self.alpha = 0.25 + 0.75 * gewichte / spanne
+
+    def rendere(self, z, x, y):
+        """Rastert eine Kachel und gibt ein RGBA-Array (256, 256, 4) mit Werten in [0, 1] zurück."""
+        groesse = KACHEL_GROESSE
+        radius = _radius_fuer_zoom(z)
+        skala = groesse * 2 ** z
+        px = self.x * skala - x * groesse
+        py = self.y * skala - y * groesse
+        im_bereich = (px > -radius) & (px < groesse + radius) & (py > -radius) & (py < groesse + radius)
+
+        bild = np.zeros((groesse * groesse, 4))
+        if not im_bereich.any():
+            return bild.reshape(groesse, groesse, 4)
+
+        dx, dy = _scheiben_offsets(radius)
+        ix = (px[im_bereich].astype(int)[:, None] + dx[None, :]).ravel()
+        iy = (py[im_bereich].astype(int)[:, None] + dy[None, :]).ravel()
+        gewicht = np.repeat(self.alpha[im_bereich], len(dx))
+        rgb = np.repeat(self.rgb[im_bereich], len(dx), axis=0)
+        gueltig = (ix >= 0) & (ix < groesse) & (iy >= 0) & (iy < groesse)
+        pixel = iy[gueltig] * groesse + ix[gueltig]
+        gewicht = gewicht[gueltig]
+
+        # Binning: Deckkraft aufsummieren, Farbe als deckkraftgewichtetes Mittel
+        summe = np.bincount(pixel, weights=gewicht, minlength=groesse * groesse)
+        belegt = summe > 0
+        for kanal in range(3):
+            kanal_summe = np.bincount(pixel, weights=gewicht * rgb[gueltig, kanal], minlength=groesse * groesse)
+            bild[belegt, kanal] = kanal_summe[belegt] / summe[belegt]
+        bild[:, 3] = 1.0 - np.exp(-summe)
+        return bild.reshape(groesse, groesse, 4)
+
+    def png(self, z, x, y):
+        puffer = io.BytesIO()
+        mimage.imsave(puffer, self.rendere(z, x, y), format='png')
+        return puffer.getvalue()
+
+
+class KachelServer:
+    """
+    Liefert Kacheln registrierter Quellen per HTTP aus: /kacheln/<schluessel>/<signatur>/<z>/<x>/<y>.png
+
+    Kacheln werden bei Bedarf erzeugt und in einem LRU-Cache gehalten; Quellen werden über einen
+    Schlüssel aus Zuweisungsstand und Filter identifiziert. Die Signatur (HMAC mit einem zufälligen
+    Prozessgeheimnis) macht die URLs unerratbar: nur wer eine Karte von der App bekommen hat,
+    kann ihre Kacheln abrufen.
+    """
+
+    def __init__(self, port=KACHEL_PORT, basis_url=KACHEL_URL, host=KACHEL_HOST):
+        self.port = port
+        self.host = host
+        self.basis_url = basis_url.rstrip('/') if basis_url else None
+        self._geheimnis = secrets.token_bytes(32)
+        self._quellen = OrderedDict()
+        self._kacheln = OrderedDict()
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def verfuegbar(self):
+        """True, wenn eine vom Browser erreichbare URL konfiguriert ist (GEBIETSPLANER_KACHEL_URL)."""
+        return self.basis_url is not None
+
+    def _signatur(self, schluessel):
+        return hmac.new(self._geheimnis, schluessel.encode(), hashlib.sha256).hexdigest()[:32]
+
+    def registriere(self, schluessel, quelle_fabrik):
+        """
+        Registriert eine Quelle (nur beim ersten Mal wird `quelle_fabrik()` aufgerufen)
+        und gibt die URL-Vorlage für folium.TileLayer zurück.
+        """
+        if not self.verfuegbar:
+            raise RuntimeError("Kein Kachelserver konfiguriert (GEBIETSPLANER_KACHEL_URL).")
+        with self._lock:
+            if schluessel in self._quellen:
+                self._quellen.move_to_end(schluessel)
+            else:
+                self._quellen[schluessel] = quelle_fabrik()
+                while len(self._quellen) > MAX_QUELLEN:
+                    verdraengt, _ = self._quellen.popitem(last=False)
+                    for k in [k for k in self._kacheln if k[0] == verdraengt]:
+                        del self._kacheln[k]
+        self.starte()
+        return f"{self.basis_url}/kacheln/{schluessel}/{self._signatur(schluessel)}/{{z}}/{{x}}/{{y}}.png"
+
+    def kachel(self, schluessel, z, x, y):
+        """Gibt die PNG-Bytes einer Kachel zurück oder None, wenn die Quelle unbekannt ist."""
+        key = (schluessel, z, x, y)
+        with self._lock:
+            if key in self._kacheln:
+                self._kacheln.move_to_end(key)
+                return self._kacheln[key]
+            quelle = self._quellen.get(schluessel)
+        if quelle is None:
+            return None
+        daten = quelle.png(z, x, y)
+        with self._lock:
+            self._kacheln[key] = daten
+            while len(self._kacheln) > MAX_KACHELN:
+                self._kacheln.popitem(last=False)
+        return daten
+
+    def starte(self):
+        """Startet den HTTP-Server einmalig in einem Daemon-Thread."""
+        if self._server is not None:
+            return
+        server_instanz = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                treffer = _PFAD_MUSTER.match(self.path.split('?')[0])
+                daten = None
+                if treffer and hmac.compare_digest(treffer.group(2), server_instanz._signatur(treffer.group(1))):
+                    schluessel, z, x, y = treffer.group(1), *map(int, treffer.groups()[2:])
+                    daten = server_instanz.kachel(schluessel, z, x, y)
+                if daten is None:
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'image/png')
+                # Kundendaten: nur im Browser cachen, nicht in geteilten Proxies; Leaflet lädt Kacheln
+                # als <img>, ein CORS-Header ist dafür nicht nötig
+                self.send_header('Cache-Control', 'private, max-age=3600')
+                self.send_header('Content-Length', str(len(daten)))
+                self.end_headers()
+                self.wfile.write(daten)
+
+            def log_message(self, format, *args):
+                pass
+
+        with self._lock:
+            if self._server is not None:
+                return
+            self._server = ThreadingHTTPServer((self.host, self.port), _Handler)
+            self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="kachelserver", daemon=True).start()
+
+
+# Ein Kachelserver pro Prozess, geteilt von allen Sessions
+kachel_server = KachelServer()
@@ -1,12 +1,38 @@
 # karten.py
 
-import streamlit as st
 import folium
+from branca.element import MacroElement, Template
 # from scipy.spatial import ConvexHull  # AUSKOMMENTIERT: Nicht mehr benötigt
 import pandas as pd
+import matplotlib.colors as mcolors
 
-@st.cache_data(ttl=3600)  # 1 Stunde Cache für Karten-Rendering
-def zeichne_karte(dataframe, farb_map, selected_customer_id=None):
+from src.kacheln import KachelQuelle, kachel_server
+from src.cache import cache
+
+# Ab dieser Kundenanzahl rendert der automatische Modus serverseitig als Rasterkacheln
+RASTER_SCHWELLE = 20000
+# Ebene und Filtereintrag für Kunden ohne Verlag (sonst fielen sie beim Gruppieren weg)
+OHNE_VERLAG = '(ohne Verlag)'
+
+def farb_zuordnung(vertreter_namen):
+    """Feste Farbe je Vertreter (alphabetisch), damit Karten verschiedener Szenarien vergleichbar sind."""
+    palette = list(mcolors.TABLEAU_COLORS.values()) + list(mcolors.CSS4_COLORS.values())
+    return {name: palette[i % len(palette)] for i, name in enumerate(sorted(set(vertreter_namen)))}
+
+def ist_rasterkarte(dataframe, modus, kachel_schluessel=None):
+    """
+    True, wenn `zeichne_karte` mit diesem Modus Rasterkacheln statt Markern zeichnet.
+    Ohne vom Browser erreichbaren Kachelserver (GEBIETSPLANER_KACHEL_URL) bliebe die Karte leer,
+    dann wird immer vektoriell gezeichnet.
+    """
+    if not kachel_server.verfuegbar:
+        return False
+    if modus == 'auto':
+        return len(dataframe) > RASTER_SCHWELLE and bool(kachel_schluessel)
+    return modus == 'raster'
+
+def zeichne_karte(dataframe, farb_map, selected_customer_id=None, modus='vektor', kachel_schluessel=None,
+                  cache_schluessel=None, cache_tags=()):
     """
     Erstellt ein interaktives Folium-Kartenobjekt, ohne es anzuzeigen.
     Gibt das Kartenobjekt zur weiteren Verwendung zurück.
@@ -15,9 +41,109 @@ def zeichne_karte(dataframe, farb_map, selected_customer_id=None):
         dataframe: DataFrame mit Kundendaten
         farb_map: Dictionary mit Vertreter-Farben
         selected_customer_id: ID des aktuell ausgewählten Kunden (optional)
+        modus: 'vektor' (ein Marker pro Kunde), 'raster' (serverseitige PNG-Kacheln, nur mit
+            konfiguriertem GEBIETSPLANER_KACHEL_URL, sonst 'vektor'), 'ebenen' (Marker in Ebenen je
+            Vertreter und Verlag, gefiltert im Browser) oder 'auto'
+        kachel_schluessel: Schlüssel aus Zuweisungsstand und Filter (für den Raster-Modus erforderlich)
+        cache_schluessel: Tupel aus Versions-Tokens; wenn gesetzt, wird die Karte im VersionsCache
+            gehalten, ohne DataFrame und Farbzuordnung zu hashen
+        cache_tags: Zusätzliche Tags für den Cache-Eintrag (immer dabei: 'karten')
+    """
+    if ist_rasterkarte(dataframe, modus, kachel_schluessel):
+        modus = 'raster'
+    elif modus in ('auto', 'raster'):
+        modus = 'vektor'
+    if modus == 'raster':
+        # Registrierung außerhalb des Caches, damit der Kachelserver die Quelle immer kennt
+        kachel_url = kachel_server.registriere(
+            kachel_schluessel,
+            lambda: KachelQuelle(
+                dataframe['Latitude'].values,
+                dataframe['Longitude'].values,
+                dataframe['Vertreter_Name'].map(farb_map).fillna('gray').values,
+                dataframe['Umsatz_2024'].values
+            )
+        )
+        baue_karte = lambda: _zeichne_raster_karte(dataframe, kachel_url, selected_customer_id)
+    elif modus == 'ebenen':
+        baue_karte = lambda: _zeichne_ebenen_karte(dataframe, farb_map, selected_customer_id)
+    else:
+        baue_karte = lambda: _zeichne_vektor_karte(dataframe, farb_map, selected_customer_id)
+
+    if cache_schluessel is None:
+        return baue_karte()
+    return cache.hole(
+        ('karte', modus, selected_customer_id) + tuple(cache_schluessel),
+        baue_karte,
+        tags=('karten',) + tuple(cache_tags),
+        ttl=3600  # 1 Stunde Cache für Karten-Rendering
+    )
+
+def _zeichne_wohnorte(karte, dataframe, ziele=None):
+    """
+    Zeichnet die Wohnorte der Vertreter als Stern-Marker.
+    `ziele` ordnet einem Vertreter optional eine eigene Ebene zu (sonst direkt auf die Karte).
+    """
+    # Wohnort-Marker für alle Vertreter (ein groupby statt einer Filterung pro Vertreter)
+    wohnorte = dataframe.groupby('Vertreter_Name', sort=False).agg(
+        wohnort_lat=('Wohnort_Lat', 'first'),
+        wohnort_lon=('Wohnort_Lon', 'first'),
+        anzahl=('Kunden_Nr', 'size')
+    )
+    for vertreter_name, wohnort in wohnorte.iterrows():
+        # Wohnort als Stern-Marker - nur wenn Koordinaten vorhanden
+        if pd.notna(wohnort['wohnort_lat']) and pd.notna(wohnort['wohnort_lon']):
+            folium.Marker(
+                [wohnort['wohnort_lat'], wohnort['wohnort_lon']],
+                popup=f"<b>🏠 Zentrum: {vertreter_name}</b><br>Kunden: {wohnort['anzahl']}",
+                icon=folium.Icon(color='black', icon_color='white', icon='star', prefix='fa')
+            ).add_to(ziele[vertreter_name] if ziele else karte)
+
+def _zeichne_raster_karte(dataframe, kachel_url, selected_customer_id=None):
+    """
+    Karte mit Kunden als Rasterkacheln: Aufwand im Browser unabhängig von der Kundenanzahl.
+    Die Kacheln rendert der Kachelserver; die Karte selbst (Wohnorte und ausgewählter Kunde als
+    Marker) wird wie die anderen Modi über `zeichne_karte` im Karten-Cache gehalten, wenn ein
+    cache_schluessel übergeben wird.
     """
+    karte = folium.Map(location=[51.1657, 10.4515], zoom_start=6, tiles="cartodbpositron")
+    folium.TileLayer(
+        tiles=kachel_url,
+        attr='Gebietsplaner',
+        name='Kunden',
+        overlay=True,
+        control=False,
+        max_zoom=18
+    ).add_to(karte)
+    _zeichne_wohnorte(karte, dataframe)
+
+    # Nur der ausgewählte Kunde wird als eigener Marker gezeichnet
+    _zeichne_auswahl(karte, dataframe, selected_customer_id)
+    return karte
+
+def _zeichne_auswahl(karte, dataframe, selected_customer_id):
+    """Hebt den ausgewählten Kunden hervor; nur er bekommt ein Popup mit Details."""
+    if selected_customer_id is None:
+        return
+    for _, row in dataframe[dataframe['Kunden_Nr'] == selected_customer_id].iterrows():
+        popup_html = f"ID: {row['Kunden_Nr']}<br><b>{row['Kunde_ID_Name']}</b><br>Vertreter: {row['Vertreter_Name']}<br>Umsatz: {int(row['Umsatz_2024']):,} €"
+        folium.CircleMarker(
+            location=[row['Latitude'], row['Longitude']],
+            radius=15,  # Größer für ausgewählte Kunden
+            popup=popup_html,
+            color='red',
+            weight=4,
+            fill=True,
+            fill_color='red',
+            fill_opacity=1.0,
+            tooltip=f"Kunde {row['Kunden_Nr']}: {row['Kunde_ID_Name']}<br>Vertreter: {row['Vertreter_Name']}"
+        ).add_to(karte)
+
+def _zeichne_vektor_karte(dataframe, farb_map, selected_customer_id=None):
+    """Karte mit einem CircleMarker pro Kunde (für kleine bis mittlere Kundenmengen)."""
     # Karte initialisieren
     karte = folium.Map(location=[51.1657, 10.4515], zoom_start=6, tiles="cartodbpositron")
+    _zeichne_wohnorte(karte, dataframe)
 
     # AUSKOMMENTIERT: ConvexHull für bessere Performance
     # for vertreter_name in dataframe['Vertreter_Name'].unique():
@@ -40,51 +166,205 @@ def zeichne_karte(dataframe, farb_map, selected_customer_id=None):
     #         except Exception:
     #             pass
             
-    # Wohnort-Marker für alle Vertreter
-    for vertreter_name in dataframe['Vertreter_Name'].unique():
-        vertreter_daten = dataframe[dataframe['Vertreter_Name'] == vertreter_name]
+    _zeichne_kunden(karte, dataframe, farb_map, selected_customer_id)
+    _zeichne_auswahl(karte, dataframe, selected_customer_id)
         
-        # Wohnort als Stern-Marker - nur wenn Koordinaten vorhanden
-        wohnort_lat = vertreter_daten['Wohnort_Lat'].iloc[0]
-        wohnort_lon = vertreter_daten['Wohnort_Lon'].iloc[0]
-        if pd.notna(wohnort_lat) and pd.notna(wohnort_lon):
-            folium.Marker(
-                [wohnort_lat, wohnort_lon],
-                popup=f"<b>🏠 Zentrum: {vertreter_name}</b><br>Kunden: {len(vertreter_daten)}",
-                icon=folium.Icon(color='black', icon_color='white', icon='star', prefix='fa')
-            ).add_to(karte)
+    return karte
 
-    # OPTIMIERT: Kundenpunkte in Batch hinzufügen
-    for _, row in dataframe.iterrows():
-        is_selected = row['Kunden_Nr'] == selected_customer_id
-        
-        # Vereinfachte Popup-Informationen für bessere Klick-Erkennung
-        popup_html = f"ID: {row['Kunden_Nr']}<br><b>{row['Kunde_ID_Name']}</b><br>Vertreter: {row['Vertreter_Name']}<br>Umsatz: {int(row['Umsatz_2024']):,} €<br><small>👆 Klicken zum Auswählen</small>"
-        
-        # Bestimme Größe und Farbe basierend auf Auswahl
-        if is_selected:
-            radius = 15  # Größer für ausgewählte Kunden
-            color = 'red'
-            weight = 4
-            fill_opacity = 1.0
-        else:
-            radius = 10  # Größer für bessere Klickbarkeit
-            color = farb_map.get(row['Vertreter_Name'], 'gray')
-            weight = 2
-            fill_opacity = 0.8
-        
+def _zeichne_kunden(ziel, dataframe, farb_map, selected_customer_id=None):
+    """Ein CircleMarker pro Kunde auf der Karte oder in einer Ebene."""
+    # OPTIMIERT: Kundenpunkte ohne Popup-HTML; Klicks werden über den KD-Baum (kunden_index.py) aufgelöst
+    for row in dataframe[['Kunden_Nr', 'Kunde_ID_Name', 'Vertreter_Name', 'Latitude', 'Longitude']].itertuples(index=False):
+        if row.Kunden_Nr == selected_customer_id:
+            continue
+        color = farb_map.get(row.Vertreter_Name, 'gray')
         folium.CircleMarker(
-            location=[row['Latitude'], row['Longitude']],
-            radius=radius,
-            popup=popup_html,
+            location=[row.Latitude, row.Longitude],
+            radius=10,  # Größer für bessere Klickbarkeit
             color=color,
-            weight=weight,
+            weight=2,
             fill=True,
             fill_color=color,
-            fill_opacity=fill_opacity,
-            tooltip=f"Kunde {row['Kunden_Nr']}: {row['Kunde_ID_Name']}<br>Vertreter: {row['Vertreter_Name']}",
-            # Füge data-Attribut für einfachere Extraktion hinzu
-            popup_props={'data-customer-id': str(row['Kunden_Nr'])}
-        ).add_to(karte)
-        
-    return karte
\ No newline at end of file
+            fill_opacity=0.8,
+            tooltip=f"Kunde {row.Kunden_Nr}: {row.Kunde_ID_Name}<br>Vertreter: {row.Vertreter_Name}"
+        ).add_to(ziel)
+
+def _zeichne_ebenen_karte(dataframe, farb_map, selected_customer_id=None):
+    """
+    Karte mit allen Kunden in einer Ebene je Vertreter und Verlag sowie einem Filter-Steuerelement.
+
+    Die Karte hängt nicht von den Anzeige-Filtern ab: Sie wird pro Zuweisungsstand einmal gebaut
+    und übertragen; das Ein- und Ausblenden übernimmt der Browser ohne Rerun.
+    """
+    karte = folium.Map(location=[51.1657, 10.4515], zoom_start=6, tiles="cartodbpositron")
+
+    ebenen = []
+    wohnort_ebenen = {}
+    for vertreter_name in sorted(dataframe['Vertreter_Name'].dropna().unique()):
+        ebene = folium.FeatureGroup(name=f"{vertreter_name} (Wohnort)", control=False).add_to(karte)
+        wohnort_ebenen[vertreter_name] = ebene
+        ebenen.append((ebene, vertreter_name, None))
+    _zeichne_wohnorte(karte, dataframe, ziele=wohnort_ebenen)
+
+    verlag_spalte = dataframe['Verlag'].astype(object)
+    verlag_spalte = verlag_spalte.where(verlag_spalte.notna() & (verlag_spalte.astype(str).str.strip() != ''),
+                                        OHNE_VERLAG)
+    for (vertreter_name, verlag), gruppe in dataframe.groupby([dataframe['Vertreter_Name'], verlag_spalte],
+                                                              sort=True):
+        ebene = folium.FeatureGroup(name=f"{vertreter_name} / {verlag}", control=False).add_to(karte)
+        _zeichne_kunden(ebene, gruppe, farb_map, selected_customer_id)
+        ebenen.append((ebene, vertreter_name, verlag))
+
+    EbenenFilter(ebenen, farb_map).add_to(karte)
+    _zeichne_auswahl(karte, dataframe, selected_customer_id)
+    return karte
+
+
+class EbenenFilter(MacroElement):
+    """
+    Leaflet-Steuerelement (oben rechts) mit Verlag-Auswahl und Vertreter-Checkboxen, das die
+    Ebenen einer Karte rein im Browser ein- und ausblendet.
+
+    Args:
+        ebenen: Liste von (FeatureGroup, Vertreter, Verlag); Verlag None für Ebenen, die zu allen
+            Verlagen des Vertreters gehören (z.B. Wohnort)
+        farb_map: Farben für die Vertreter-Checkboxen
+    """
+
+    _template = Template("""
+        {% macro header(this, kwargs) %}
+        <style>
+            .ebenen-filter { background: white; padding: 8px; max-height: 420px; overflow-y: auto;
+                             font: 12px sans-serif; box-shadow: 0 1px 5px rgba(0,0,0,0.4); border-radius: 5px; }
+            .ebenen-filter select { width: 100%; margin-bottom: 6px; }
+            .ebenen-filter label { display: block; white-space: nowrap; }
+            .ebenen-filter .farbe { display: inline-block; width: 10px; height: 10px; border-radius: 50%;
+                                    margin: 0 4px; }
+            .ebenen-filter button { margin: 0 4px 6px 0; }
+        </style>
+        {% endmacro %}
+
+        {% macro script(this, kwargs) %}
+        (function() {
+            var karte = {{ this._parent.get_name() }};
+            var ebenen = [
+                {% for ebene, vertreter, verlag in this.ebenen %}
+                {layer: {{ ebene.get_name() }}, vertreter: {{ vertreter|tojson }}, verlag: {{ verlag|tojson }}},
+                {% endfor %}
+            ];
+            var verlageJeVertreter = {{ this.verlage_je_vertreter|tojson }};
+            var farben = {{ this.farben|tojson }};
+            var SPEICHER_SCHLUESSEL = 'gebietsplaner-ebenen-filter';
+
+            var Steuerung = L.Control.extend({
+                options: {position: 'topright'},
+                onAdd: function() {
+                    var div = L.DomUtil.create('div', 'ebenen-filter');
+                    L.DomEvent.disableClickPropagation(div);
+                    L.DomEvent.disableScrollPropagation(div);
+
+                    var verlagAuswahl = L.DomUtil.create('select', '', div);
+                    verlagAuswahl.add(new Option('Alle Verlage', ''));
+                    {{ this.verlage|tojson }}.forEach(function(verlag) {
+                        verlagAuswahl.add(new Option(verlag, verlag));
+                    });
+
+                    var alle = L.DomUtil.create('button', '', div);
+                    alle.textContent = 'Alle';
+                    var keine = L.DomUtil.create('button', '', div);
+                    keine.textContent = 'Keine';
+
+                    var boxen = {};
+                    var zeilen = {};
+                    Object.keys(verlageJeVertreter).forEach(function(vertreter) {
+                        var zeile = L.DomUtil.create('label', '', div);
+                        var box = L.DomUtil.create('input', '', zeile);
+                        box.type = 'checkbox';
+                        box.checked = true;
+                        var farbe = L.DomUtil.create('span', 'farbe', zeile);
+                        farbe.style.background = farben[vertreter] || 'gray';
+                        zeile.appendChild(document.createTextNode(vertreter));
+                        boxen[vertreter] = box;
+                        zeilen[vertreter] = zeile;
+                        box.addEventListener('change', aktualisiere);
+                    });
+
+                    function aktualisiere() {
+                        var verlag = verlagAuswahl.value;
+                        speichere(verlag);
+                        Object.keys(zeilen).forEach(function(vertreter) {
+                            var passt = !verlag || verlageJeVertreter[vertreter].indexOf(verlag) >= 0;
+                            zeilen[vertreter].style.display = passt ? '' : 'none';
+                        });
+                        ebenen.forEach(function(e) {
+                            var sichtbar = boxen[e.vertreter].checked && (!verlag || (e.verlag === null
+                                ? verlageJeVertreter[e.vertreter].indexOf(verlag) >= 0
+                                : e.verlag === verlag));
+                            if (sichtbar && !karte.hasLayer(e.layer)) {
+                                karte.addLayer(e.layer);
+                            } else if (!sichtbar && karte.hasLayer(e.layer)) {
+                                karte.removeLayer(e.layer);
+                            }
+                        });
+                    }
+
+                    function setzeAlle(wert) {
+                        Object.keys(boxen).forEach(function(vertreter) {
+                            if (zeilen[vertreter].style.display !== 'none') {
+                                boxen[vertreter].checked = wert;
+                            }
+                        });
+                        aktualisiere();
+                    }
+
+                    // Filterzustand überlebt ein Neuzeichnen der Karte (z.B. nach einer Kundenauswahl)
+                    function speichere(verlag) {
+                        var aus = Object.keys(boxen).filter(function(v) { return !boxen[v].checked; });
+                        try {
+                            sessionStorage.setItem(SPEICHER_SCHLUESSEL, JSON.stringify({verlag: verlag, aus: aus}));
+                        } catch (e) {}
+                    }
+
+                    function stelleWiederHer() {
+                        var zustand = null;
+                        try {
+                            zustand = JSON.parse(sessionStorage.getItem(SPEICHER_SCHLUESSEL));
+                        } catch (e) {}
+                        if (!zustand) {
+                            return;
+                        }
+                        if ({{ this.verlage|tojson }}.indexOf(zustand.verlag) >= 0) {
+                            verlagAuswahl.value = zustand.verlag;
+                        }
+                        (zustand.aus || []).forEach(function(vertreter) {
+                            if (boxen[vertreter]) {
+                                boxen[vertreter].checked = false;
+                            }
+                        });
+                        aktualisiere();
+                    }
+
+                    verlagAuswahl.addEventListener('change', aktualisiere);
+                    alle.addEventListener('click', function() { setzeAlle(true); });
+                    keine.addEventListener('click', function() { setzeAlle(false); });
+                    stelleWiederHer();
+                    return div;
+                }
+            });
+            new Steuerung().addTo(karte);
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, ebenen, farb_map):
+        super().__init__()
+        self._name = 'EbenenFilter'
+        self.ebenen = ebenen
+        verlage_je_vertreter = {}
+        for _, vertreter, verlag in ebenen:
+            eintrag = verlage_je_vertreter.setdefault(vertreter, [])
+            if verlag is not None:
+                eintrag.append(verlag)
+        self.verlage_je_vertreter = verlage_je_vertreter
+        self.verlage = sorted({verlag for _, _, verlag in ebenen if verlag is not None})
+        self.farben = {vertreter: farb_map.get(vertreter, 'gray') for vertreter in verlage_je_vertreter}
\ No newline at end of file
@@ -0,0 +1,41 @@
+# konfig.py
+
+import os
+import tomllib
+
+# Secrets-Datei für Läufe ohne Streamlit (z.B. nächtliche Jobs); Standard wie bei Streamlit
+SECRETS_PFAD = os.environ.get('GEBIETSPLANER_SECRETS', os.path.join('.streamlit', 'secrets.toml'))
+# Name des Szenarios, das die unveränderten Basisdaten darstellt
+IST_ZUSTAND = 'Aktueller IST-Zustand'
+
+
+def hole_secret(abschnitt):
+    """
+    Liest einen Abschnitt der Secrets.
+
+    Zuerst aus der TOML-Datei SECRETS_PFAD, falls sie existiert und den Abschnitt enthält, damit
+    Datenzugriffe auch ohne laufende Web-Oberfläche funktionieren; sonst aus st.secrets.
+    """
+    if os.path.exists(SECRETS_PFAD):
+        with open(SECRETS_PFAD, 'rb') as datei:
+            secrets = tomllib.load(datei)
+        if abschnitt in secrets:
+            return dict(secrets[abschnitt])
+    import streamlit as st
+    return dict(st.secrets[abschnitt])
+
+
+def ist_admin_modus():
+    """
+    Admin-/Debug-Modus für interne Diagnosen (z.B. Speicherbelegung aller Sessions).
+
+    Aktiv über die Umgebungsvariable GEBIETSPLANER_ADMIN=1 oder `aktiv = true` im Secrets-Abschnitt
+    [admin]; ohne beides ist er aus.
+    """
+    wert = os.environ.get('GEBIETSPLANER_ADMIN')
+    if wert is None:
+        try:
+            wert = hole_secret('admin').get('aktiv', False)
+        except Exception:
+            return False
+    return str(wert).strip().lower() in ('1', 'true', 'ja', 'yes')
@@ -0,0 +1,211 @@
+# kpi.py
+
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from src.besuchsplanung import plane_besuche, _haversine_km, MAX_POOL_WORKER
+from src.cache import VersionsCache
+from src.konfig import IST_ZUSTAND
+
+# Kunden bis zu dieser Luftlinie vom Wohnort ihres Vertreters gelten als abgedeckt
+ABDECKUNG_KM = 100.0
+# Unterhalb dieser Szenarioanzahl lohnt sich kein Prozess-Pool
+MIN_SZENARIEN_PARALLEL = 4
+# Kennzahl -> True, wenn größere Werte besser sind (für die Rangfolge)
+KPI_RICHTUNG = {
+    'Umsatz_Gini': False,
+    'km_mittel': False,
+    'km_max': False,
+    'Kunden_verschoben': False,
+    'Abdeckung': True,
+}
+
+# Ergebnisse je Szenario-Prüfsumme (Zuordnung + Basisdatenstand)
+_kpi_cache = VersionsCache(max_eintraege=500)
+
+# Gemeinsame Arrays der Basisdaten im Pool-Worker (einmal pro Prozess über den Initializer gesetzt)
+_BASIS = None
+
+
+def kennzahlen(dataframe):
+    """Kennzahlen einer Gebietsverteilung, wie sie das Dashboard oben anzeigt."""
+    return {
+        'Vertreter': int(dataframe['Vertreter_Name'].nunique()),
+        'Kunden': int(len(dataframe)),
+        'Umsatz_2024': float(dataframe['Umsatz_2024'].fillna(0).sum()),
+    }
+
+
+def kennzahlen_je_vertreter(dataframe):
+    """Kunden, Umsatz und Anzahl Verlage je Vertreter."""
+    return dataframe.groupby('Vertreter_Name').agg(
+        Kunden=('Kunden_Nr', 'size'),
+        Umsatz_2024=('Umsatz_2024', 'sum'),
+        Verlage=('Verlag', 'nunique'),
+    ).reset_index()
+
+
+def szenario_kennzahlen(dataframe, wohnorte=None, max_worker=1):
+    """
+    Kennzahlen inklusive Besuchsplanung für ein ganzes Szenario.
+    `wohnorte` (aus den Stammdaten) und `max_worker` werden an `plane_besuche` weitergereicht
+    (max_worker 1 = im aufrufenden Prozess).
+
+    Returns:
+        (Dict mit Kennzahlen, Besuchsplan-Übersicht je Vertreter)
+    """
+    werte = kennzahlen(dataframe)
+    besuchs_uebersicht, _ = plane_besuche(dataframe, wohnorte=wohnorte, max_worker=max_worker)
+    if besuchs_uebersicht.empty:
+        werte.update({'Auslastung_max': 0.0, 'Ueberlastete_Gebiete': 0, 'km_pro_Jahr': 0})
+    else:
+        werte.update({
+            'Auslastung_max': float(besuchs_uebersicht['Auslastung'].max()),
+            'Ueberlastete_Gebiete': int((besuchs_uebersicht['Auslastung'] > 1.0).sum()),
+            'km_pro_Jahr': int(besuchs_uebersicht['km_pro_Jahr'].sum()),
+        })
+    return werte, besuchs_uebersicht
+
+
+def _gini(werte):
+    """Gini-Koeffizient (0 = völlig gleich verteilt, gegen 1 = alles bei einem)."""
+    werte = np.sort(np.clip(np.asarray(werte, dtype=float), 0, None))
+    n = len(werte)
+    if n == 0 or werte.sum() == 0:
+        return 0.0
+    return float(2 * np.sum(np.arange(1, n + 1) * werte) / (n * werte.sum()) - (n + 1) / n)
+
+
+def _kpi_vektor(basis, codes):
+    """
+    Kennzahlen einer Zuordnung (Vertreter-Code je Basiszeile), vollständig vektorisiert.
+
+    Args:
+        basis: Dict mit lat, lon, umsatz, verlag (Codes), verlage (Namen), heim_lat, heim_lon (je
+            Vertreter-Code) und ist (Vertreter-Code im IST-Zustand)
+    """
+    anzahl_vertreter = len(basis['heim_lat'])
+    umsatz_je_vertreter = np.bincount(codes, weights=basis['umsatz'], minlength=anzahl_vertreter)
+    aktiv = np.bincount(codes, minlength=anzahl_vertreter) > 0
+    km = _haversine_km(basis['lat'], basis['lon'], basis['heim_lat'][codes], basis['heim_lon'][codes])
+    abgedeckt = np.where(np.isnan(km), 0.0, (km <= ABDECKUNG_KM) * basis['umsatz'])
+
+    werte = {
+        'Vertreter': int(aktiv.sum()),
+        'Umsatz_Gini': round(_gini(umsatz_je_vertreter[aktiv]), 4),
+        'km_mittel': round(float(np.nanmean(km)), 1) if np.isfinite(km).any() else np.nan,
+        'km_max': round(float(np.nanmax(km)), 1) if np.isfinite(km).any() else np.nan,
+        'Kunden_verschoben': int((codes != basis['ist']).sum()),
+    }
+    gesamt = basis['umsatz'].sum()
+    werte['Abdeckung'] = round(float(abgedeckt.sum() / gesamt), 4) if gesamt > 0 else np.nan
+    umsatz_je_verlag = np.bincount(basis['verlag'], weights=basis['umsatz'], minlength=len(basis['verlage']))
+    abgedeckt_je_verlag = np.bincount(basis['verlag'], weights=abgedeckt, minlength=len(basis['verlage']))
+    for i, verlag in enumerate(basis['verlage']):
+        anteil = abgedeckt_je_verlag[i] / umsatz_je_verlag[i] if umsatz_je_verlag[i] > 0 else np.nan
+        werte[f'Abdeckung_{verlag}'] = round(float(anteil), 4)
+    return werte
+
+
+def _setze_basis(basis):
+    global _BASIS
+    _BASIS = basis
+
+
+def _bewerte_im_worker(codes):
+    return _kpi_vektor(_BASIS, codes)
+
+
+def _pruefsumme(codes):
+    return hashlib.blake2b(np.ascontiguousarray(codes, dtype=np.int64).tobytes(), digest_size=16).hexdigest()
+
+
+def bewerte_szenarien(df_basis, zuweisungen, max_worker=1):
+    """
+    Berechnet den Kennzahlenvektor für mehrere Szenarien auf Basis desselben Datenstands.
+
+    Die Basisdaten werden einmal in Arrays übersetzt; im Pool werden sie je Worker nur einmal
+    übertragen, pro Szenario wandert nur der Vektor der Vertreter-Codes. Ergebnisse werden je Prüfsumme aus
+    Zuordnung und Basisdaten gecacht, sodass nur neue oder geänderte Szenarien gerechnet werden.
+
+    Args:
+        df_basis: Basisdaten (IST-Zustand)
+        zuweisungen: Dict szenario_name -> Zuordnung (Index Kunden_Nr, Spalte Vertreter_Name)
+        max_worker: 1 (Standard) rechnet im aufrufenden Prozess, z.B. in der App. Größere Werte
+            (CLI) nutzen ab MIN_SZENARIEN_PARALLEL offenen Szenarien einen Pool mit höchstens
+            MAX_POOL_WORKER per 'spawn' gestarteten Prozessen.
+    Returns:
+        DataFrame mit einer Zeile je Szenario (inklusive IST-Zustand)
+    """
+    ist_namen = df_basis['Vertreter_Name'].fillna('')
+    kunden_nr = df_basis['Kunden_Nr']
+
+    # Vertreter aller Szenarien (wie beim Laden: fehlende Kunden behalten den IST-Vertreter)
+    szenario_namen = {}
+    for name, zuweisung in zuweisungen.items():
+        zuordnung = zuweisung['Vertreter_Name']
+        zuordnung = zuordnung[~zuordnung.index.duplicated(keep='last')]
+        werte = kunden_nr.map(zuordnung)
+        szenario_namen[name] = werte.where(werte.notna(), ist_namen).to_numpy(dtype=object)
+
+    ist_codes, vertreter = pd.factorize(ist_namen, sort=True)
+    neue = set()
+    for werte in szenario_namen.values():
+        neue.update(pd.unique(werte))
+    vertreter = pd.Index(list(vertreter) + sorted(neue - set(vertreter), key=str))
+    wohnorte = df_basis.groupby('Vertreter_Name')[['Wohnort_Lat', 'Wohnort_Lon']].first().reindex(vertreter)
+    verlag_codes, verlage = pd.factorize(df_basis['Verlag'].astype(str), sort=True)
+    basis = {
+        'lat': df_basis['Latitude'].to_numpy(dtype=float),
+        'lon': df_basis['Longitude'].to_numpy(dtype=float),
+        'umsatz': np.clip(df_basis['Umsatz_2024'].fillna(0).to_numpy(dtype=float), 0, None),
+        'verlag': verlag_codes,
+        'verlage': list(verlage),
+        'heim_lat': wohnorte['Wohnort_Lat'].to_numpy(dtype=float),
+        'heim_lon': wohnorte['Wohnort_Lon'].to_numpy(dtype=float),
+        'ist': ist_codes,
+    }
+    basis_pruefsumme = int(pd.util.hash_pandas_object(
+        df_basis[['Kunden_Nr', 'Vertreter_Name', 'Verlag', 'Latitude', 'Longitude', 'Umsatz_2024',
+                  'Wohnort_Lat', 'Wohnort_Lon']], index=False
+    ).sum() & 0xFFFFFFFFFFFFFFFF)
+
+    alle = {IST_ZUSTAND: ist_codes.astype(np.int64)}
+    for name, werte in szenario_namen.items():
+        alle[name] = vertreter.get_indexer(werte).astype(np.int64)
+
+    ergebnisse = {}
+    offen = []
+    for name, codes in alle.items():
+        schluessel = ('kpi', ABDECKUNG_KM, basis_pruefsumme, _pruefsumme(codes))
+        treffer = _kpi_cache.finde(schluessel)
+        if treffer is None:
+            offen.append((name, codes, schluessel))
+        else:
+            ergebnisse[name] = treffer
+
+    if offen:
+        if len(offen) >= MIN_SZENARIEN_PARALLEL and max_worker > 1:
+            with ProcessPoolExecutor(max_workers=min(max_worker, len(offen), MAX_POOL_WORKER),
+                                     mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_setze_basis, initargs=(basis,)) as executor:
+                berechnet = list(executor.map(_bewerte_im_worker, [codes for _, codes, _ in offen]))
+        else:
+            berechnet = [_kpi_vektor(basis, codes) for _, codes, _ in offen]
+        for (name, _, schluessel), werte in zip(offen, berechnet):
+            _kpi_cache.setze(schluessel, werte)
+            ergebnisse[name] = werte
+
+    return pd.DataFrame([{'Szenario': name, **ergebnisse[name]} for name in alle])
+
+
+def rangfolge(bewertung, kennzahl):
+    """Sortiert die Bewertung nach einer Kennzahl (beste zuerst) und ergänzt die Spalte 'Rang'."""
+    aufsteigend = not KPI_RICHTUNG.get(kennzahl, kennzahl.startswith('Abdeckung'))
+    sortiert = bewertung.sort_values(kennzahl, ascending=aufsteigend, na_position='last').reset_index(drop=True)
+    sortiert.insert(0, 'Rang', sortiert[kennzahl].rank(ascending=aufsteigend, method='min').astype('Int64'))
+    return sortiert
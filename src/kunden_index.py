@@ -0,0 +1,72 @@
+# kunden_index.py
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+ERDRADIUS_M = 6371000.0
+# Klicktoleranz in Bildschirmpixeln (etwas größer als der Marker-Radius)
+KLICK_TOLERANZ_PX = 12
+# Marker-Klicks liefern die Marker-Koordinaten selbst, die Toleranz fängt nur Rundungen ab
+MARKER_KLICK_TOLERANZ_M = 50.0
+# Zoomstufe für die Toleranz bei Klicks auf Rasterkacheln (die aktuelle Zoomstufe wird nicht übertragen)
+RASTER_KLICK_ZOOM = 8
+MAX_INDIZES = 16
+
+_indizes = OrderedDict()
+_lock = threading.Lock()
+
+
+def _einheitsvektoren(lat, lon):
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+
+class KundenIndex:
+    """
+    KD-Baum über die Kundenkoordinaten einer (gefilterten) Ansicht.
+
+    Punkte liegen als 3D-Einheitsvektoren vor, damit die Euklid-Distanz im Baum
+    monoton zur Großkreisdistanz ist.
+    """
+
+    def __init__(self, dataframe):
+        self.kunden_nr = dataframe['Kunden_Nr'].to_numpy()
+        self._baum = cKDTree(_einheitsvektoren(dataframe['Latitude'], dataframe['Longitude']))
+
+    def naechster_kunde(self, lat, lon, max_distanz_m=None):
+        """Gibt die Kunden_Nr des nächstgelegenen Kunden zurück oder None (leer / zu weit entfernt)."""
+        if len(self.kunden_nr) == 0:
+            return None
+        # Sehnenlänge auf der Einheitskugel aus der Bogenlänge
+        grenze = np.inf if max_distanz_m is None else 2 * np.sin(min(max_distanz_m / ERDRADIUS_M, np.pi) / 2)
+        distanz, position = self._baum.query(_einheitsvektoren([lat], [lon])[0], distance_upper_bound=grenze)
+        if not np.isfinite(distanz):
+            return None
+        return self.kunden_nr[position].item()
+
+
+def klick_toleranz_m(lat, zoom):
+    """Entspricht KLICK_TOLERANZ_PX Bildschirmpixeln bei der gegebenen Zoomstufe (Web Mercator)."""
+    meter_pro_pixel = 156543.03392 * np.cos(np.radians(lat)) / 2 ** zoom
+    return KLICK_TOLERANZ_PX * meter_pro_pixel
+
+
+def hole_kunden_index(schluessel, dataframe):
+    """
+    Gibt den KD-Baum für eine Ansicht zurück; pro Schlüssel (Zuweisungsstand + Filter)
+    wird er nur einmal gebaut und prozessweit in einem kleinen LRU-Cache gehalten.
+    """
+    with _lock:
+        if schluessel in _indizes:
+            _indizes.move_to_end(schluessel)
+            return _indizes[schluessel]
+    index = KundenIndex(dataframe)
+    with _lock:
+        _indizes[schluessel] = index
+        while len(_indizes) > MAX_INDIZES:
+            _indizes.popitem(last=False)
+    return index
@@ -0,0 +1,190 @@
+# sheets_client.py
+
+import logging
+import random
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import gspread
+import requests
+from google.oauth2.service_account import Credentials
+
+logger = logging.getLogger(__name__)
+
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/drive']
+
+# Fehlercodes, bei denen sich ein erneuter Versuch lohnt (Quota bzw. Serverfehler)
+WIEDERHOLBARE_CODES = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """
+    Token-Bucket, der höchstens `pro_minute` Anfragen pro Minute durchlässt.
+    Thread-sicher; `warte()` blockiert, bis wieder ein Token frei ist.
+    """
+
+    def __init__(self, pro_minute=60):
+        self.pro_minute = pro_minute
+        self._tokens = float(pro_minute)
+        self._letzte_auffuellung = time.monotonic()
+        self._lock = threading.Lock()
+
+    def warte(self):
+        """Gibt die Wartezeit in Sekunden zurück."""
+        gewartet = 0.0
+        while True:
+            with self._lock:
+                jetzt = time.monotonic()
+                self._tokens = min(self.pro_minute,
+                                   self._tokens + (jetzt - self._letzte_auffuellung) * self.pro_minute / 60.0)
+                self._letzte_auffuellung = jetzt
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return gewartet
+                pause = (1 - self._tokens) * 60.0 / self.pro_minute
+            time.sleep(pause)
+            gewartet += pause
+
+
+def _ist_wiederholbar(fehler, idempotent=True):
+    if isinstance(fehler, gspread.exceptions.APIError):
+        return fehler.code in WIEDERHOLBARE_CODES if idempotent else fehler.code == 429
+    return idempotent and isinstance(fehler, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+class SheetsClientPool:
+    """
+    Geteilter, einmal autorisierter gspread-Client mit Pool für Spreadsheet- und Worksheet-Handles.
+
+    Alle Anfragen laufen über `ausfuehren()`: Rate-Limit pro Minute, exponentielles Backoff
+    bei 429/5xx und Metriken (Anzahl, Latenz, Wiederholungen) je Operation.
+
+    Args:
+        hole_creds_info: Funktion, die das Service-Account-Dict liefert (erst bei Bedarf aufgerufen)
+        anfragen_pro_minute: Obergrenze für Anfragen pro Minute (Google-Standardquota: 60 pro Nutzer)
+        max_versuche: Versuche pro Anfrage inklusive dem ersten
+    """
+
+    def __init__(self, hole_creds_info, anfragen_pro_minute=60, max_versuche=5, basis_wartezeit=1.0):
+        self._hole_creds_info = hole_creds_info
+        self._limiter = RateLimiter(anfragen_pro_minute)
+        self.max_versuche = max_versuche
+        self.basis_wartezeit = basis_wartezeit
+        self._client = None
+        self._spreadsheets = {}
+        self._worksheets = {}
+        self._lock = threading.RLock()
+        # Ein Lock je Handle: ein langsames oder gedrosseltes `open` blockiert nur Anfragen an dasselbe Sheet
+        self._handle_locks = {}
+        self._metriken_lock = threading.Lock()
+        self._metriken = defaultdict(lambda: {'anfragen': 0, 'fehler': 0, 'wiederholungen': 0,
+                                              'latenz_summe': 0.0, 'latenz_max': 0.0})
+        self._gedrosselt_sekunden = 0.0
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                creds = Credentials.from_service_account_info(self._hole_creds_info(), scopes=SCOPES)
+                self._client = gspread.authorize(creds)
+            return self._client
+
+    def ausfuehren(self, operation, funktion, *args, idempotent=True, **kwargs):
+        """
+        Führt eine API-Anfrage mit Rate-Limit, Backoff und Metriken aus.
+
+        Nicht idempotente Anfragen (z.B. append_rows) werden nur nach 429 wiederholt: Google hat sie
+        dann sicher abgelehnt. Nach Timeouts oder 5xx kann die Anfrage trotzdem ausgeführt worden sein.
+        """
+        for versuch in range(1, self.max_versuche + 1):
+            gewartet = self._limiter.warte()
+            start = time.monotonic()
+            try:
+                ergebnis = funktion(*args, **kwargs)
+                self._erfasse(operation, time.monotonic() - start, gewartet)
+                return ergebnis
+            except Exception as e:
+                self._erfasse(operation, time.monotonic() - start, gewartet, fehler=True)
+                if not _ist_wiederholbar(e, idempotent) or versuch == self.max_versuche:
+                    raise
+                pause = min(64.0, self.basis_wartezeit * 2 ** (versuch - 1)) + random.uniform(0, 1)
+                logger.info("%s fehlgeschlagen (%s), neuer Versuch in %.1fs", operation, e, pause)
+                with self._metriken_lock:
+                    self._metriken[operation]['wiederholungen'] += 1
+                time.sleep(pause)
+
+    def _gepoolt(self, ablage, art, name, laden):
+        # Lookup unter dem Pool-Lock, Laden (inklusive Backoff) nur unter dem Lock dieses Handles
+        with self._lock:
+            if name in ablage:
+                return ablage[name]
+            lock = self._handle_locks.setdefault((art, name), threading.Lock())
+        with lock:
+            with self._lock:
+                if name in ablage:
+                    return ablage[name]
+            handle = laden()
+            with self._lock:
+                ablage[name] = handle
+            return handle
+
+    def spreadsheet(self, name):
+        """Gibt ein (gepooltes) Spreadsheet-Handle zurück."""
+        return self._gepoolt(self._spreadsheets, 'spreadsheet', name,
+                             lambda: self.ausfuehren('open', self.client.open, name))
+
+    def worksheet(self, name):
+        """Gibt das (gepoolte) erste Tabellenblatt eines Spreadsheets zurück."""
+        return self._gepoolt(self._worksheets, 'worksheet', name,
+                             lambda: self.ausfuehren('get_worksheet', self.spreadsheet(name).get_worksheet, 0))
+
+    def geaendert_um(self, name):
+        """Letzte Änderung laut Drive-Metadaten (eine günstige Anfrage statt aller Werte)."""
+        return self.ausfuehren('drive_metadata', self.spreadsheet(name).get_lastUpdateTime)
+
+    def alle_werte(self, name):
+        """Alle Zellwerte des ersten Tabellenblatts inklusive Kopfzeile."""
+        return self.ausfuehren('get_all_values', self.worksheet(name).get_all_values)
+
+    def parallel(self, auftraege, max_worker=4):
+        """
+        Führt unabhängige Aufträge gleichzeitig aus.
+
+        Args:
+            auftraege: Dict schluessel -> Funktion ohne Argumente
+        Returns:
+            Dict schluessel -> Ergebnis (Exceptions werden weitergereicht)
+        """
+        if len(auftraege) <= 1:
+            return {schluessel: funktion() for schluessel, funktion in auftraege.items()}
+        with ThreadPoolExecutor(max_workers=min(max_worker, len(auftraege))) as executor:
+            futures = {schluessel: executor.submit(funktion) for schluessel, funktion in auftraege.items()}
+            return {schluessel: future.result() for schluessel, future in futures.items()}
+
+    def zuruecksetzen(self):
+        """Verwirft Client und Handles, z.B. nach Änderungen an den Secrets."""
+        with self._lock:
+            self._client = None
+            self._spreadsheets.clear()
+            self._worksheets.clear()
+
+    def metriken(self):
+        """Momentaufnahme der Anfrage-Metriken je Operation."""
+        with self._metriken_lock:
+            zeilen = {}
+            for operation, werte in self._metriken.items():
+                zeilen[operation] = dict(werte)
+                zeilen[operation]['latenz_mittel'] = werte['latenz_summe'] / werte['anfragen'] if werte['anfragen'] else 0.0
+            return {'operationen': zeilen, 'gedrosselt_sekunden': self._gedrosselt_sekunden}
+
+    def _erfasse(self, operation, dauer, gewartet, fehler=False):
+        with self._metriken_lock:
+            werte = self._metriken[operation]
+            werte['anfragen'] += 1
+            werte['latenz_summe'] += dauer
+            werte['latenz_max'] = max(werte['latenz_max'], dauer)
+            if fehler:
+                werte['fehler'] += 1
+            self._gedrosselt_sekunden += gewartet
@@ -0,0 +1,217 @@
+# sitzungen.py
+
+import logging
+import os
+import threading
+import time
+
+from src.cache import cache, schaetze_groesse
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+# Budgets für gecachte Karten und SQLite-Dateien, konfigurierbar über Umgebungsvariablen
+SITZUNG_BUDGET = int(float(os.environ.get('GEBIETSPLANER_SITZUNG_BUDGET_MB', '200')) * MB)
+GESAMT_BUDGET = int(float(os.environ.get('GEBIETSPLANER_GESAMT_BUDGET_MB', '2000')) * MB)
+# Nach so vielen Sekunden ohne Rerun gilt eine Session als inaktiv
+LEERLAUF_SEKUNDEN = float(os.environ.get('GEBIETSPLANER_LEERLAUF_MIN', '30')) * 60
+# Danach hat Streamlit die Session längst verworfen; sie wird auch aus der Buchführung entfernt
+VERGESSEN_SEKUNDEN = 24 * 3600
+
+
+def cache_tag(token):
+    """Tag, unter dem der VersionsCache die Einträge einer Session führt."""
+    return f"session:{token}"
+
+
+class SitzungsVerwaltung:
+    """
+    Führt Buch über den Speicher aller Streamlit-Sessions eines Prozesses und setzt Budgets durch.
+
+    Gezählt werden die gecachten Karten einer Session (über ihr Cache-Tag), ihre SQLite-Datei und
+    der Zustand im Session State (df_aktuell, Verlauf). Über dem Budget werden zuerst gecachte
+    Karten verdrängt (sie werden bei Bedarf neu gezeichnet), dann SQLite-Verbindungen geschlossen;
+    inaktive Sessions verlieren beides. Den Zustand selbst verwirft die Verwaltung nie.
+
+    SQLite-Verbindungen gehören der Verwaltung statt dem Session State, damit sie auch
+    von außen (z.B. beim Aufräumen durch eine andere Session) geschlossen werden können.
+    """
+
+    def __init__(self, sitzung_budget=SITZUNG_BUDGET, gesamt_budget=GESAMT_BUDGET,
+                 leerlauf_sekunden=LEERLAUF_SEKUNDEN):
+        self.sitzung_budget = sitzung_budget
+        self.gesamt_budget = gesamt_budget
+        self.leerlauf_sekunden = leerlauf_sekunden
+        self._sitzungen = {}  # token -> {'zuletzt', 'zustand', 'db_conn', 'db_pfad'}
+        self._geteilt = {}  # name -> Bytes (z.B. Basisdaten, einmal für alle Sessions)
+        self._lock = threading.RLock()
+
+    def _sitzung(self, token):
+        return self._sitzungen.setdefault(
+            token, {'zuletzt': time.time(), 'zustand': {}, 'db_conn': None, 'db_pfad': None}
+        )
+
+    # --- Erfassen ---
+
+    def beruehre(self, token, **zustand):
+        """
+        Markiert die Session als aktiv, merkt sich die Größe ihres Zustands (Name -> Objekt)
+        und setzt danach die Budgets durch.
+        """
+        with self._lock:
+            sitzung = self._sitzung(token)
+            sitzung['zuletzt'] = time.time()
+            for name, wert in zustand.items():
+                # Kopien von df_basis teilen sich die Strings mit dem Original: nur Arrays zählen
+                sitzung['zustand'][name] = schaetze_groesse(wert, tief=False)
+        self.raeume_auf(token)
+
+    def merke_geteilt(self, name, wert):
+        """Größe eines von allen Sessions geteilten Objekts (wird nur einmal gezählt)."""
+        with self._lock:
+            self._geteilt[name] = schaetze_groesse(wert)
+
+    def registriere_db(self, token, conn, pfad):
+        """Übernimmt die SQLite-Verbindung einer Session; eine vorherige wird geschlossen und gelöscht."""
+        with self._lock:
+            self.schliesse_db(token)
+            sitzung = self._sitzung(token)
+            sitzung['db_conn'], sitzung['db_pfad'] = conn, pfad
+
+    def db_verbindung(self, token):
+        """Offene SQLite-Verbindung der Session oder None (z.B. nach dem Aufräumen)."""
+        with self._lock:
+            sitzung = self._sitzungen.get(token)
+            return sitzung['db_conn'] if sitzung else None
+
+    # --- Freigeben ---
+
+    def schliesse_db(self, token):
+        """Schließt die SQLite-Verbindung der Session und löscht ihre temporäre Datei."""
+        with self._lock:
+            sitzung = self._sitzungen.get(token)
+            if not sitzung or sitzung['db_conn'] is None:
+                return 0
+            conn, pfad = sitzung['db_conn'], sitzung['db_pfad']
+            sitzung['db_conn'] = sitzung['db_pfad'] = None
+        groesse = _dateigroesse(pfad)
+        try:
+            conn.close()
+        except Exception as e:
+            logger.warning("SQLite-Verbindung konnte nicht geschlossen werden: %s", e)
+        if pfad:
+            try:
+                os.remove(pfad)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning("Temporäre Datenbank %s konnte nicht gelöscht werden: %s", pfad, e)
+        return groesse
+
+    def beende_sitzung(self, token):
+        """Gibt alle Ressourcen einer Session frei (z.B. beim Abmelden)."""
+        self.schliesse_db(token)
+        cache.invalidiere(cache_tag(token))
+        with self._lock:
+            self._sitzungen.pop(token, None)
+
+    def raeume_auf(self, aktuelle_sitzung=None):
+        """
+        Setzt Leerlauf-Grenze, Sitzungs- und Gesamtbudget durch.
+        Die gerade aktive Session verliert ihre SQLite-Verbindung nur bei überschrittenem eigenen Budget.
+        """
+        jetzt = time.time()
+        with self._lock:
+            inaktiv = [t for t, s in self._sitzungen.items()
+                       if t != aktuelle_sitzung and jetzt - s['zuletzt'] > self.leerlauf_sekunden]
+        for token in inaktiv:
+            self.schliesse_db(token)
+            cache.invalidiere(cache_tag(token))
+            with self._lock:
+                sitzung = self._sitzungen.get(token)
+                if sitzung and jetzt - sitzung['zuletzt'] > VERGESSEN_SEKUNDEN:
+                    del self._sitzungen[token]
+
+        # Sitzungsbudget: zuerst gecachte Karten (älteste zuerst), dann die SQLite-Datei
+        if aktuelle_sitzung is not None:
+            belegt = self._belegung(aktuelle_sitzung)
+            if belegt['gesamt'] > self.sitzung_budget:
+                fest = belegt['zustand'] + belegt['datenbank']
+                cache.verdraenge(max(0, self.sitzung_budget - fest), tag=cache_tag(aktuelle_sitzung))
+                if fest > self.sitzung_budget:
+                    self.schliesse_db(aktuelle_sitzung)
+
+        # Gesamtbudget: LRU über alle Sessions, danach Datenbanken der am längsten inaktiven Sessions
+        gesamt = self.belegung()
+        if gesamt['gesamt'] <= self.gesamt_budget:
+            return
+        ohne_karten = gesamt['gesamt'] - gesamt['karten']
+        cache.verdraenge(max(0, self.gesamt_budget - ohne_karten), praefix='session:')
+        ueberschuss = self.belegung()['gesamt'] - self.gesamt_budget
+        with self._lock:
+            reihenfolge = sorted(self._sitzungen, key=lambda t: self._sitzungen[t]['zuletzt'])
+        for token in reihenfolge:
+            if ueberschuss <= 0:
+                break
+            if token != aktuelle_sitzung:
+                ueberschuss -= self.schliesse_db(token)
+
+    # --- Anzeige ---
+
+    def _belegung(self, token, karten=None):
+        with self._lock:
+            sitzung = self._sitzungen.get(token)
+            if sitzung is None:
+                return {'zustand': 0, 'karten': 0, 'datenbank': 0, 'gesamt': 0}
+            zustand = sum(sitzung['zustand'].values())
+            db_pfad = sitzung['db_pfad']
+        if karten is None:
+            karten = cache.belegung(cache_tag(token)).get(cache_tag(token), 0)
+        datenbank = _dateigroesse(db_pfad)
+        return {'zustand': zustand, 'karten': karten, 'datenbank': datenbank,
+                'gesamt': zustand + karten + datenbank}
+
+    def belegung(self):
+        """Gesamtbelegung in Bytes: geteilte Objekte plus Summe über alle Sessions."""
+        karten = cache.belegung('session:')
+        with self._lock:
+            tokens = list(self._sitzungen)
+            geteilt = sum(self._geteilt.values())
+        summe = {'geteilt': geteilt, 'zustand': 0, 'karten': 0, 'datenbank': 0}
+        for token in tokens:
+            for art, wert in self._belegung(token, karten.get(cache_tag(token), 0)).items():
+                if art != 'gesamt':
+                    summe[art] += wert
+        summe['gesamt'] = sum(summe.values())
+        summe['sitzungen'] = len(tokens)
+        return summe
+
+    def uebersicht(self):
+        """Eine Zeile pro Session (für das Admin-Panel), zuletzt aktive zuerst."""
+        karten = cache.belegung('session:')
+        jetzt = time.time()
+        with self._lock:
+            sitzungen = [(t, s['zuletzt'], s['db_conn'] is not None) for t, s in self._sitzungen.items()]
+        zeilen = []
+        for token, zuletzt, db_offen in sorted(sitzungen, key=lambda s: -s[1]):
+            belegt = self._belegung(token, karten.get(cache_tag(token), 0))
+            zeilen.append({
+                'Sitzung': token[:8],
+                'Inaktiv_min': round((jetzt - zuletzt) / 60, 1),
+                'Zustand_MB': round(belegt['zustand'] / MB, 1),
+                'Karten_MB': round(belegt['karten'] / MB, 1),
+                'Datenbank_MB': round(belegt['datenbank'] / MB, 1),
+                'DB_offen': db_offen,
+            })
+        return zeilen
+
+
+def _dateigroesse(pfad):
+    try:
+        return os.path.getsize(pfad) if pfad else 0
+    except OSError:
+        return 0
+
+
+# Eine Verwaltung pro Prozess, geteilt von allen Sessions
+sitzungen = SitzungsVerwaltung()
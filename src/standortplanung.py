@@ -0,0 +1,230 @@
+# standortplanung.py
+
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import linear_sum_assignment
+
+from src.besuchsplanung import _haversine_km, wohnorte_je_vertreter, MAX_POOL_WORKER
+
+# Obergrenzen für die Distanzmatrix (Kandidaten x Nachfragepunkte)
+MAX_KANDIDATEN = 800
+MAX_NACHFRAGEPUNKTE = 3000
+# Startgröße des Rasters, auf dem nahe beieinander liegende Kunden zusammengefasst werden (Grad)
+START_RASTER_GRAD = 0.01
+MAX_ITERATIONEN = 500
+# Ersatz für "zweitnächster Standort", wenn nur einer offen ist (größer als jede Distanz in km)
+_GROSSE_DISTANZ = 1e6
+
+# Distanzmatrix und Gewichte im Pool-Worker (einmal pro Prozess über den Initializer gesetzt)
+_D = None
+_W = None
+
+
+@dataclass
+class StandortLoesung:
+    """Ergebnis der Standortplanung."""
+    standorte: pd.DataFrame  # je Vertreter: Vertreter_Name, Wohnort_Lat, Wohnort_Lon, Fest, Kunden, Umsatz_2024, km_mittel
+    zuordnung: pd.Series  # Vertreter_Name je Zeile des Eingabe-DataFrames (gleicher Index)
+    kosten: float  # umsatzgewichtete Summe der Luftlinien-km zum nächsten Standort
+    starts: int
+    dauer: float = 0.0
+
+
+def _verdichte(lat, lon, max_punkte, zelle=START_RASTER_GRAD):
+    """
+    Fasst Punkte auf einem Raster zusammen, dessen Zellgröße so lange verdoppelt wird, bis höchstens
+    `max_punkte` Zellen belegt sind. Gibt die Zellnummer je Punkt zurück.
+    """
+    while True:
+        zellen = pd.factorize(pd.MultiIndex.from_arrays([np.floor(lat / zelle), np.floor(lon / zelle)]))[0]
+        if zellen.max() + 1 <= max_punkte:
+            return zellen
+        zelle *= 2
+
+
+def _naechste(D, offen):
+    """Distanz zum nächsten und zweitnächsten offenen Standort sowie Position des nächsten in `offen`."""
+    teil = D[offen]
+    if len(offen) == 1:
+        return teil[0], np.full(teil.shape[1], _GROSSE_DISTANZ), np.zeros(teil.shape[1], dtype=int)
+    zwei = np.argpartition(teil, 1, axis=0)[:2]
+    spalten = np.arange(teil.shape[1])
+    a, b = teil[zwei[0], spalten], teil[zwei[1], spalten]
+    erster = np.where(a <= b, zwei[0], zwei[1])
+    return np.minimum(a, b), np.maximum(a, b), erster
+
+
+def _startloesung(D, w, feste, anzahl_frei, rng):
+    """Wählt freie Standorte gewichtet nach Umsatz x Distanz zum nächsten offenen Standort (wie k-means++)."""
+    offen = list(feste)
+    d1 = D[offen].min(axis=0) if offen else np.full(D.shape[1], 1.0)
+    for _ in range(anzahl_frei):
+        # Nachfragepunkt ziehen, dann den nächstgelegenen noch geschlossenen Kandidaten öffnen
+        p = w * d1
+        p = p / p.sum() if p.sum() > 0 else np.full(len(w), 1.0 / len(w))
+        punkt = rng.choice(len(w), p=p)
+        reihenfolge = np.argsort(D[:, punkt])
+        kandidat = next(int(k) for k in reihenfolge if k not in offen)
+        offen.append(kandidat)
+        d1 = np.minimum(d1, D[kandidat]) if len(offen) > 1 else D[kandidat].copy()
+    return offen
+
+
+def _lokale_suche(D, w, feste, anzahl_frei, seed):
+    """
+    Austauschverfahren (Teitz-Bart mit der Bewertung nach Whitaker/Resende-Werneck): in jeder
+    Iteration wird für alle Paare (neuer Kandidat, offener freier Standort) der Gewinn eines Tauschs
+    vektorisiert berechnet und der beste Tausch ausgeführt, bis keiner mehr verbessert.
+    """
+    rng = np.random.default_rng(seed)
+    offen = _startloesung(D, w, feste, anzahl_frei, rng)
+    anzahl_fest = len(feste)
+    for _ in range(MAX_ITERATIONEN):
+        d1, d2, erster = _naechste(D, offen)
+        # Gewinn durch Öffnen von c: alle Punkte, die c näher haben als ihren bisherigen Standort
+        gewinn = np.maximum(d1[None, :] - D, 0.0) @ w
+        # Verlust durch Schließen von f: seine Punkte weichen auf den zweitnächsten Standort aus
+        verlust = np.bincount(erster, weights=w * (d2 - d1), minlength=len(offen))
+        # Korrektur: Punkte von f, die nach dem Tausch zu c statt zum zweitnächsten gehen
+        zusatz_je_punkt = np.maximum(d2[None, :] - np.maximum(D, d1[None, :]), 0.0) * w
+        zusatz = np.zeros((D.shape[0], len(offen)))
+        for j in range(anzahl_fest, len(offen)):
+            zusatz[:, j] = zusatz_je_punkt[:, erster == j].sum(axis=1)
+        ersparnis = gewinn[:, None] - verlust[None, :] + zusatz
+        ersparnis[:, :anzahl_fest] = -np.inf  # feste Standorte bleiben
+        ersparnis[offen, :] = -np.inf  # bereits offene Kandidaten
+        c, j = np.unravel_index(np.argmax(ersparnis), ersparnis.shape)
+        if not ersparnis[c, j] > 1e-9 * max(float(d1 @ w), 1.0):
+            break
+        offen[j] = int(c)
+    d1, _, _ = _naechste(D, offen)
+    return float(d1 @ w), offen
+
+
+def _setze_matrix(D, w):
+    global _D, _W
+    _D, _W = D, w
+
+
+def _suche_im_worker(auftrag):
+    feste, anzahl_frei, seed = auftrag
+    return _lokale_suche(_D, _W, feste, anzahl_frei, seed)
+
+
+def plane_standorte(dataframe, feste_standorte, freie_vertreter, starts=8, max_worker=1, seed=0, wohnorte=None):
+    """
+    Sucht Wohnorte für Vertreter so, dass die umsatzgewichtete Luftlinie der Kunden zum nächsten
+    Wohnort minimal wird (gewichtetes p-Median-Problem). Jeder Kunde wird dem nächsten Wohnort zugeordnet.
+
+    Kandidaten sind Kundenstandorte (je Rasterzelle der umsatzstärkste); nahe Kunden werden zu
+    Nachfragepunkten zusammengefasst. Die Lösung ist die beste aus mehreren zufälligen Starts.
+
+    Args:
+        dataframe: Kunden mit Kunden_Nr, Latitude, Longitude, Umsatz_2024
+        feste_standorte: Dict Vertreter -> (lat, lon) der Wohnorte, die bleiben
+        freie_vertreter: Namen der Vertreter, deren Wohnort gesucht wird (neu oder umziehend). Umziehende
+            Vertreter erhalten den freien Standort, der ihrem bisherigen Wohnort am nächsten liegt.
+        starts: Anzahl der Starts der lokalen Suche
+        max_worker: 1 (Standard) rechnet alle Starts im aufrufenden Prozess, z.B. in der App.
+            Größere Werte (Batch-Läufe, CLI) verteilen die Starts auf höchstens MAX_POOL_WORKER
+            per 'spawn' gestartete Prozesse.
+        wohnorte: bisherige Wohnorte je Vertreter aus den Stammdaten (siehe `wohnorte_je_vertreter`);
+            ohne Angabe aus `dataframe`, was nur für unveränderte Basisdaten stimmt
+    """
+    start = time.perf_counter()
+    if not freie_vertreter:
+        raise ValueError("Mindestens ein Vertreter ohne festen Wohnort wird benötigt.")
+    kunden = dataframe.dropna(subset=['Latitude', 'Longitude'])
+    lat = kunden['Latitude'].to_numpy(dtype=float)
+    lon = kunden['Longitude'].to_numpy(dtype=float)
+    umsatz = np.clip(kunden['Umsatz_2024'].fillna(0).to_numpy(dtype=float), 0, None)
+    if umsatz.sum() <= 0:
+        umsatz = np.ones(len(umsatz))
+
+    # Nachfragepunkte: umsatzgewichteter Schwerpunkt je Rasterzelle
+    zellen = _verdichte(lat, lon, MAX_NACHFRAGEPUNKTE)
+    w = np.bincount(zellen, weights=umsatz)
+    nachfrage_gewicht = np.where(w > 0, w, 1.0)
+    n_lat = np.bincount(zellen, weights=umsatz * lat) / nachfrage_gewicht
+    n_lon = np.bincount(zellen, weights=umsatz * lon) / nachfrage_gewicht
+    leer = w <= 0
+    n_lat[leer] = np.bincount(zellen, weights=lat)[leer] / np.bincount(zellen)[leer]
+    n_lon[leer] = np.bincount(zellen, weights=lon)[leer] / np.bincount(zellen)[leer]
+
+    # Kandidaten: umsatzstärkster Kunde je (gröberer) Rasterzelle
+    kandidaten_zellen = _verdichte(lat, lon, MAX_KANDIDATEN)
+    beste = pd.Series(umsatz).groupby(kandidaten_zellen).idxmax().to_numpy()
+    fest_namen = list(feste_standorte)
+    k_lat = np.concatenate([[feste_standorte[n][0] for n in fest_namen], lat[beste]])
+    k_lon = np.concatenate([[feste_standorte[n][1] for n in fest_namen], lon[beste]])
+
+    D = _haversine_km(k_lat[:, None], k_lon[:, None], n_lat[None, :], n_lon[None, :]).astype(np.float32)
+    feste = list(range(len(fest_namen)))
+    anzahl_frei = min(len(freie_vertreter), len(k_lat) - len(feste))
+    auftraege = [(feste, anzahl_frei, seed + i) for i in range(starts)]
+
+    if max_worker <= 1 or starts == 1:
+        ergebnisse = [_lokale_suche(D, w, *a) for a in auftraege]
+    else:
+        with ProcessPoolExecutor(max_workers=min(max_worker, starts, MAX_POOL_WORKER),
+                                 mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=_setze_matrix, initargs=(D, w)) as executor:
+            ergebnisse = list(executor.map(_suche_im_worker, auftraege))
+    kosten, offen = min(ergebnisse, key=lambda e: e[0])
+
+    # Freie Standorte den Vertretern zuordnen: Umziehende möglichst nah am bisherigen Wohnort
+    freie_standorte = offen[len(feste):]
+    if wohnorte is not None:
+        bisher = wohnorte
+    elif {'Wohnort_Lat', 'Wohnort_Lon'} <= set(dataframe.columns):
+        bisher = wohnorte_je_vertreter(dataframe)
+    else:
+        bisher = pd.DataFrame()
+    freie_namen = list(freie_vertreter)[:anzahl_frei]
+    abstand = np.zeros((len(freie_namen), len(freie_standorte)))
+    for i, name in enumerate(freie_namen):
+        if name in bisher.index and bisher.loc[name].notna().all():
+            abstand[i] = _haversine_km(bisher.loc[name, 'Wohnort_Lat'], bisher.loc[name, 'Wohnort_Lon'],
+                                       k_lat[freie_standorte], k_lon[freie_standorte])
+    zeilen, spalten = linear_sum_assignment(abstand)
+    namen = fest_namen + [None] * len(freie_standorte)
+    for i, j in zip(zeilen, spalten):
+        namen[len(feste) + j] = freie_namen[i]
+
+    # Zuordnung aller Kunden zum nächsten Wohnort (vektorisiert über alle Standorte)
+    kunden_distanz = _haversine_km(k_lat[offen][:, None], k_lon[offen][:, None], lat[None, :], lon[None, :])
+    naechster = kunden_distanz.argmin(axis=0)
+    zuordnung = pd.Series(np.asarray(namen, dtype=object)[naechster], index=kunden.index, name='Vertreter_Name')
+    km = kunden_distanz[naechster, np.arange(len(lat))]
+
+    standorte = pd.DataFrame({
+        'Vertreter_Name': namen,
+        'Wohnort_Lat': k_lat[offen],
+        'Wohnort_Lon': k_lon[offen],
+        'Fest': [i < len(feste) for i in range(len(offen))],
+        'Kunden': np.bincount(naechster, minlength=len(offen)),
+        'Umsatz_2024': np.bincount(naechster, weights=umsatz, minlength=len(offen)),
+        'km_mittel': np.round(np.bincount(naechster, weights=km, minlength=len(offen))
+                              / np.maximum(np.bincount(naechster, minlength=len(offen)), 1), 1),
+    })
+    return StandortLoesung(standorte=standorte, zuordnung=zuordnung, kosten=kosten, starts=starts,
+                           dauer=time.perf_counter() - start)
+
+
+def als_szenario(dataframe, loesung):
+    """
+    Was-wäre-wenn-Szenario: jeder Kunde beim nächstgelegenen Wohnort, Wohnorte aus der Lösung.
+    Kunden ohne Koordinaten behalten ihren Vertreter.
+    """
+    szenario = dataframe.copy()
+    szenario.loc[loesung.zuordnung.index, 'Vertreter_Name'] = loesung.zuordnung
+    wohnorte = loesung.standorte.set_index('Vertreter_Name')
+    betroffen = szenario['Vertreter_Name'].isin(wohnorte.index)
+    szenario.loc[betroffen, 'Wohnort_Lat'] = szenario.loc[betroffen, 'Vertreter_Name'].map(wohnorte['Wohnort_Lat'])
+    szenario.loc[betroffen, 'Wohnort_Lon'] = szenario.loc[betroffen, 'Vertreter_Name'].map(wohnorte['Wohnort_Lon'])
+    return szenario
@@ -0,0 +1,212 @@
+# sync.py
+
+import time
+from dataclasses import dataclass, field
+
+import pandas as pd
+import numpy as np
+
+from src.geokodierung import fuelle_koordinaten
+
+NUMERISCHE_SPALTEN = ['Latitude', 'Longitude', 'Wohnort_Lat', 'Wohnort_Lon', 'Umsatz_2024', 'Kunden_Nr']
+KOORDINATEN_SPALTEN = ['Latitude', 'Longitude', 'Wohnort_Lat', 'Wohnort_Lon']
+
+
+@dataclass
+class SyncBericht:
+    """Beschreibt, was sich bei einer Synchronisation geändert hat."""
+    vollstaendig: bool = False
+    uebersprungen: bool = False
+    eingefuegt: list = field(default_factory=list)
+    geaendert: list = field(default_factory=list)
+    geloescht: list = field(default_factory=list)
+    vertreter_geaendert: list = field(default_factory=list)
+    # Alle Kunden_Nr, deren Zeilen im typisierten Frame neu berechnet oder entfernt wurden
+    betroffene_kunden: set = field(default_factory=set)
+    dauer: float = 0.0
+
+    @property
+    def hat_aenderungen(self):
+        return self.vollstaendig or bool(self.betroffene_kunden)
+
+    def zusammenfassung(self):
+        if self.vollstaendig:
+            return f"Vollständig geladen in {self.dauer:.1f}s"
+        if not self.hat_aenderungen:
+            return "Keine Änderungen"
+        return (f"+{len(self.eingefuegt)} neu, ~{len(self.geaendert)} geändert, "
+                f"-{len(self.geloescht)} gelöscht, {len(self.vertreter_geaendert)} Vertreter geändert "
+                f"({self.dauer:.1f}s)")
+
+
+def _fuehre_zusammen(kunden_df, vertreter_df):
+    """Ergänzt fehlende Koordinaten offline über PLZ/Ort (siehe geokodierung.py) und merged Kunden mit Vertretern."""
+    kunden_df = fuelle_koordinaten(kunden_df, 'Latitude', 'Longitude', 'PLZ', 'Ort', 'Koordinaten_Praezision')
+    vertreter_df = fuelle_koordinaten(vertreter_df, 'Wohnort_Lat', 'Wohnort_Lon',
+                                      'Wohnort_PLZ', 'Wohnort', 'Wohnort_Praezision')
+    return pd.merge(kunden_df, vertreter_df, on='Vertreter_Name', how='left')
+
+
+def _typisiere(df_merged):
+    """Typisiert die numerischen Spalten und entfernt Zeilen ohne Koordinaten (liefert eine Kopie)."""
+    df_merged = df_merged.copy()
+    for col in NUMERISCHE_SPALTEN:
+        if col in df_merged.columns:
+            df_merged[col] = pd.to_numeric(df_merged[col].replace('', np.nan), errors='coerce')
+
+    df_merged.dropna(subset=KOORDINATEN_SPALTEN, inplace=True)
+    return df_merged
+
+
+def bereite_basis_daten_auf(kunden_df, vertreter_df):
+    """
+    Führt Kunden- und Vertreterdaten zusammen, typisiert und entfernt Zeilen ohne Koordinaten.
+    Fehlende Koordinaten werden vorher offline über PLZ/Ort ergänzt (siehe geokodierung.py).
+    """
+    return _typisiere(_fuehre_zusammen(kunden_df, vertreter_df))
+
+
+def _roh_frame(werte):
+    """Baut aus get_all_values() einen String-DataFrame, indiziert über einen Hash pro Zeile."""
+    kopf, zeilen = werte[0], werte[1:]
+    # Zeilen auf Kopfbreite bringen (die API kürzt leere Zellen am Zeilenende)
+    breite = len(kopf)
+    zeilen = [(z + [''] * (breite - len(z)))[:breite] for z in zeilen]
+    df = pd.DataFrame(zeilen, columns=kopf, dtype=str)
+    # Komplett leere Zeilen ignorieren, wie get_all_records()
+    df = df[(df != '').any(axis=1)]
+
+    # Schlüssel = Inhalts-Hash + laufende Nummer, damit identische Zeilen unterscheidbar bleiben
+    zeilen_hash = pd.util.hash_pandas_object(df, index=False).astype(str)
+    vorkommen = zeilen_hash.groupby(zeilen_hash).cumcount().astype(str)
+    df.index = pd.Index(zeilen_hash + '-' + vorkommen, name='_zeile')
+    return df
+
+
+class InkrementellerSync:
+    """
+    Hält Kunden- und Vertreterdaten aktuell, ohne bei jeder Aktualisierung alles neu aufzubereiten.
+
+    - Unveränderte Spreadsheets (Drive-Metadaten `modifiedTime`) werden gar nicht abgerufen.
+    - Bei Änderungen werden geänderte Zeilen über einen Hash pro Zeile erkannt; nur diese
+      (bzw. die Kunden geänderter Vertreter) werden neu geokodiert und gemerged.
+    - Die Typisierung läuft danach über den gesamten gemergten Stand, damit das Ergebnis
+      (inklusive dtypes, z.B. int64 -> float64) exakt einem vollständigen Neuladen entspricht.
+
+    Beide Tabellen werden gleichzeitig abgeglichen.
+
+    Args:
+        sheets: SheetsClientPool (oder Objekt mit geaendert_um(name), alle_werte(name), parallel(auftraege))
+        kunden_sheet_name: Name der Kunden-Tabelle
+        vertreter_sheet_name: Name der Vertreter-Tabelle
+    """
+
+    def __init__(self, sheets, kunden_sheet_name, vertreter_sheet_name):
+        self._sheets = sheets
+        self._namen = {'kunden': kunden_sheet_name, 'vertreter': vertreter_sheet_name}
+        self._geaendert_um = {}
+        self._roh = {}
+        # Gemergter, noch nicht typisierter Stand (Index = Zeilenschlüssel der Kundentabelle)
+        self._gemerged = None
+        self._typisiert = None
+        self.ergebnis = None
+        self.letzter_bericht = None
+
+    def _hole_falls_geaendert(self, art):
+        """Gibt den neuen Roh-Frame zurück oder None, wenn sich das Spreadsheet nicht geändert hat."""
+        name = self._namen[art]
+        geaendert_um = self._sheets.geaendert_um(name)
+        if art in self._roh and self._geaendert_um.get(art) == geaendert_um:
+            return None
+        return geaendert_um, _roh_frame(self._sheets.alle_werte(name))
+
+    def synchronisiere(self):
+        """
+        Gleicht den Datenstand mit den Sheets ab.
+        Gibt den typisierten, nach Kunden_Nr sortierten DataFrame zurück. Ist nichts geändert,
+        wird exakt dasselbe Objekt wie beim letzten Aufruf geliefert.
+        """
+        start = time.time()
+        abrufe = self._sheets.parallel({art: (lambda art=art: self._hole_falls_geaendert(art)) for art in self._namen})
+        neu_kunden = abrufe['kunden'][1] if abrufe['kunden'] is not None else None
+        neu_vertreter = abrufe['vertreter'][1] if abrufe['vertreter'] is not None else None
+
+        if self._typisiert is None or self._kopf_geaendert(neu_kunden, neu_vertreter):
+            bericht = self._voll_laden(neu_kunden, neu_vertreter)
+        elif neu_kunden is None and neu_vertreter is None:
+            bericht = SyncBericht(uebersprungen=True)
+        else:
+            bericht = self._inkrementell(neu_kunden, neu_vertreter)
+
+        # Zeitstempel erst übernehmen, wenn Abruf und Verarbeitung erfolgreich waren
+        for art, abruf in abrufe.items():
+            if abruf is not None:
+                self._geaendert_um[art] = abruf[0]
+        bericht.dauer = time.time() - start
+        self.letzter_bericht = bericht
+        return self.ergebnis
+
+    def _kopf_geaendert(self, neu_kunden, neu_vertreter):
+        for art, neu in (('kunden', neu_kunden), ('vertreter', neu_vertreter)):
+            if neu is not None and list(neu.columns) != list(self._roh[art].columns):
+                return True
+        return False
+
+    def _voll_laden(self, neu_kunden, neu_vertreter):
+        # Beim Voll-Laden werden beide Tabellen benötigt
+        if neu_kunden is None:
+            neu_kunden = self._roh['kunden']
+        if neu_vertreter is None:
+            neu_vertreter = self._roh['vertreter']
+        self._roh = {'kunden': neu_kunden, 'vertreter': neu_vertreter}
+
+        self._gemerged = _fuehre_zusammen(neu_kunden.reset_index(), neu_vertreter).set_index('_zeile')
+        self._veroeffentliche()
+        return SyncBericht(vollstaendig=True)
+
+    def _inkrementell(self, neu_kunden, neu_vertreter):
+        bericht = SyncBericht()
+        alt_kunden = self._roh['kunden']
+        kunden = neu_kunden if neu_kunden is not None else alt_kunden
+        vertreter = neu_vertreter if neu_vertreter is not None else self._roh['vertreter']
+
+        # Kundenzeilen: Diff über die Zeilenschlüssel
+        hinzu = kunden.index.difference(alt_kunden.index)
+        weg = alt_kunden.index.difference(kunden.index)
+
+        # Vertreterzeilen: alle Kunden eines geänderten Vertreters müssen neu gemerged werden
+        if neu_vertreter is not None:
+            alt_vertreter = self._roh['vertreter']
+            v_hinzu = vertreter.index.difference(alt_vertreter.index)
+            v_weg = alt_vertreter.index.difference(vertreter.index)
+            betroffene_vertreter = set(vertreter.loc[v_hinzu, 'Vertreter_Name']) | set(alt_vertreter.loc[v_weg, 'Vertreter_Name'])
+            if betroffene_vertreter:
+                bericht.vertreter_geaendert = sorted(betroffene_vertreter)
+                betroffen = kunden.index[kunden['Vertreter_Name'].isin(betroffene_vertreter)]
+                hinzu = hinzu.union(betroffen)
+                weg = weg.union(betroffen.intersection(alt_kunden.index))
+
+        nr_hinzu = set(pd.to_numeric(kunden.loc[hinzu, 'Kunden_Nr'].replace('', np.nan), errors='coerce').dropna())
+        nr_weg = set(pd.to_numeric(alt_kunden.loc[weg, 'Kunden_Nr'].replace('', np.nan), errors='coerce').dropna())
+        bericht.eingefuegt = sorted(nr_hinzu - nr_weg)
+        bericht.geloescht = sorted(nr_weg - nr_hinzu)
+        bericht.geaendert = sorted(nr_hinzu & nr_weg)
+        bericht.betroffene_kunden = nr_hinzu | nr_weg
+
+        self._roh = {'kunden': kunden, 'vertreter': vertreter}
+        if len(hinzu) == 0 and len(weg) == 0:
+            return bericht
+
+        # Nur die betroffenen Zeilen neu geokodieren und mergen, Reihenfolge wie in der Tabelle
+        behalten = self._gemerged.drop(index=weg)
+        neue_zeilen = _fuehre_zusammen(kunden.loc[hinzu].reset_index(), vertreter).set_index('_zeile')
+        self._gemerged = pd.concat([behalten, neue_zeilen]).loc[kunden.index]
+        self._veroeffentliche()
+        return bericht
+
+    def _veroeffentliche(self):
+        # OPTIMIERT: to_numeric über den Gesamtstand kostet nur Millisekunden, ist aber unabhängig davon,
+        # welche Zeilen sich geändert haben (ein Teilframe würde dtypes falsch verengen oder erweitern)
+        self._typisiert = _typisiere(self._gemerged).sort_values('Kunden_Nr', kind='stable')
+        # Neues Objekt, damit bereits ausgelieferte Stände unverändert bleiben
+        self.ergebnis = self._typisiert.reset_index(drop=True)
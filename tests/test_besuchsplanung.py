@@ -0,0 +1,63 @@
+# test_besuchsplanung.py
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.besuchsplanung import plane_besuche, wohnorte_je_vertreter
+
+HAMBURG = (53.55, 10.0)
+MUENCHEN = (48.14, 11.58)
+
+
+@pytest.fixture
+def df_basis():
+    rng = np.random.default_rng(7)
+    zeilen = []
+    for vertreter, (lat, lon), start in (('A', HAMBURG, 1000), ('B', MUENCHEN, 2000)):
+        for i in range(60):
+            zeilen.append({
+                'Kunden_Nr': start + i,
+                'Vertreter_Name': vertreter,
+                'Latitude': lat + rng.uniform(-0.5, 0.5),
+                'Longitude': lon + rng.uniform(-0.5, 0.5),
+                'Umsatz_2024': float(rng.integers(100, 10000)),
+                'Wohnort_Lat': lat,
+                'Wohnort_Lon': lon,
+            })
+    return pd.DataFrame(zeilen)
+
+
+def _zeile(uebersicht, vertreter):
+    return uebersicht.set_index('Vertreter_Name').loc[vertreter]
+
+
+def test_wohnorte_je_vertreter(df_basis):
+    wohnorte = wohnorte_je_vertreter(df_basis)
+    assert tuple(wohnorte.loc['A']) == HAMBURG
+    assert tuple(wohnorte.loc['B']) == MUENCHEN
+
+
+def test_umverteilter_erster_kunde_aendert_wohnort_nicht(df_basis):
+    # Wie kunde_zuweisen: nur Vertreter_Name ändert sich, die Zeile trägt weiter den Wohnort von A
+    df_aktuell = df_basis.copy()
+    df_aktuell.loc[df_aktuell['Kunden_Nr'] == 1000, 'Vertreter_Name'] = 'B'
+    assert df_aktuell[df_aktuell['Vertreter_Name'] == 'B']['Kunden_Nr'].min() == 1000
+
+    uebersicht, _ = plane_besuche(df_aktuell, wohnorte=wohnorte_je_vertreter(df_basis))
+
+    # Erwartung: dieselbe Umverteilung mit korrektem Wohnort in der Zeile
+    korrigiert = df_aktuell.copy()
+    korrigiert.loc[korrigiert['Kunden_Nr'] == 1000, ['Wohnort_Lat', 'Wohnort_Lon']] = MUENCHEN
+    erwartet, _ = plane_besuche(korrigiert)
+
+    pd.testing.assert_series_equal(_zeile(uebersicht, 'B'), _zeile(erwartet, 'B'))
+    # Aus Hamburg geplant wäre das Münchner Gebiet deutlich länger unterwegs
+    aus_hamburg, _ = plane_besuche(df_aktuell)
+    assert _zeile(aus_hamburg, 'B')['km_pro_Jahr'] > 5 * _zeile(uebersicht, 'B')['km_pro_Jahr']
+
+
+def test_ohne_wohnorte_aus_unveraenderten_basisdaten(df_basis):
+    mit, _ = plane_besuche(df_basis, wohnorte=wohnorte_je_vertreter(df_basis))
+    ohne, _ = plane_besuche(df_basis)
+    pd.testing.assert_frame_equal(mit, ohne)
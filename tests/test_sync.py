@@ -0,0 +1,125 @@
+# test_sync.py
+
+import pandas as pd
+import pytest
+
+from src import geokodierung
+from src.sync import InkrementellerSync
+
+KUNDEN_KOPF = ['Kunden_Nr', 'Kunde_ID_Name', 'Vertreter_Name', 'Verlag', 'Latitude', 'Longitude', 'Umsatz_2024']
+VERTRETER_KOPF = ['Vertreter_Name', 'Wohnort_Lat', 'Wohnort_Lon']
+
+
+class FakeSheets:
+    """Minimaler Ersatz für den SheetsClientPool: Tabellen als Listen von Zeilen, Version je Änderung."""
+
+    def __init__(self, kunden, vertreter):
+        self.tabellen = {'kunden': [KUNDEN_KOPF] + kunden, 'vertreter': [VERTRETER_KOPF] + vertreter}
+        self.versionen = {'kunden': 1, 'vertreter': 1}
+
+    def setze(self, name, zeilen):
+        kopf = self.tabellen[name][0]
+        self.tabellen[name] = [kopf] + zeilen
+        self.versionen[name] += 1
+
+    def geaendert_um(self, name):
+        return self.versionen[name]
+
+    def alle_werte(self, name):
+        return [list(z) for z in self.tabellen[name]]
+
+    def parallel(self, auftraege):
+        return {schluessel: funktion() for schluessel, funktion in auftraege.items()}
+
+
+def _voll_geladen(sheets):
+    return InkrementellerSync(sheets, 'kunden', 'vertreter').synchronisiere()
+
+
+@pytest.fixture(autouse=True)
+def _ohne_geocache(tmp_path, monkeypatch):
+    monkeypatch.setattr(geokodierung, 'CACHE_PFAD', str(tmp_path / 'geocache.db'))
+    monkeypatch.setattr(geokodierung, 'ZENTROIDE_PFAD', str(tmp_path / 'fehlt.csv'))
+
+
+@pytest.fixture
+def sheets():
+    kunden = [
+        ['1', 'Kunde 1', 'Anna', 'A', '52.5', '13.4', '1000'],
+        ['2', 'Kunde 2', 'Anna', 'B', '48.1', '11.6', '2000'],
+        ['3', 'Kunde 3', 'Bert', 'A', '50.9', '6.9', '3000'],
+        ['4', 'Kunde 4', 'Bert', 'B', '', '', '4000'],
+    ]
+    vertreter = [['Anna', '52.0', '13.0'], ['Bert', '51.0', '7.0']]
+    return FakeSheets(kunden, vertreter)
+
+
+def _pruefe_wie_voll_geladen(sync, sheets):
+    inkrementell = sync.synchronisiere()
+    assert not sync.letzter_bericht.vollstaendig
+    pd.testing.assert_frame_equal(inkrementell, _voll_geladen(sheets))
+    return inkrementell
+
+
+def test_einfuegen(sheets):
+    sync = InkrementellerSync(sheets, 'kunden', 'vertreter')
+    sync.synchronisiere()
+    sheets.setze('kunden', sheets.tabellen['kunden'][1:] + [['0', 'Kunde 0', 'Bert', 'A', '53.5', '10.0', '500']])
+    ergebnis = _pruefe_wie_voll_geladen(sync, sheets)
+    assert sync.letzter_bericht.eingefuegt == [0]
+    assert list(ergebnis['Kunden_Nr']) == [0, 1, 2, 3]
+
+
+def test_aendern(sheets):
+    sync = InkrementellerSync(sheets, 'kunden', 'vertreter')
+    sync.synchronisiere()
+    zeilen = [list(z) for z in sheets.tabellen['kunden'][1:]]
+    zeilen[1][2] = 'Bert'
+    sheets.setze('kunden', zeilen)
+    _pruefe_wie_voll_geladen(sync, sheets)
+    assert sync.letzter_bericht.geaendert == [2]
+
+
+def test_loeschen(sheets):
+    sync = InkrementellerSync(sheets, 'kunden', 'vertreter')
+    sync.synchronisiere()
+    sheets.setze('kunden', sheets.tabellen['kunden'][2:])
+    _pruefe_wie_voll_geladen(sync, sheets)
+    assert sync.letzter_bericht.geloescht == [1]
+
+
+def test_vertreter_geaendert(sheets):
+    sync = InkrementellerSync(sheets, 'kunden', 'vertreter')
+    sync.synchronisiere()
+    sheets.setze('vertreter', [['Anna', '52.0', '13.0'], ['Bert', '50.5', '7.5']])
+    ergebnis = _pruefe_wie_voll_geladen(sync, sheets)
+    assert sync.letzter_bericht.vertreter_geaendert == ['Bert']
+    assert ergebnis.loc[ergebnis['Vertreter_Name'] == 'Bert', 'Wohnort_Lat'].tolist() == [50.5]
+
+
+def test_dtype_erweitert(sheets):
+    sync = InkrementellerSync(sheets, 'kunden', 'vertreter')
+    assert sync.synchronisiere()['Umsatz_2024'].dtype == 'int64'
+    zeilen = [list(z) for z in sheets.tabellen['kunden'][1:]]
+    zeilen[0][6] = '1234.56'
+    sheets.setze('kunden', zeilen)
+    ergebnis = _pruefe_wie_voll_geladen(sync, sheets)
+    assert ergebnis.loc[ergebnis['Kunden_Nr'] == 1, 'Umsatz_2024'].item() == 1234.56
+
+
+def test_dtype_verengt(sheets):
+    zeilen = [list(z) for z in sheets.tabellen['kunden'][1:]]
+    zeilen[0][6] = '1234.56'
+    sheets.setze('kunden', zeilen)
+    sync = InkrementellerSync(sheets, 'kunden', 'vertreter')
+    assert sync.synchronisiere()['Umsatz_2024'].dtype == 'float64'
+    # Die einzige Dezimalzahl verschwindet: ein Neuladen liefert wieder int64
+    sheets.setze('kunden', zeilen[1:])
+    assert _pruefe_wie_voll_geladen(sync, sheets)['Umsatz_2024'].dtype == 'int64'
+
+
+def test_unveraendert_liefert_dasselbe_objekt(sheets):
+    sync = InkrementellerSync(sheets, 'kunden', 'vertreter')
+    erstes = sync.synchronisiere()
+    assert sync.synchronisiere() is erstes
+    assert sync.letzter_bericht.uebersprungen